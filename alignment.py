@@ -0,0 +1,306 @@
+from json import dumps, loads
+import numpy as np
+from sklearn.cluster import KMeans
+
+## vote code of a country that has no vote recorded on a resolution, recorded votes are coded from 1 up
+MISSING_VOTE = 0
+
+## a country needs more votes than this alongside the reference in a year for that year to count towards its alignment
+MINIMUM_VOTES = 10
+
+## countries are split into this many clusters, the reference country's cluster are its allies
+CLUSTERS = 2
+CLUSTER_SEED = 0
+
+
+## this is a class to hold every vote as a dense countries x resolutions matrix of small integer codes
+## resolutions are ordered by year, so each year is a contiguous block of columns
+class VoteMatrix:
+
+    ## constructor for matrix
+    ## arguments:
+    ##      - countries: country names, one per row
+    ##      - years: year of each resolution, one per column, in ascending order
+    ##      - votes: int8 countries x resolutions matrix of vote codes
+    ##      - codes: vote to code dictionary
+    def __init__( self, countries, years, votes, codes ):
+        self.countries = list( countries )
+        self.index = { country: i for i, country in enumerate( self.countries ) }
+        self.years = np.asarray( years )
+        self.votes = votes
+        self.codes = codes
+
+        ## first column of each year, so a year range is a slice of columns
+        self.year_values, self.year_starts = np.unique( self.years, return_index = True )
+
+
+    ## function to get the columns of a range of years as a slice
+    ## arguments:
+    ##      - first: first year, defaults to the earliest
+    ##      - last: last year included, defaults to the latest
+    def columns( self, first = None, last = None ):
+
+        start = 0 if first is None else np.searchsorted( self.years, int( first ), side = 'left' )
+        end = len( self.years ) if last is None else np.searchsorted( self.years, int( last ), side = 'right' )
+
+        return slice( start, end )
+
+
+    ## function to get the years in a range along with where each one starts relative to the range
+    ## arguments:
+    ##      - first: first year, defaults to the earliest
+    ##      - last: last year included, defaults to the latest
+    def year_blocks( self, first = None, last = None ):
+
+        columns = self.columns( first, last )
+        keep = ( self.year_starts >= columns.start ) & ( self.year_starts < columns.stop )
+
+        return self.year_values[ keep ], self.year_starts[ keep ] - columns.start
+
+
+    ## function to count, for every country and year, the resolutions it voted on alongside a reference country and how many of those votes matched
+    ## returns ( years, agreed, total ) where agreed and total are countries x years
+    ## arguments:
+    ##      - reference: name of the reference country
+    ##      - first: first year, defaults to the earliest
+    ##      - last: last year included, defaults to the latest
+    def agreement( self, reference, first = None, last = None ):
+
+        votes = self.votes[ :, self.columns( first, last ) ]
+        years, starts = self.year_blocks( first, last )
+
+        if not len( years ):
+            return years, np.zeros( ( len( self.countries ), 0 ), np.int64 ), np.zeros( ( len( self.countries ), 0 ), np.int64 )
+
+        reference = votes[ self.index[ reference ] ]
+        both = ( votes != MISSING_VOTE ) & ( reference != MISSING_VOTE )
+        agreed = both & ( votes == reference )
+
+        return years, np.add.reduceat( agreed, starts, axis = 1, dtype = np.int64 ), np.add.reduceat( both, starts, axis = 1, dtype = np.int64 )
+
+
+    ## function to rank countries by how often they vote with a reference country, returns ( country, rate ) pairs, highest first
+    ## a year only counts for a country if it voted more than minimum times alongside the reference and agreed at least once
+    ## arguments:
+    ##      - reference: name of the reference country
+    ##      - first: first year, defaults to the earliest
+    ##      - last: last year included, defaults to the latest
+    ##      - minimum: votes a country needs in a year for the year to count
+    def alignment( self, reference, first = None, last = None, minimum = MINIMUM_VOTES ):
+
+        _, agreed, total = self.agreement( reference, first, last )
+
+        counted = ( total > minimum ) & ( agreed > 0 )
+        agreed = np.where( counted, agreed, 0 ).sum( axis = 1 )
+        total = np.where( counted, total, 0 ).sum( axis = 1 )
+
+        ranked = [ ( country, agreed[ i ] / total[ i ] ) for i, country in enumerate( self.countries ) if total[ i ] and country != reference ]
+
+        return sorted( ranked, key = lambda el: ( -el[ 1 ], el[ 0 ] ) )
+
+
+    ## function to count agreements between every pair of countries, one countries x countries matrix per year
+    ## returns ( years, agreed, total ) where agreed and total are years x countries x countries
+    ## arguments:
+    ##      - first: first year, defaults to the earliest
+    ##      - last: last year included, defaults to the latest
+    def pairwise( self, first = None, last = None ):
+
+        votes = self.votes[ :, self.columns( first, last ) ]
+        years, starts = self.year_blocks( first, last )
+        ends = np.append( starts[ 1 : ], votes.shape[ 1 ] )
+
+        ## one indicator matrix per vote, agreeing on a vote is then a matrix product, float32 counts stay exact
+        present = ( votes != MISSING_VOTE ).astype( np.float32 )
+        indicators = [ ( votes == code ).astype( np.float32 ) for code in self.codes.values() ]
+
+        agreed = np.zeros( ( len( years ), len( self.countries ), len( self.countries ) ), np.int64 )
+        total = np.zeros( ( len( years ), len( self.countries ), len( self.countries ) ), np.int64 )
+
+        for y, ( start, end ) in enumerate( zip( starts, ends ) ):
+            total[ y ] = present[ :, start : end ] @ present[ :, start : end ].T
+            for indicator in indicators:
+                agreed[ y ] += ( indicator[ :, start : end ] @ indicator[ :, start : end ].T ).astype( np.int64 )
+
+        return years, agreed, total
+
+
+    ## function to get the rate at which every pair of countries agree over a range of years, nan where they never voted together
+    ## arguments:
+    ##      - first: first year, defaults to the earliest
+    ##      - last: last year included, defaults to the latest
+    def pairwise_rates( self, first = None, last = None ):
+
+        _, agreed, total = self.pairwise( first, last )
+        agreed, total = agreed.sum( axis = 0 ), total.sum( axis = 0 )
+
+        with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+            return np.where( total > 0, agreed / np.maximum( total, 1 ), np.nan )
+
+
+## function to load the votes in the database into a VoteMatrix
+## every resolution's votes are a row of bytes indexed by country code, so they are read straight into the matrix
+## arguments:
+##      - db: sqlite connection holding RESOLUTION_VOTES, the CANONICAL_COUNTRIES it is coded against and VOTE_CODES
+##      - years: optional years to load, defaults to every year
+def load_vote_matrix( db, years = None ):
+
+    if years is None:
+        rows = db.execute( '''SELECT YEAR, VOTES FROM RESOLUTION_VOTES ORDER BY YEAR, RESOLUTION_ID''' ).fetchall()
+    else:
+        years = [ int( year ) for year in years ]
+        rows = db.execute( f'''
+            SELECT YEAR, VOTES FROM RESOLUTION_VOTES WHERE YEAR IN ( {','.join( '?' * len( years ) )} ) ORDER BY YEAR, RESOLUTION_ID
+        ''', years ).fetchall()
+
+    if not rows:
+        return VoteMatrix( [], [], np.zeros( ( 0, 0 ), np.int8 ), {} )
+
+    years, packed = zip( *rows )
+
+    ## rows stop at the last country that voted, so shorter ones are padded out with missing votes
+    width = max( len( votes ) for votes in packed )
+    matrix = np.frombuffer( b''.join( votes.ljust( width, bytes( [ MISSING_VOTE ] ) ) for votes in packed ), np.int8 ).reshape( len( packed ), width ).T
+
+    ## only countries that voted in the years loaded are kept, ordered by name, votes loaded against a country CountryIndex
+    ## has since turned back into an unresolved spelling are left out
+    names = dict( db.execute( '''SELECT COUNTRY_ID, COUNTRY FROM CANONICAL_COUNTRIES''' ) )
+    voted = sorted( ( names[ country_id ], country_id ) for country_id in np.flatnonzero( ( matrix != MISSING_VOTE ).any( axis = 1 ) ).tolist() if country_id in names )
+    codes = dict( db.execute( '''SELECT VOTE, VOTE_ID FROM VOTE_CODES ORDER BY VOTE_ID''' ) )
+
+    return VoteMatrix( [ name for name, _ in voted ], np.array( years, np.int64 ), matrix[ [ country_id for _, country_id in voted ] ], codes )
+
+
+## this is a class to keep every year's country x country agreement counts in the database, so they are only worked out once
+## each year is a row holding its countries and two int32 matrices, so summing any range of years only reads a few small blobs
+## classes for any reference country and range of years are then worked out from the stored counts without touching the votes
+class AlignmentStore:
+
+    ## constructor for store
+    ## arguments:
+    ##      - db: sqlite connection the counts are kept in
+    def __init__( self, db ):
+        self.db = db
+
+        self.db.execute( '''
+            CREATE TABLE IF NOT EXISTS YEAR_AGREEMENT
+            (
+                YEAR INT PRIMARY KEY
+                , COUNTRIES TEXT
+                , AGREED BLOB
+                , TOTAL BLOB
+            )
+        ''' )
+
+
+    ## function to get the years the store holds counts for
+    def years( self ):
+
+        return [ str( row[ 0 ] ) for row in self.db.execute( '''SELECT YEAR FROM YEAR_AGREEMENT ORDER BY YEAR''' ) ]
+
+
+    ## function to work out and store the counts of some years, replacing what was stored for them
+    ## arguments:
+    ##      - matrix: VoteMatrix holding at least the years
+    ##      - years: years to store
+    def update_years( self, matrix, years ):
+
+        for year in years:
+
+            self.drop_years( [ year ] )
+            _, agreed, total = matrix.pairwise( year, year )
+
+            if not len( total ):
+                continue
+
+            ## only countries that voted that year are kept
+            keep = np.diagonal( total[ 0 ] ) > 0
+            countries = [ country for country, kept in zip( matrix.countries, keep ) if kept ]
+
+            self.db.execute( '''
+                INSERT INTO YEAR_AGREEMENT ( YEAR, COUNTRIES, AGREED, TOTAL ) VALUES ( ?, ?, ?, ? )
+            ''', ( int( year ), dumps( countries ), agreed[ 0 ][ np.ix_( keep, keep ) ].astype( '<i4' ).tobytes(), total[ 0 ][ np.ix_( keep, keep ) ].astype( '<i4' ).tobytes() ) )
+
+
+    ## function to remove the counts of some years
+    ## arguments:
+    ##      - years: years to remove
+    def drop_years( self, years ):
+
+        self.db.executemany( '''DELETE FROM YEAR_AGREEMENT WHERE YEAR = ?''', [ ( int( year ), ) for year in years ] )
+
+
+    ## function to add up the stored counts over a range of years, returns ( countries, agreed, total ) with country x country matrices
+    ## arguments:
+    ##      - first: first year, defaults to the earliest
+    ##      - last: last year included, defaults to the latest
+    def agreement( self, first = None, last = None ):
+
+        rows = self.db.execute( '''
+            SELECT COUNTRIES, AGREED, TOTAL
+            FROM YEAR_AGREEMENT
+            WHERE YEAR >= COALESCE( ?, YEAR ) AND YEAR <= COALESCE( ?, YEAR )
+        ''', ( first and int( first ), last and int( last ) ) ).fetchall()
+
+        rows = [ ( loads( countries ), agreed, total ) for countries, agreed, total in rows ]
+        names = sorted( set( country for countries, _, _ in rows for country in countries ) )
+        index = { name: i for i, name in enumerate( names ) }
+
+        agreed = np.zeros( ( len( names ), len( names ) ), np.int64 )
+        total = np.zeros( ( len( names ), len( names ) ), np.int64 )
+
+        ## each year's matrix is added into the rows and columns of its countries
+        for countries, year_agreed, year_total in rows:
+            position = np.ix_( [ index[ country ] for country in countries ], [ index[ country ] for country in countries ] )
+            agreed[ position ] += np.frombuffer( year_agreed, '<i4' ).reshape( len( countries ), len( countries ) )
+            total[ position ] += np.frombuffer( year_total, '<i4' ).reshape( len( countries ), len( countries ) )
+
+        return names, agreed, total
+
+
+    ## function to cluster countries by their agreement with every other country over a range of years, returns a country to cluster dictionary
+    ## each country is described by its row of agreement rates, pairs that never voted together take the average rate of the other country
+    ## arguments:
+    ##      - first: first year, defaults to the earliest
+    ##      - last: last year included, defaults to the latest
+    ##      - clusters: number of clusters
+    ##      - minimum: votes a country needs over the range to be clustered
+    def clusters( self, first = None, last = None, clusters = CLUSTERS, minimum = MINIMUM_VOTES ):
+
+        countries, agreed, total = self.agreement( first, last )
+
+        ## countries with too few votes to say anything about are left out
+        keep = np.diagonal( total ) > minimum
+        countries = [ country for country, kept in zip( countries, keep ) if kept ]
+        agreed, total = agreed[ np.ix_( keep, keep ) ], total[ np.ix_( keep, keep ) ]
+
+        if len( countries ) < clusters:
+            return { country: 0 for country in countries }
+
+        with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+            rates = np.where( total > 0, agreed / np.maximum( total, 1 ), np.nan )
+
+        rates = np.where( np.isnan( rates ), np.nanmean( rates, axis = 0 ), rates )
+        labels = KMeans( n_clusters = clusters, n_init = 10, random_state = CLUSTER_SEED ).fit_predict( rates )
+
+        return dict( zip( countries, labels.tolist() ) )
+
+
+    ## function to classify countries as allies of a reference country or opposed to it over a range of years
+    ## allies are the countries clustered with the reference, returns a country to class dictionary
+    ## arguments:
+    ##      - reference: name of the reference country
+    ##      - first: first year, defaults to the earliest
+    ##      - last: last year included, defaults to the latest
+    ##      - clusters: optional country to cluster dictionary already worked out for the range
+    def classes( self, reference, first = None, last = None, clusters = None ):
+
+        ## an empty clustering passed in is kept as it is rather than worked out again
+        if clusters is None:
+            clusters = self.clusters( first, last )
+
+        if reference not in clusters:
+            span = f"between {'the earliest year' if first is None else first} and {'the latest year' if last is None else last}"
+            raise KeyError( f'{reference} did not vote enough {span} to be clustered' )
+
+        return { country: 'ALLY' if cluster == clusters[ reference ] else 'OPPOSED' for country, cluster in clusters.items() if country != reference }
@@ -1,19 +1,13 @@
-from pandas import concat, DataFrame, read_csv
+from features import FeatureStore
+from grid_search import GridSearch, RESULTS_FILENAME, summarize
+from pandas import concat, DataFrame
+from preprocessor import ParallelPreprocessor, PreprocessedCache
 from sqlite3 import connect, OperationalError
 
 import numpy as np
-from nltk.tokenize import word_tokenize
-from nltk import pos_tag
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
 from sklearn.preprocessing import LabelEncoder
-from collections import defaultdict
-from nltk.corpus import wordnet as wn
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn import model_selection, naive_bayes, svm
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
-from pathlib import Path  
-from itertools import product
+from sklearn import svm
+from time import perf_counter
 
 
 ## some contants
@@ -24,93 +18,56 @@ db = connect( DB_FILENAME )
 cursor = db.cursor()
 
 ## PULLING OUR DATA FOR RUNNING OUR MACHINE LEARNING
-"""
+## reports and statuses are joined on the canonical country id, however each source spelled the country
 query = '''
-SELECT DISTINCT a.DOCID, LOWER( a.FORMATTED ), b.STATUS AS CLASS
+SELECT DISTINCT a.DOCID, a.RAWTEXT, b.STATUS AS CLASS
 FROM YEAR_COUNTRY_SECTION_RAWTEXT a
 INNER JOIN COUNTRY_STATUS b
-ON a.COUNTRY = b.COUNTRY
+ON a.COUNTRY_ID = b.COUNTRY_ID
 '''
 
 ## we now loop over our results and assign classes based on what we see
 results = cursor.execute( query ).fetchall()
+df = DataFrame( results, columns = [ 'DOCID', 'RAWTEXT', 'CLASS' ] )
 
-## text processing is based on guide posted here: https://medium.com/@bedigunjit/simple-guide-to-text-classification-nlp-using-svm-and-naive-bayes-with-python-421db3a72d34
-df = DataFrame( results, columns = [ 'DOCID', 'TEXT', 'CLASS' ] )
-print( df )
-
-## tokenization step
-df[ 'TEXT' ].dropna( inplace = True )
-df[ 'TEXT' ] = [ word_tokenize( e ) for e in df[ 'TEXT' ] ]
-
-tag_map = defaultdict( lambda : wn.NOUN )
-tag_map[ 'J' ] = wn.ADJ
-tag_map[ 'V' ] = wn.VERB
-tag_map[ 'R' ] = wn.ADV
-
-for index, entry in enumerate( df[ 'TEXT' ] ):
-
-    words = []
-    word_lemmatizer = WordNetLemmatizer()
-
-    for word, tag in pos_tag( entry ):
-
-        if word not in stopwords.words( 'english' ) and word.isalpha():
-            words.append( word_lemmatizer.lemmatize( word, tag_map[ tag[ 0 ] ] ) )
-
-    df.loc[ index, 'TEXT_FINAL' ] = " ".join( words )
+## sections are preprocessed through the same cache the report processor fills, so text it has seen is not lemmatized again
+preprocessor = ParallelPreprocessor( cache = PreprocessedCache() )
+df[ 'TEXT_FINAL' ] = preprocessor.process_all( list( df[ 'RAWTEXT' ] ) )
+print( f'Preprocessed text cache: {preprocessor.cache.statistics()}' )
+preprocessor.close()
 
+## sections with no text left after preprocessing are dropped
+df = df.drop( 'RAWTEXT', axis = 1 )
+df = df[ df[ 'TEXT_FINAL' ] != '' ].reset_index( drop = True )
 
-filepath = Path( 'processed/tokenized.csv' )
-df = df.drop( 'TEXT', axis=1 )
-df.to_csv( filepath )
-"""
-
-## loading from csv file... this is updated to be able to just read from our db
-df = read_csv( 'processed/tokenized.csv' )
-df.dropna( inplace = True )
-
-## do some initial transforms
-train_x, test_x, train_y, test_y = model_selection.train_test_split( df[ [ 'DOCID',  'TEXT_FINAL' ] ], df[ 'CLASS' ], test_size = .3 )
+## the text is tokenized and counted once, and the counts saved, every TF-IDF matrix of the grid search is worked out from them
+features = FeatureStore()
+print( f"Term counts: {'loaded' if features.build( list( df[ 'TEXT_FINAL' ] ) ) else 'counted'}, {features.counts.shape[ 0 ]} documents x {features.counts.shape[ 1 ]} terms" )
 
+## classes are encoded once, every setting is scored on the same folds of the whole corpus
 encoder = LabelEncoder()
-train_y = encoder.fit_transform( train_y )
-test_y = encoder.fit_transform( test_y )
+labels = encoder.fit_transform( df[ 'CLASS' ] )
 
-## here we keep track of hyperparameters
+## here we keep track of hyperparameters, every combination is scored
+## alpha starts above 0, without smoothing a term a class never saw has a log probability of -inf in that class
 hyperparameters = {
-    'max_features': [ 100000 ] # this is max features
-    , 'alpha': [ 0 ]
+    'max_features': [ 1000, 2000, 5000, 10000, 20000, 50000, 100000, None ] # this is max features
+    , 'alpha': np.logspace( -3, 1, 25 ).tolist()
 }
 
-## grid search!
-accuracy = "accuracy,max_features,alpha\n"
-combinations = product( *hyperparameters.values() )
-
-for instance in combinations:
-
-    args = dict( zip( hyperparameters.keys(), instance ) )
-
-    print( f'Hyperparameters: {args} ...' )
-
-    tfidf = TfidfVectorizer( max_features = args[ 'max_features' ] )
-    tfidf.fit( df[ 'TEXT_FINAL' ] )
-    train_x_tfidf = tfidf.transform( train_x[ 'TEXT_FINAL' ] )
-    test_x_tfidf = tfidf.transform( test_x[ 'TEXT_FINAL' ] )
-
-    nb = naive_bayes.MultinomialNB()
-    nb.set_params( alpha = args[ 'alpha' ] )
-    nb.fit( train_x_tfidf, train_y )
+## grid search! settings are scored across a pool of worker processes sharing the term counts, every fit is kept with its timing
+search = GridSearch( features, labels )
+start = perf_counter()
+results = search.run( hyperparameters )
+print( f'Grid search: {len( results )} fits of {len( results ) // len( search.folds )} settings on {len( search.folds )} folds in {perf_counter() - start:.2f}s, written to {RESULTS_FILENAME}' )
 
-    predictions = nb.predict( test_x_tfidf )
-    score = accuracy_score( test_y, predictions )
-    accuracy = accuracy + f"{score},{args[ 'max_features' ]},{args[ 'alpha' ]}\n"
-    print( f"Naive Bayes Accuracy Score -> {score * 100}" )
+summary = summarize( results )
+print( summary.head( 10 ).to_string( index = False ) )
 
-    recall = recall_score( test_y, predictions )
-    precision = precision_score( test_y, predictions )
-    f1 = f1_score( test_y, predictions )
-    print( f'Recall: {recall}, Precision: {precision}, F1 Score: {f1}' )
+## the best setting is the first row, read a column at a time so max_features keeps its type
+best = { column: summary.loc[ 0, column ] for column in summary.columns }
+print( f"Naive Bayes Accuracy Score -> {best[ 'accuracy' ] * 100} with max_features {best[ 'max_features' ]}, alpha {best[ 'alpha' ]}" )
+print( f"Recall: {best[ 'recall' ]}, Precision: {best[ 'precision' ]}, F1 Score: {best[ 'f1' ]}" )
 
 
 """
@@ -0,0 +1,95 @@
+from alignment import load_vote_matrix
+from sqlite3 import connect
+from sys import argv
+from time import perf_counter
+
+## benchmark comparing the original SQL alignment query against the vectorised vote matrix
+## usage: python bench_alignment.py [ database ], defaults to the database un_processor.py builds
+DB_FILENAME = argv[ 1 ] if len( argv ) > 1 else 'processed/model.db'
+REFERENCE = 'UNITED STATES'
+
+## original query, it can only rank countries against the US
+LEGACY_QUERY = '''
+    WITH cte_USVotes AS
+    (
+        SELECT
+            YEAR
+            , RESOLUTION_ID
+            , VOTE
+        FROM YEAR_RESOLUTION_COUNTRY_VOTES
+        WHERE COUNTRY = 'UNITED STATES'
+    )
+    , cte_TotalVotes AS
+    (
+        SELECT
+            v.YEAR
+            , v.COUNTRY
+            , COUNT( v.COUNTRY ) AS N_VOTES
+        FROM YEAR_RESOLUTION_COUNTRY_VOTES v
+        INNER JOIN cte_USVotes us
+            ON us.RESOLUTION_ID = v.RESOLUTION_ID
+            AND us.YEAR = v.YEAR
+        GROUP BY v.YEAR
+            , v.COUNTRY
+        HAVING COUNT( v.COUNTRY ) > 10
+    )
+    , cte_Alignment AS
+    (
+        SELECT
+            r.YEAR
+            , r.COUNTRY
+            , COUNT( r.VOTE ) AS ALIGNMENT
+        FROM YEAR_RESOLUTION_COUNTRY_VOTES r
+        INNER JOIN cte_USVotes c
+            ON c.YEAR = r.YEAR
+            AND c.RESOLUTION_ID = r.RESOLUTION_ID
+            AND c.VOTE = r.VOTE
+        GROUP BY r.YEAR
+            , r.COUNTRY
+    )
+    SELECT
+        a.COUNTRY
+        , SUM( ALIGNMENT ) * 1.0 / SUM( N_VOTES ) AS VOTING_PERCENTAGE
+    FROM cte_Alignment a
+    INNER JOIN cte_TotalVotes v
+        ON a.YEAR = v.YEAR
+        AND a.COUNTRY = v.COUNTRY
+    WHERE a.COUNTRY <> 'UNITED STATES'
+    GROUP BY a.COUNTRY
+    ORDER BY SUM( ALIGNMENT ) * 1.0 / SUM( N_VOTES ) DESC
+'''
+
+
+db = connect( DB_FILENAME )
+
+## votes are stored packed, so the query runs on a temporary vote per row copy of them, which shadows the view of the same name
+start = perf_counter()
+db.execute( '''CREATE TEMP TABLE YEAR_RESOLUTION_COUNTRY_VOTES AS SELECT * FROM main.YEAR_RESOLUTION_COUNTRY_VOTES''' )
+unpack_seconds = perf_counter() - start
+
+start = perf_counter()
+legacy = db.execute( LEGACY_QUERY ).fetchall()
+sql_seconds = perf_counter() - start
+
+start = perf_counter()
+matrix = load_vote_matrix( db )
+load_seconds = perf_counter() - start
+
+start = perf_counter()
+ranked = matrix.alignment( REFERENCE )
+reference_seconds = perf_counter() - start
+
+start = perf_counter()
+rates = matrix.pairwise_rates()
+pairwise_seconds = perf_counter() - start
+
+## the query leaves ties in no particular order, so we compare the rates country by country
+agree = dict( legacy ) == dict( ranked )
+
+print( f'Votes: {len( matrix.countries )} countries x {len( matrix.years )} resolutions over {len( matrix.year_values )} years' )
+print( f'Rankings agree: {agree}' )
+print( f'Unpack votes into rows:           {unpack_seconds * 1000:8.1f} ms' )
+print( f'SQL query, {REFERENCE} only:      {sql_seconds * 1000:8.1f} ms' )
+print( f'Load vote matrix:                 {load_seconds * 1000:8.1f} ms' )
+print( f'Matrix, {REFERENCE} only:         {reference_seconds * 1000:8.1f} ms ({sql_seconds / reference_seconds:.0f}x)' )
+print( f'Matrix, all {len( matrix.countries )} references at once: {pairwise_seconds * 1000:8.1f} ms' )
@@ -0,0 +1,168 @@
+from bs4 import BeautifulSoup
+from constants import CACHE_CONFIG
+from extractors import VOTE_PATTERN_REGEX, parse_hr_index, parse_hr_report, parse_un_record, parse_un_search
+from glob import glob
+from json import load
+from re import DOTALL, findall
+from time import perf_counter
+
+## benchmark comparing the original BeautifulSoup + regex parsing against the streaming extractors
+## pages are taken from the crawlers' response cache, kinds of page the cache has none of are measured on the saved
+## pages in fixtures/ instead, so the comparison runs without crawling first
+LINK_REGEX = '<a class="moreinfo" href="/record/(.*?)">'
+TITLE_DIV_REGEX = '<div class="full-record-title">(.*?)</div>'
+VOTE_DIV_REGEX = r'\A<div class="metadata-row"><span class="title col-xs-12 col-sm-3 col-md-2">Vote[^\w][^\w]'
+HR_LINK_REGEX = '"({prefix}.*?)"'
+SECTION_REGEX = '<section class=".*?content">(.*?)</section>'
+SUBTITLE_REGEX = '<h3.*?>(.*?)</h3>'
+TEXT_REGEX = '<p>(.*?)</p>'
+HR_PREFIX = 'https://www.state.gov/reports/'
+ROUNDS = 3
+FIXTURES_DIRECTORY = 'fixtures'
+FIXTURE_INDEX_URL = 'https://www.state.gov/reports/2019-country-reports-on-human-rights-practices/'
+
+## a fixture page is parsed this many times a round, a single small page is too quick to time on its own
+FIXTURE_REPEATS = 50
+
+
+## original parsing of a UN search results page
+## arguments:
+##      - html: contents of the page
+def legacy_un_search( html ):
+
+    soup = BeautifulSoup( html, 'html.parser' )
+    pages = []
+
+    for section in soup.find_all( 'a' ):
+        tsection = findall( LINK_REGEX, str( section ), flags = DOTALL )
+        if tsection:
+            pages.append( tsection[ 0 ] )
+
+    return pages
+
+
+## original parsing of a UN record page
+## arguments:
+##      - html: contents of the page
+def legacy_un_record( html ):
+
+    soup = BeautifulSoup( html, 'html.parser' )
+    title, votes = None, None
+
+    for el in soup.find_all( 'div' ):
+        if findall( TITLE_DIV_REGEX, str( el ), flags = DOTALL ):
+            title = str( el )
+        if findall( VOTE_DIV_REGEX, str( el ), flags = DOTALL ):
+            votes = str( el )
+
+    title = findall( TITLE_DIV_REGEX, title, flags = DOTALL )[ 0 ].strip() if title else None
+    votes = findall( VOTE_PATTERN_REGEX, votes or '', flags = DOTALL )
+
+    return title, dict( [ ( el2, el1 ) for el1, el2 in votes ] )
+
+
+## original parsing of the human rights report index
+## arguments:
+##      - html: contents of the page
+##      - prefix: url prefix of the country reports
+def legacy_hr_index( html, prefix ):
+
+    soup = BeautifulSoup( html, 'html.parser' )
+    urls = [ findall( HR_LINK_REGEX.format( prefix = prefix ), str( el ), flags = DOTALL ) for el in soup.find_all( 'a' ) ]
+
+    return set( [ el[ 0 ] for el in urls if el ] )
+
+
+## original parsing of a human rights country report
+## arguments:
+##      - html: contents of the page
+def legacy_hr_report( html ):
+
+    soup = BeautifulSoup( html, 'html.parser' )
+    article = {}
+
+    for section in soup.find_all( 'section' ):
+
+        section = str( section )
+        if not findall( SECTION_REGEX, section, flags = DOTALL ):
+            continue
+
+        subtitles = list( findall( SUBTITLE_REGEX, section, flags = DOTALL ) )
+        if len( subtitles ) != 1:
+            continue
+
+        article[ subtitles[ 0 ] ] = " ".join( findall( TEXT_REGEX, section, flags = DOTALL ) )
+
+    return article
+
+
+## function to time a parser over a set of pages, returns the best seconds per page
+## arguments:
+##      - parser: callable taking the contents of a page
+##      - pages: contents of the pages
+def seconds_per_page( parser, pages ):
+
+    best = None
+
+    for _ in range( ROUNDS ):
+        start = perf_counter()
+        for page in pages:
+            parser( page )
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min( best, elapsed )
+
+    return best / len( pages )
+
+
+## we sort the cached pages by the kind of page they are
+kinds = { 'un_search': [], 'un_record': [], 'hr_index': [], 'hr_report': [] }
+
+for filename in glob( f"{CACHE_CONFIG[ 'directory' ]}/*/*.json" ):
+
+    with open( filename, 'r' ) as fh:
+        url = load( fh )[ 'url' ]
+
+    with open( filename[ : -5 ] + '.body', 'rb' ) as fh:
+        page = fh.read().decode( 'utf-8' )
+
+    if 'digitallibrary.un.org/search' in url:
+        kinds[ 'un_search' ].append( page )
+    elif 'digitallibrary.un.org/record/' in url:
+        kinds[ 'un_record' ].append( page )
+    elif url.startswith( HR_PREFIX ) and url.rstrip( '/' ).endswith( 'human-rights-practices' ):
+        kinds[ 'hr_index' ].append( ( page, url ) )
+    elif url.startswith( HR_PREFIX ):
+        kinds[ 'hr_report' ].append( page )
+
+## kinds of page missing from the cache fall back to the fixture page of that kind
+for kind, pages in kinds.items():
+
+    if pages:
+        continue
+
+    with open( f'{FIXTURES_DIRECTORY}/{kind}.html', 'rb' ) as fh:
+        page = fh.read().decode( 'utf-8' )
+
+    pages.extend( [ ( page, FIXTURE_INDEX_URL ) if kind == 'hr_index' else page ] * FIXTURE_REPEATS )
+
+parsers = {
+    'un_search': ( legacy_un_search, parse_un_search )
+    , 'un_record': ( legacy_un_record, parse_un_record )
+    , 'hr_index': ( lambda page: legacy_hr_index( *page ), lambda page: parse_hr_index( *page ) )
+    , 'hr_report': ( legacy_hr_report, parse_hr_report )
+}
+
+for kind, pages in kinds.items():
+
+    legacy, streaming = parsers[ kind ]
+
+    ## report pages keep text rather than inner html now, so for those we only compare which sections were found
+    if kind == 'hr_report':
+        agree = sum( len( legacy( page ) ) == len( streaming( page ) ) for page in pages )
+    else:
+        agree = sum( legacy( page ) == streaming( page ) for page in pages )
+
+    before = seconds_per_page( legacy, pages )
+    after = seconds_per_page( streaming, pages )
+
+    print( f'{kind}: {len( pages )} pages, {agree} agree, {before * 1000:.2f} ms -> {after * 1000:.2f} ms per page ({before / after:.1f}x)' )
@@ -0,0 +1,138 @@
+from glob import glob
+from json import load
+from re import findall, match, sub
+from time import perf_counter
+from utilities import IRAdvancedTermProcessor, M0, M1
+
+## micro-benchmark comparing the original porter's implementation against the compiled, cached stemmer
+## the token stream is every word found in the raw json files, so repeated tokens are kept on purpose
+RAW_GLOB = 'raw/*/*.json'
+ROUNDS = 3
+
+
+## original implementation of the first step of porter's, kept here as a reference for output and speed
+## arguments:
+##      - token: token to be stemmed
+def legacy_porters( token ):
+
+    m = 0
+    if match( M0, token ):
+        m = 0
+    elif match( M1, token ):
+        m = 1
+    else:
+        m = 2
+
+
+    ## step 1a
+    if match( r"(\w+?)sses$", token ):
+        token = sub( r"(\w+?)sses$", r"\g<1>ss", token )
+
+    elif match( r"(\w+?)ies$", token ):
+        token = sub( r"(\w+?)ies$", r"\g<1>i", token )
+
+    else:
+        token = sub( r"(\w+?[^aiou])s$", r"\g<1>", token )
+
+    ## step 1b
+    if m > 0:
+        token = sub( r"(\w+?)eed$", r"\g<1>ee", token )
+
+    elif match( r"(.*?[aeiou].*?)ed", token ):
+
+        token = sub( r"(.*?[aeiou].*?)ed", r"\g<1>", token )
+
+        if match( r"(.*?)at", token ):
+            token = sub( r"(.*?)at", r"\g<1>ate", token )
+
+        elif match( r"(.*?)bl", token ):
+            token = sub( r"(.*?)bl", r"\g<1>ble", token )
+
+        elif match( r"(.*?)iz", token ):
+            token = sub( r"(.*?)iz", r"\g<1>ize", token )
+
+        ## double same consonant ending check
+        elif token[ -1 ] == token[ -2 ] and token[ -1 ] not in ( 'l', 's', 'z' ):
+            token = token[ : -1 ]
+
+        elif m == 1 and match( '[^aeiou][aeiou][^aeiou]', token ):
+            token = token + 'e'
+
+    elif match( r"(.*?[aeiou].*?)ing", token ):
+
+        token = sub( r"(.*?[aeiou].*?)ing", r"\g<1>", token )
+
+        if match( r"(.*?)at", token ):
+            token = sub( r"(.*?)at", r"\g<1>ate", token )
+
+        elif match( r"(.*?)bl", token ):
+            token = sub( r"(.*?)bl", r"\g<1>ble", token )
+
+        elif match( r"(.*?)iz", token ):
+            token = sub( r"(.*?)iz", r"\g<1>ize", token )
+
+        ## double same consonant ending check
+        elif token[ -1 ] == token[ -2 ] and token[ -1 ] not in ( 'l', 's', 'z' ):
+            token = token[ : -1 ]
+
+        elif m == 1 and match( '[^aeiou][aeiou][^aeiou]', token ):
+            token = token + 'e'
+
+
+    return token
+
+
+## function to collect every word in the raw files as a token stream
+## arguments:
+##      - node: parsed json content to walk
+##      - tokens: list the tokens are appended to
+def collect_tokens( node, tokens ):
+
+    if isinstance( node, dict ):
+        for key in node:
+            tokens.extend( findall( '[a-z0-9_]+', key.lower() ) )
+            collect_tokens( node[ key ], tokens )
+
+    elif isinstance( node, str ):
+        tokens.extend( findall( '[a-z0-9_]+', node.lower() ) )
+
+
+## function to time a stemmer over the token stream
+## arguments:
+##      - stemmer: callable taking a token and returning its stem
+##      - tokens: tokens to be stemmed
+def tokens_per_second( stemmer, tokens ):
+
+    best = None
+
+    for _ in range( ROUNDS ):
+        start = perf_counter()
+        for token in tokens:
+            stemmer( token )
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min( best, elapsed )
+
+    return len( tokens ) / best
+
+
+tokens = []
+for filename in sorted( glob( RAW_GLOB ) ):
+    with open( filename, 'r' ) as fh:
+        collect_tokens( load( fh ), tokens )
+
+print( f'Tokens: {len( tokens )}, Vocabulary: {len( set( tokens ) )}' )
+
+## first we make sure the outputs agree on the whole vocabulary
+processor = IRAdvancedTermProcessor()
+mismatches = [ token for token in set( tokens ) if legacy_porters( token ) != processor.stem( token ) ]
+print( f'Mismatched stems: {len( mismatches )}' )
+
+legacy = tokens_per_second( legacy_porters, tokens )
+compiled = tokens_per_second( IRAdvancedTermProcessor().stem, tokens )
+cached_processor = IRAdvancedTermProcessor()
+cached = tokens_per_second( cached_processor.porters, tokens )
+
+print( f'Legacy porters:   {legacy:,.0f} tokens/sec' )
+print( f'Compiled stemmer: {compiled:,.0f} tokens/sec ({compiled / legacy:.1f}x)' )
+print( f'Cached stemmer:   {cached:,.0f} tokens/sec ({cached / legacy:.1f}x)' )
+print( f'Cache statistics: {cached_processor.stem_cache.statistics()}' )
@@ -0,0 +1,217 @@
+from extractors import parse_hr_index, parse_hr_report, parse_un_record, parse_un_search
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import load
+from sys import exit
+from tempfile import TemporaryDirectory
+from threading import Lock, Thread
+from time import perf_counter
+from urllib.error import HTTPError
+from utilities import Fetcher, ResponseCache
+
+## checks the fetcher and the streaming extractors against the saved pages in fixtures/, served from a local http server
+## the server counts connections and answers with 304s, 429s, 5xxs and redirects on purpose, so no network is needed
+## usage: python check_fetcher.py, exits with 1 if any check fails
+FIXTURES_DIRECTORY = 'fixtures'
+PAGES = [ 'un_search', 'un_record', 'hr_index', 'hr_report' ]
+HR_PREFIX = 'https://www.state.gov/reports/2019-country-reports-on-human-rights-practices/'
+LAST_MODIFIED = 'Wed, 18 Dec 2019 00:00:00 GMT'
+BACKOFF = 0.05
+RETRIES = 2
+
+## every request the server answers as ( path, client port, If-None-Match header, status )
+requests = []
+requests_lock = Lock()
+failures = 0
+
+
+## this is a class to serve the fixture pages over keep-alive connections
+## paths are:
+##      - /pages/<page>: the page, with an ETag it is revalidated against
+##      - /flaky/<status>/<count>/<page>: answers with status the first count times it is asked for, then the page
+##      - /redirect/<page>: redirects to the page
+##      - /loop: redirects to itself forever
+##      - /unchanged: always answers 304, whether or not it was asked conditionally
+## anything else is a 404
+class FixtureHandler( BaseHTTPRequestHandler ):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET( self ):
+
+        parts = self.path.strip( '/' ).split( '/' )
+
+        if parts[ 0 ] == 'pages' and len( parts ) == 2 and parts[ 1 ] in PAGES:
+            body = fixture( parts[ 1 ] )
+            etag = f'"{sha256( body ).hexdigest()[ : 16 ]}"'
+            if self.headers.get( 'If-None-Match' ) == etag:
+                self.answer( 304, headers = { 'ETag': etag } )
+            else:
+                self.answer( 200, body, { 'ETag': etag, 'Last-Modified': LAST_MODIFIED, 'Content-Type': 'text/html; charset=utf-8' } )
+
+        elif parts[ 0 ] == 'flaky' and len( parts ) == 4 and parts[ 3 ] in PAGES:
+            asked = len( answered( self.path ) )
+            if asked < int( parts[ 2 ] ):
+                self.answer( int( parts[ 1 ] ), b'try again later', { 'Retry-After': '0' } )
+            else:
+                self.answer( 200, fixture( parts[ 3 ] ) )
+
+        elif parts[ 0 ] == 'redirect' and len( parts ) == 2:
+            self.answer( 302, headers = { 'Location': f'/pages/{parts[ 1 ]}' } )
+
+        elif self.path == '/loop':
+            self.answer( 302, headers = { 'Location': '/loop' } )
+
+        elif self.path == '/unchanged':
+            self.answer( 304 )
+
+        else:
+            self.answer( 404, b'not found' )
+
+
+    ## function to send a response and note it down
+    ## arguments:
+    ##      - status: status code of the response
+    ##      - body: body of the response as bytes
+    ##      - headers: extra headers of the response
+    def answer( self, status, body = b'', headers = {} ):
+
+        with requests_lock:
+            requests.append( ( self.path, self.client_address[ 1 ], self.headers.get( 'If-None-Match' ), status ) )
+
+        self.send_response( status )
+        for name, value in headers.items():
+            self.send_header( name, value )
+
+        ## a 304 has no body, everything else says how long its body is so the connection can be kept open
+        if status != 304:
+            self.send_header( 'Content-Length', str( len( body ) ) )
+        self.end_headers()
+
+        if status != 304:
+            self.wfile.write( body )
+
+
+    def log_message( self, format, *args ):
+        pass
+
+
+## function to read a fixture page as bytes
+## arguments:
+##      - page: name of the page
+def fixture( page ):
+
+    with open( f'{FIXTURES_DIRECTORY}/{page}.html', 'rb' ) as fh:
+        return fh.read()
+
+
+## function to get the requests the server answered for a path
+## arguments:
+##      - path: path of the requests
+def answered( path ):
+
+    with requests_lock:
+        return [ request for request in requests if request[ 0 ] == path ]
+
+
+## function to report a check
+## arguments:
+##      - name: what is being checked
+##      - passed: whether the check passed
+##      - detail: what was seen instead, printed when the check fails
+def check( name, passed, detail = '' ):
+
+    global failures
+
+    print( f"{'ok' if passed else 'FAILED'}: {name}" + ( '' if passed else f' ({detail})' ) )
+    failures = failures + ( not passed )
+
+
+## function to fetch a url, returns ( contents, None ) or ( None, the error it raised )
+## arguments:
+##      - fetcher: Fetcher the url is fetched with
+##      - url: url to be fetched
+def attempt( fetcher, url ):
+
+    try:
+        return fetcher.fetch( url ), None
+    except HTTPError as e:
+        return None, e
+
+
+server = ThreadingHTTPServer( ( '127.0.0.1', 0 ), FixtureHandler )
+Thread( target = server.serve_forever, daemon = True ).start()
+base = f'http://127.0.0.1:{server.server_address[ 1 ]}'
+
+with open( f'{FIXTURES_DIRECTORY}/expected.json', 'r' ) as fh:
+    expected = load( fh )
+
+## the extractors give the known output for each page, fetched through the server
+fetcher = Fetcher( concurrency = 2, rate = 0, retries = RETRIES, backoff = BACKOFF, timeout = 5 )
+pages = { page: fetcher.fetch( f'{base}/pages/{page}' ) for page in PAGES }
+
+check( 'un search results', parse_un_search( pages[ 'un_search' ] ) == expected[ 'un_search' ], parse_un_search( pages[ 'un_search' ] ) )
+check( 'un record', list( parse_un_record( pages[ 'un_record' ] ) ) == expected[ 'un_record' ], parse_un_record( pages[ 'un_record' ] ) )
+check( 'hr index', sorted( parse_hr_index( pages[ 'hr_index' ], HR_PREFIX ) ) == expected[ 'hr_index' ], sorted( parse_hr_index( pages[ 'hr_index' ], HR_PREFIX ) ) )
+check( 'hr report', parse_hr_report( pages[ 'hr_report' ] ) == expected[ 'hr_report' ], parse_hr_report( pages[ 'hr_report' ] ) )
+
+## requests made one after another from a thread share its keep-alive connection
+ports = set( port for path, port, _, _ in requests if path.startswith( '/pages/' ) )
+check( 'keep-alive connection reused', len( ports ) == 1, f'{len( ports )} connections for {len( PAGES )} pages' )
+
+pooled = [ f'{base}/pages/{page}' for page in PAGES * 4 ]
+before = set( port for _, port, _, _ in requests )
+check( 'fetch_all keeps page order', [ contents for _, contents in fetcher.fetch_all( pooled ) ] == [ pages[ page ] for page in PAGES * 4 ] )
+opened = set( port for _, port, _, _ in requests ) - before
+check( 'fetch_all opens a connection per worker at most', len( opened ) <= 2, f'{len( opened )} connections' )
+
+## a cached page is revalidated with its ETag and served from the cache on a 304, offline runs never ask the server
+with TemporaryDirectory() as directory:
+
+    cached = Fetcher( rate = 0, retries = RETRIES, backoff = BACKOFF, timeout = 5, cache = ResponseCache( directory ) )
+    url = f'{base}/pages/un_record'
+    first = cached.fetch( url )
+    seen = len( answered( '/pages/un_record' ) )
+    second = cached.fetch( url )
+    last = answered( '/pages/un_record' )[ -1 ]
+
+    check( 'revalidated with If-None-Match', len( answered( '/pages/un_record' ) ) == seen + 1 and last[ 2 ] is not None, last )
+    check( '304 served from the cache', last[ 3 ] == 304 and first == second == pages[ 'un_record' ], last )
+
+    offline = Fetcher( rate = 0, cache = ResponseCache( directory, offline = True ) )
+    seen = len( requests )
+    check( 'offline fetch served without a request', offline.fetch( url ) == first and len( requests ) == seen )
+
+    redirected = cached.fetch( f'{base}/redirect/hr_index' )
+    check( 'redirect followed and cached', redirected == pages[ 'hr_index' ] and offline.fetch( f'{base}/redirect/hr_index' ) == redirected )
+
+    ## a 304 for a page we have no copy of and a redirect past the limit are errors, never cached as empty pages
+    _, error = attempt( cached, f'{base}/unchanged' )
+    check( '304 without a cached page raised', error is not None and error.code == 304 and cached.cache.lookup( f'{base}/unchanged' ) is None, error )
+
+    _, error = attempt( cached, f'{base}/loop' )
+    check( 'redirect loop raised once redirects run out', error is not None and error.code == 302 and cached.cache.lookup( f'{base}/loop' ) is None, error )
+
+## 429s and 5xxs are retried with a doubling backoff, other client errors are not
+for status in ( 429, 503 ):
+
+    path = f'/flaky/{status}/{RETRIES}/hr_report'
+    start = perf_counter()
+    contents, _ = attempt( fetcher, base + path )
+    elapsed = perf_counter() - start
+    waited = sum( BACKOFF * 2 ** attempt for attempt in range( RETRIES ) )
+
+    check( f'{status} retried until it succeeds', contents == pages[ 'hr_report' ] and len( answered( path ) ) == RETRIES + 1, answered( path ) )
+    check( f'{status} retries back off', elapsed >= waited, f'{elapsed:.3f}s < {waited:.3f}s' )
+
+path = f'/flaky/500/{RETRIES + 1}/hr_report'
+_, error = attempt( fetcher, base + path )
+check( '500 raised once retries run out', error is not None and error.code == 500 and len( answered( path ) ) == RETRIES + 1, answered( path ) )
+
+_, error = attempt( fetcher, f'{base}/missing' )
+check( '404 raised without retrying', error is not None and error.code == 404 and len( answered( '/missing' ) ) == 1, answered( '/missing' ) )
+
+server.shutdown()
+
+print( f'{failures} checks failed' if failures else 'all checks passed' )
+exit( 1 if failures else 0 )
@@ -40,7 +40,7 @@ COUNTRIES = [
     , 'colombia'
     , 'comoros'
     , 'congo'
-    , 'congo'
+    , 'democratic-republic-of-the-congo'
     , 'costa-rica'
     , 'croatia'
     , 'cuba'
@@ -199,6 +199,243 @@ COUNTRIES = [
     , 'zimbabwe'
 ]
 
+## canonical country names, everything that names a country is resolved to one of these and joined on its id
+## these are the names UN votes use, plus the few places the human rights reports cover that do not vote
+CANONICAL_COUNTRIES = [
+    'AFGHANISTAN'
+    , 'ALBANIA'
+    , 'ALGERIA'
+    , 'ANDORRA'
+    , 'ANGOLA'
+    , 'ANTIGUA AND BARBUDA'
+    , 'ARGENTINA'
+    , 'ARMENIA'
+    , 'AUSTRALIA'
+    , 'AUSTRIA'
+    , 'AZERBAIJAN'
+    , 'BAHAMAS'
+    , 'BAHRAIN'
+    , 'BANGLADESH'
+    , 'BARBADOS'
+    , 'BELARUS'
+    , 'BELGIUM'
+    , 'BELIZE'
+    , 'BENIN'
+    , 'BHUTAN'
+    , 'BOLIVIA (PLURINATIONAL STATE OF)'
+    , 'BOSNIA AND HERZEGOVINA'
+    , 'BOTSWANA'
+    , 'BRAZIL'
+    , 'BRUNEI DARUSSALAM'
+    , 'BULGARIA'
+    , 'BURKINA FASO'
+    , 'BURUNDI'
+    , 'CABO VERDE'
+    , 'CAMBODIA'
+    , 'CAMEROON'
+    , 'CANADA'
+    , 'CENTRAL AFRICAN REPUBLIC'
+    , 'CHAD'
+    , 'CHILE'
+    , 'CHINA'
+    , 'COLOMBIA'
+    , 'COMOROS'
+    , 'CONGO'
+    , 'COSTA RICA'
+    , 'CROATIA'
+    , 'CUBA'
+    , 'CYPRUS'
+    , 'CZECHIA'
+    , "CÔTE D'IVOIRE"
+    , "DEMOCRATIC PEOPLE'S REPUBLIC OF KOREA"
+    , 'DEMOCRATIC REPUBLIC OF THE CONGO'
+    , 'DENMARK'
+    , 'DJIBOUTI'
+    , 'DOMINICA'
+    , 'DOMINICAN REPUBLIC'
+    , 'ECUADOR'
+    , 'EGYPT'
+    , 'EL SALVADOR'
+    , 'EQUATORIAL GUINEA'
+    , 'ERITREA'
+    , 'ESTONIA'
+    , 'ESWATINI'
+    , 'ETHIOPIA'
+    , 'FIJI'
+    , 'FINLAND'
+    , 'FRANCE'
+    , 'GABON'
+    , 'GAMBIA'
+    , 'GEORGIA'
+    , 'GERMANY'
+    , 'GHANA'
+    , 'GREECE'
+    , 'GRENADA'
+    , 'GUATEMALA'
+    , 'GUINEA'
+    , 'GUINEA-BISSAU'
+    , 'GUYANA'
+    , 'HAITI'
+    , 'HOLY SEE'
+    , 'HONDURAS'
+    , 'HUNGARY'
+    , 'ICELAND'
+    , 'INDIA'
+    , 'INDONESIA'
+    , 'IRAN (ISLAMIC REPUBLIC OF)'
+    , 'IRAQ'
+    , 'IRELAND'
+    , 'ISRAEL'
+    , 'ITALY'
+    , 'JAMAICA'
+    , 'JAPAN'
+    , 'JORDAN'
+    , 'KAZAKHSTAN'
+    , 'KENYA'
+    , 'KIRIBATI'
+    , 'KOSOVO'
+    , 'KUWAIT'
+    , 'KYRGYZSTAN'
+    , "LAO PEOPLE'S DEMOCRATIC REPUBLIC"
+    , 'LATVIA'
+    , 'LEBANON'
+    , 'LESOTHO'
+    , 'LIBERIA'
+    , 'LIBYA'
+    , 'LIECHTENSTEIN'
+    , 'LITHUANIA'
+    , 'LUXEMBOURG'
+    , 'MADAGASCAR'
+    , 'MALAWI'
+    , 'MALAYSIA'
+    , 'MALDIVES'
+    , 'MALI'
+    , 'MALTA'
+    , 'MARSHALL ISLANDS'
+    , 'MAURITANIA'
+    , 'MAURITIUS'
+    , 'MEXICO'
+    , 'MICRONESIA (FEDERATED STATES OF)'
+    , 'MONACO'
+    , 'MONGOLIA'
+    , 'MONTENEGRO'
+    , 'MOROCCO'
+    , 'MOZAMBIQUE'
+    , 'MYANMAR'
+    , 'NAMIBIA'
+    , 'NAURU'
+    , 'NEPAL'
+    , 'NETHERLANDS'
+    , 'NEW ZEALAND'
+    , 'NICARAGUA'
+    , 'NIGER'
+    , 'NIGERIA'
+    , 'NORTH MACEDONIA'
+    , 'NORWAY'
+    , 'OMAN'
+    , 'PAKISTAN'
+    , 'PALAU'
+    , 'PANAMA'
+    , 'PAPUA NEW GUINEA'
+    , 'PARAGUAY'
+    , 'PERU'
+    , 'PHILIPPINES'
+    , 'POLAND'
+    , 'PORTUGAL'
+    , 'QATAR'
+    , 'REPUBLIC OF KOREA'
+    , 'REPUBLIC OF MOLDOVA'
+    , 'ROMANIA'
+    , 'RUSSIAN FEDERATION'
+    , 'RWANDA'
+    , 'SAINT KITTS AND NEVIS'
+    , 'SAINT LUCIA'
+    , 'SAINT VINCENT AND THE GRENADINES'
+    , 'SAMOA'
+    , 'SAN MARINO'
+    , 'SAO TOME AND PRINCIPE'
+    , 'SAUDI ARABIA'
+    , 'SENEGAL'
+    , 'SERBIA'
+    , 'SEYCHELLES'
+    , 'SIERRA LEONE'
+    , 'SINGAPORE'
+    , 'SLOVAKIA'
+    , 'SLOVENIA'
+    , 'SOLOMON ISLANDS'
+    , 'SOMALIA'
+    , 'SOUTH AFRICA'
+    , 'SOUTH SUDAN'
+    , 'SPAIN'
+    , 'SRI LANKA'
+    , 'SUDAN'
+    , 'SURINAME'
+    , 'SWEDEN'
+    , 'SWITZERLAND'
+    , 'SYRIAN ARAB REPUBLIC'
+    , 'TAIWAN'
+    , 'TAJIKISTAN'
+    , 'THAILAND'
+    , 'TIMOR-LESTE'
+    , 'TOGO'
+    , 'TONGA'
+    , 'TRINIDAD AND TOBAGO'
+    , 'TUNISIA'
+    , 'TURKEY'
+    , 'TURKMENISTAN'
+    , 'TUVALU'
+    , 'UGANDA'
+    , 'UKRAINE'
+    , 'UNITED ARAB EMIRATES'
+    , 'UNITED KINGDOM'
+    , 'UNITED REPUBLIC OF TANZANIA'
+    , 'UNITED STATES'
+    , 'URUGUAY'
+    , 'UZBEKISTAN'
+    , 'VANUATU'
+    , 'VENEZUELA (BOLIVARIAN REPUBLIC OF)'
+    , 'VIET NAM'
+    , 'YEMEN'
+    , 'ZAMBIA'
+    , 'ZIMBABWE'
+]
+
+## spellings too far from their canonical name to be matched on their own, as spelling to canonical name
+## names are matched after normalizing, see countries.normalize, so one entry covers every punctuation and case of a spelling
+## an entry here replaces whatever an earlier run matched the same spelling to, but data already loaded keeps the country
+## it was loaded with, rebuild processed/model.db to apply changes to it
+COUNTRY_ALIASES = {
+
+    'CZECH REPUBLIC': 'CZECHIA'
+    , 'SWAZILAND': 'ESWATINI'
+    , 'MACEDONIA': 'NORTH MACEDONIA'
+    , 'THE FORMER YUGOSLAV REPUBLIC OF MACEDONIA': 'NORTH MACEDONIA'
+    , 'ANTIGUA AND BARBADOS': 'ANTIGUA AND BARBUDA'
+    , 'IVORY COAST': "CÔTE D'IVOIRE"
+    , 'EAST TIMOR': 'TIMOR-LESTE'
+    , 'CAPE VERDE': 'CABO VERDE'
+    , 'KOREA NORTH': "DEMOCRATIC PEOPLE'S REPUBLIC OF KOREA"
+    , 'NORTH KOREA': "DEMOCRATIC PEOPLE'S REPUBLIC OF KOREA"
+    , 'KOREA SOUTH': 'REPUBLIC OF KOREA'
+    , 'SOUTH KOREA': 'REPUBLIC OF KOREA'
+    , 'LAOS': "LAO PEOPLE'S DEMOCRATIC REPUBLIC"
+    , 'SYRIA': 'SYRIAN ARAB REPUBLIC'
+    , 'RUSSIA': 'RUSSIAN FEDERATION'
+    , 'BURMA': 'MYANMAR'
+    , 'VATICAN CITY': 'HOLY SEE'
+    , 'DEMOCRATIC REPUBLIC OF CONGO': 'DEMOCRATIC REPUBLIC OF THE CONGO'
+    , 'DEMOCRATIC-REPUBLIC-OF-THE-CONGO': 'DEMOCRATIC REPUBLIC OF THE CONGO'
+    , 'CONGO (KINSHASA)': 'DEMOCRATIC REPUBLIC OF THE CONGO'
+    , 'REPUBLIC OF THE CONGO': 'CONGO'
+    , 'REPUBLIC-OF-THE-CONGO': 'CONGO'
+    , 'CONGO (BRAZZAVILLE)': 'CONGO'
+    , 'KYRGYZ REPUBLIC': 'KYRGYZSTAN'
+    , 'TURKIYE': 'TURKEY'
+    , 'ISRAEL-WEST-BANK-AND-GAZA': 'ISRAEL'
+    , 'CHINA (INCLUDES TIBET, HONG KONG, AND MACAU)': 'CHINA'
+
+}
+
 YEARS = [
     "2021"
     , "2020"
@@ -224,6 +461,7 @@ HR_CONFIG = {
 UN_CONFIG = {
     
     "baseURL": "https://digitallibrary.un.org/search?cc=Voting+Data&ln=en&c=Voting+Data&rg={nrecords}&jrec={start}&fct__3={year}&fct__9=Vote"
+    , "recordURL": "https://digitallibrary.un.org/record/{record}"
     , "q": [
         "start"
         , "nrecords"
@@ -231,3 +469,22 @@ UN_CONFIG = {
     ]
 
 }
+
+## settings for fetching pages, point the URLs above at a local server to crawl saved pages instead
+FETCH_CONFIG = {
+
+    "concurrency": 8
+    , "rate": 4
+    , "retries": 3
+    , "backoff": 1.0
+
+}
+
+## on-disk cache of fetched pages, in offline mode crawls are served from the cache alone
+CACHE_CONFIG = {
+
+    "directory": "cache/http"
+    , "max_size": 2 << 30
+    , "offline": False
+
+}
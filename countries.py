@@ -0,0 +1,192 @@
+from constants import CANONICAL_COUNTRIES, COUNTRY_ALIASES
+from difflib import get_close_matches
+from re import sub
+from unicodedata import combining, normalize as unicode_normalize
+
+## how alike two normalized names have to be, from 0 to 1, for a name to be matched to a country it does not spell exactly
+FUZZY_CUTOFF = 0.85
+
+## words that say nothing about which country is meant, and abbreviations spelled out before names are compared
+FILLER_WORDS = frozenset( [ 'AND', 'THE', 'OF' ] )
+ABBREVIATIONS = { 'ST': 'SAINT', 'REP': 'REPUBLIC' }
+
+## words naming a form of state rather than a country, two names sharing only these are not the same country
+## "PEOPLE'S" comes out of normalize as "PEOPLE S"
+GENERIC_WORDS = frozenset( [
+    'REPUBLIC', 'DEMOCRATIC', 'PEOPLE', 'PEOPLES', 'S', 'STATE', 'STATES', 'ISLAMIC', 'FEDERATED', 'FEDERAL', 'FEDERATION'
+    , 'PLURINATIONAL', 'BOLIVARIAN', 'UNITED', 'KINGDOM', 'ARAB', 'SOCIALIST'
+] )
+
+
+## function to reduce a country name to the words that identify it, returns them as a tuple
+## accents, case, punctuation and filler words are dropped, so "Côte d'Ivoire" and "COTE D IVOIRE" come out the same, as do
+## "BOSNIA AND HERZEGOVINA" and "bosnia-herzegovina", parenthesised words are kept since "CONGO (KINSHASA)" is not "CONGO"
+## arguments:
+##      - name: country name in any spelling
+def normalize( name ):
+
+    name = ''.join( char for char in unicode_normalize( 'NFKD', name ) if not combining( char ) ).upper()
+    name = sub( r'[^A-Z0-9]+', ' ', name )
+
+    return tuple( ABBREVIATIONS.get( word, word ) for word in name.split() if word not in FILLER_WORDS )
+
+
+## this is a class to resolve the many spellings of a country to a single integer id, shared by everything loading data about countries
+## canonical countries and every spelling seen so far are kept in the database, so a spelling is only matched once
+## a new spelling is matched on its normalized words, then fuzzily, then as the only country whose name holds all of its words
+## spellings that match nothing, or could name more than one country, are kept as aliases without a country and resolve to None,
+## they are never matched against, so which spellings turn up first cannot change what later ones resolve to
+class CountryIndex:
+
+    ## constructor for index, the canonical countries and curated aliases are added to the database if missing
+    ## arguments:
+    ##      - db: sqlite connection the index is kept in
+    def __init__( self, db ):
+        self.db = db
+
+        self.db.execute( '''
+            CREATE TABLE IF NOT EXISTS CANONICAL_COUNTRIES
+            (
+                COUNTRY_ID INTEGER PRIMARY KEY
+                , COUNTRY TEXT UNIQUE
+            )
+        ''' )
+        self.db.execute( '''
+            CREATE TABLE IF NOT EXISTS COUNTRY_ALIASES
+            (
+                ALIAS TEXT PRIMARY KEY
+                , COUNTRY_ID INT
+            )
+        ''' )
+        self.db.execute( '''CREATE INDEX IF NOT EXISTS COUNTRY_ALIASES_COUNTRY ON COUNTRY_ALIASES ( COUNTRY_ID )''' )
+
+        self.db.executemany( '''INSERT OR IGNORE INTO CANONICAL_COUNTRIES ( COUNTRY ) VALUES ( ? )''', [ ( country, ) for country in CANONICAL_COUNTRIES ] )
+
+        ## earlier runs added spellings that matched nothing as countries of their own, they are turned back into unresolved aliases
+        stale = [ ( country_id, ) for country_id, name in self.db.execute( '''SELECT COUNTRY_ID, COUNTRY FROM CANONICAL_COUNTRIES''' ) if name not in CANONICAL_COUNTRIES ]
+        self.db.executemany( '''UPDATE COUNTRY_ALIASES SET COUNTRY_ID = NULL WHERE COUNTRY_ID = ?''', stale )
+        self.db.executemany( '''DELETE FROM CANONICAL_COUNTRIES WHERE COUNTRY_ID = ?''', stale )
+
+        self.names = dict( self.db.execute( '''SELECT COUNTRY_ID, COUNTRY FROM CANONICAL_COUNTRIES''' ) )
+        self.ids = dict( self.db.execute( '''SELECT ALIAS, COUNTRY_ID FROM COUNTRY_ALIASES''' ) )
+
+        ## normalized spelling to id, spaces are left out of the key so "VIETNAM" is "VIET NAM"
+        ## and the same spellings with their words space separated, for fuzzy matching
+        self.keys = {}
+        self.spellings = {}
+
+        ## canonical names alone, in the same form, for shortened names, so "HONG KONG" is not matched to a curated alias
+        ## like "CHINA (INCLUDES TIBET, HONG KONG, AND MACAU)" just for holding its words
+        self.canonical = { ' '.join( normalize( name ) ): country_id for country_id, name in self.names.items() }
+
+        ## curated aliases come before the spellings matched by earlier runs, and replace them if those were matched wrongly
+        for country_id, name in self.names.items():
+            self.remember( name, country_id )
+
+        for alias, country in COUNTRY_ALIASES.items():
+            country_id = self.resolve( country )
+            if self.ids.get( alias ) != country_id:
+                self.db.execute( '''INSERT OR REPLACE INTO COUNTRY_ALIASES ( ALIAS, COUNTRY_ID ) VALUES ( ?, ? )''', ( alias, country_id ) )
+                self.ids[ alias ] = country_id
+            self.remember( alias, country_id )
+
+        for alias, country_id in self.ids.items():
+            if country_id is not None:
+                self.remember( alias, country_id )
+
+
+    ## function to get the id of a country from any spelling of its name, new spellings are matched and remembered
+    ## returns None for a spelling that names no known country, or more than one, so callers leave it out of anything joined on ids
+    ## arguments:
+    ##      - name: country name as the data spells it
+    def resolve( self, name ):
+
+        if name in self.ids:
+            return self.ids[ name ]
+
+        candidates = self.candidates( name )
+
+        country_id = None
+
+        if len( candidates ) == 1:
+            country_id = candidates.pop()
+        elif candidates:
+            print( f"... {name} could be any of {', '.join( sorted( self.names[ candidate ] for candidate in candidates ) )}, leaving it unresolved rather than guess" )
+        else:
+            print( f'... {name} does not match a known country, leaving it unresolved' )
+
+        self.db.execute( '''INSERT OR REPLACE INTO COUNTRY_ALIASES ( ALIAS, COUNTRY_ID ) VALUES ( ?, ? )''', ( name, country_id ) )
+        self.ids[ name ] = country_id
+
+        if country_id is not None:
+            self.remember( name, country_id )
+
+        return country_id
+
+
+    ## function to add a spelling to the ones new names are matched against, spellings already known keep their country
+    ## arguments:
+    ##      - name: country name in any spelling
+    ##      - country_id: id of the country it names
+    def remember( self, name, country_id ):
+
+        self.keys.setdefault( ''.join( normalize( name ) ), country_id )
+        self.spellings.setdefault( ' '.join( normalize( name ) ), country_id )
+
+
+    ## function to find the country a spelling most likely names, returns its id or None if it matches none or several
+    ## arguments:
+    ##      - name: country name as the data spells it
+    def match( self, name ):
+
+        candidates = self.candidates( name )
+
+        return candidates.pop() if len( candidates ) == 1 else None
+
+
+    ## function to find the countries a spelling could name, returns a set of ids, with a single one when it is matched
+    ## arguments:
+    ##      - name: country name as the data spells it
+    def candidates( self, name ):
+
+        words = normalize( name )
+
+        if ''.join( words ) in self.keys:
+            return { self.keys[ ''.join( words ) ] }
+
+        if not words:
+            return set()
+
+        ## a fuzzy match has to start every word with the same letter, so typos like "CHILES" are caught but "ROMAN" is not "OMAN"
+        initials = [ word[ 0 ] for word in words ]
+        close = get_close_matches( ' '.join( words ), [ spelling for spelling in self.spellings if [ word[ 0 ] for word in spelling.split() ] == initials ], n = 1, cutoff = FUZZY_CUTOFF )
+
+        if close:
+            return { self.spellings[ close[ 0 ] ] }
+
+        ## a shortened name like "BURKINA" is the only country whose canonical name holds every one of its words, generic words are left
+        ## out so "REPUBLIC OF THE CONGO" is not taken for the DEMOCRATIC REPUBLIC OF THE CONGO just for holding REPUBLIC
+        identifying = set( words ) - GENERIC_WORDS
+
+        if not identifying:
+            return set()
+
+        holding = [ ( set( spelling.split() ), country_id ) for spelling, country_id in self.canonical.items() if identifying <= set( spelling.split() ) ]
+        countries = set( country_id for _, country_id in holding )
+
+        ## between countries the identifying words fit equally, only one also spelled with the same generic words is taken
+        if len( countries ) > 1:
+            generic = set( words ) & GENERIC_WORDS
+            same = set( country_id for spelling, country_id in holding if spelling & GENERIC_WORDS == generic )
+            if len( same ) == 1:
+                return same
+
+        return countries
+
+
+    ## function to get the canonical name of a country
+    ## arguments:
+    ##      - country_id: id of the country
+    def name( self, country_id ):
+
+        return self.names[ country_id ]
@@ -0,0 +1,298 @@
+from html.parser import HTMLParser
+from re import DOTALL, findall, match
+
+## UN record page info, vote rows are rebuilt as "<vote> <country><br/>" text and matched with this pattern
+VOTE_PATTERN_REGEX = r'([YNA\s]) (.*?)<br/?>'
+VOTE_TITLE_REGEX = r'Vote(\W\W|\W?\Z)'
+BREAK = '<br/>'
+
+## some vote rows come through with several votes run together behind a "<br>", these are split back out with this pattern
+SECOND_VOTE_PATTERN_REGEX = r' ([YNA\s]) (.*)'
+MALFORMED_BREAK = '<br>'
+
+## class names we look for in the pages
+UN_LINK_CLASS = 'moreinfo'
+UN_RECORD_PREFIX = '/record/'
+UN_TITLE_CLASS = 'full-record-title'
+UN_ROW_CLASS = 'metadata-row'
+UN_ROW_TITLE_CLASS = 'title col-xs-12 col-sm-3 col-md-2'
+HR_SECTION_CLASS = 'content'
+
+
+## event-driven extractor for UN digital library search results, collects the record ids of the results
+class UNSearchExtractor( HTMLParser ):
+
+    ## constructor for extractor
+    def __init__( self ):
+        super().__init__()
+        self.records = []
+
+
+    def handle_starttag( self, tag, attrs ):
+
+        if tag != 'a':
+            return
+
+        attrs = dict( attrs )
+        href = attrs.get( 'href' ) or ''
+
+        if attrs.get( 'class' ) == UN_LINK_CLASS and href.startswith( UN_RECORD_PREFIX ):
+            self.records.append( href[ len( UN_RECORD_PREFIX ) : ] )
+
+
+## event-driven extractor for UN digital library record pages, pulls the resolution title and the vote row in one pass
+class UNRecordExtractor( HTMLParser ):
+
+    ## constructor for extractor
+    def __init__( self ):
+        super().__init__()
+        self.title = None
+        self.votes = None
+        self.depth = 0
+
+        ## the title div being read and the depth it closes at
+        self.title_parts = None
+        self.title_depth = None
+
+        ## the metadata row being read, its depth and how far into it we are
+        self.row_parts = None
+        self.row_depth = None
+        self.row_state = None
+
+
+    def handle_starttag( self, tag, attrs ):
+
+        if tag == 'br':
+            if self.row_state == 'value':
+                self.row_parts.append( BREAK )
+            return
+
+        attrs = dict( attrs )
+
+        ## a vote row has to open straight away with its title span
+        if self.row_state == 'start':
+            self.row_state = 'title' if tag == 'span' and attrs.get( 'class' ) == UN_ROW_TITLE_CLASS else None
+
+        if tag != 'div':
+            return
+
+        self.depth = self.depth + 1
+
+        if attrs.get( 'class' ) == UN_TITLE_CLASS:
+            self.title_parts = []
+            self.title_depth = self.depth
+
+        elif attrs.get( 'class' ) == UN_ROW_CLASS and self.row_state is None:
+            self.row_parts = []
+            self.row_depth = self.depth
+            self.row_state = 'start'
+
+
+    def handle_endtag( self, tag ):
+
+        ## once the title span closes we know if this is the vote row
+        if tag == 'span' and self.row_state == 'title':
+            self.row_state = 'value' if match( VOTE_TITLE_REGEX, ''.join( self.row_parts ) ) else None
+            self.row_parts = []
+
+        if tag != 'div':
+            return
+
+        if self.depth == self.title_depth:
+            self.title = ''.join( self.title_parts ).strip()
+            self.title_parts, self.title_depth = None, None
+
+        if self.depth == self.row_depth:
+            if self.row_state == 'value':
+                self.votes = ''.join( self.row_parts )
+            self.row_parts, self.row_depth, self.row_state = None, None, None
+
+        self.depth = self.depth - 1
+
+
+    def handle_data( self, data ):
+
+        if self.title_parts is not None:
+            self.title_parts.append( data )
+
+        if self.row_state in ( 'title', 'value' ):
+            self.row_parts.append( data )
+
+        ## text before the title span means this is not a vote row
+        elif self.row_state == 'start' and data.strip():
+            self.row_state = None
+
+
+## event-driven extractor for the human rights report index, collects links under a url prefix
+class HRIndexExtractor( HTMLParser ):
+
+    ## constructor for extractor
+    ## arguments:
+    ##      - prefix: url prefix of the country reports
+    def __init__( self, prefix ):
+        super().__init__()
+        self.prefix = prefix
+        self.urls = set()
+
+
+    def handle_starttag( self, tag, attrs ):
+
+        if tag != 'a':
+            return
+
+        ## the first attribute under our prefix is the link we want
+        for _, value in attrs:
+            if value and value.startswith( self.prefix ):
+                self.urls.add( value )
+                break
+
+
+## event-driven extractor for a human rights country report, collects the paragraphs under each section subtitle
+class HRReportExtractor( HTMLParser ):
+
+    ## constructor for extractor
+    def __init__( self ):
+        super().__init__()
+        self.sections = []
+        self.open = []
+        self.subtitle = None
+        self.paragraph = None
+
+
+    def handle_starttag( self, tag, attrs ):
+
+        if tag == 'section':
+            section = None
+            if ( dict( attrs ).get( 'class' ) or '' ).endswith( HR_SECTION_CLASS ):
+                section = { 'subtitles': [], 'paragraphs': [] }
+                self.sections.append( section )
+            self.open.append( section )
+
+        elif tag == 'h3':
+            self.subtitle = []
+
+        ## only bare paragraphs hold report text, an unclosed paragraph ends where the next one starts
+        elif tag == 'p':
+            self.close_paragraph()
+            if not attrs:
+                self.paragraph = []
+
+
+    def handle_endtag( self, tag ):
+
+        if tag == 'section' and self.open:
+            self.close_paragraph()
+            self.open.pop()
+
+        elif tag == 'h3' and self.subtitle is not None:
+            for section in self.open:
+                if section is not None:
+                    section[ 'subtitles' ].append( ''.join( self.subtitle ).strip() )
+            self.subtitle = None
+
+        elif tag == 'p':
+            self.close_paragraph()
+
+
+    def handle_data( self, data ):
+
+        if self.subtitle is not None:
+            self.subtitle.append( data )
+
+        if self.paragraph is not None:
+            self.paragraph.append( data )
+
+
+    ## function to add the paragraph being read to every open section
+    def close_paragraph( self ):
+
+        if self.paragraph is None:
+            return
+
+        for section in self.open:
+            if section is not None:
+                section[ 'paragraphs' ].append( ''.join( self.paragraph ) )
+
+        self.paragraph = None
+
+
+## function to get the record ids listed on a UN search results page
+## arguments:
+##      - html: contents of the page
+def parse_un_search( html ):
+
+    extractor = UNSearchExtractor()
+    extractor.feed( html )
+    extractor.close()
+
+    return extractor.records
+
+
+## function to get the title and the votes of a UN record page, returns ( None, {} ) if the page has no title
+## arguments:
+##      - html: contents of the page
+def parse_un_record( html ):
+
+    extractor = UNRecordExtractor()
+    extractor.feed( html )
+    extractor.close()
+
+    votes = findall( VOTE_PATTERN_REGEX, extractor.votes or '', flags = DOTALL )
+
+    return extractor.title, repair_votes( dict( [ ( country, vote ) for vote, country in votes ] ) )
+
+
+## function to split out votes that were run together behind a malformed "<br>" tag, returns a new country to vote dictionary
+## the text before the first tag keeps the original vote and every later part holding a vote is added as its own country
+## arguments:
+##      - votes: country to vote dictionary of a resolution
+def repair_votes( votes ):
+
+    repaired = {}
+
+    for country, vote in votes.items():
+
+        parts = country.split( MALFORMED_BREAK )
+
+        if len( parts ) == 1:
+            repaired[ country ] = vote
+            continue
+
+        repaired[ parts[ 0 ] ] = vote
+
+        for part in parts:
+            for second_vote, second_country in findall( SECOND_VOTE_PATTERN_REGEX, part, flags = DOTALL ):
+                repaired[ second_country ] = second_vote
+
+    return repaired
+
+
+## function to get the country report urls linked from the human rights report index
+## arguments:
+##      - html: contents of the page
+##      - prefix: url prefix of the country reports
+def parse_hr_index( html, prefix ):
+
+    extractor = HRIndexExtractor( prefix )
+    extractor.feed( html )
+    extractor.close()
+
+    return extractor.urls
+
+
+## function to get the sections of a human rights country report as a subtitle to text dictionary
+## sections with more or less than one subtitle are skipped to avoid duplicates
+## arguments:
+##      - html: contents of the page
+def parse_hr_report( html ):
+
+    extractor = HRReportExtractor()
+    extractor.feed( html )
+    extractor.close()
+
+    article = {}
+    for section in extractor.sections:
+        if len( section[ 'subtitles' ] ) == 1:
+            article[ section[ 'subtitles' ][ 0 ] ] = " ".join( section[ 'paragraphs' ] )
+
+    return article
@@ -0,0 +1,107 @@
+from hashlib import sha256
+from os import makedirs, replace
+from os.path import dirname, exists
+from sklearn import __version__ as SKLEARN_VERSION
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+import numpy as np
+import scipy.sparse as sp
+
+## term counts of the corpus are kept here between runs, next to the preprocessed text they are counted from
+FEATURES_FILENAME = 'processed/features.npz'
+
+## version of the counting, bump it whenever the tokenizing below changes so saved counts are redone
+## the sklearn version is part of it too, since its tokenizer decides the vocabulary as much as we do
+FEATURES_VERSION = f'1-sklearn{SKLEARN_VERSION}'
+
+
+## this is a class to count the terms of a corpus once and derive every TF-IDF matrix we train on from those counts
+## the documents x terms count matrix and its vocabulary are saved to disk, keyed by the hash of the corpus,
+## so a later run over the same text loads them instead of tokenizing again
+## weights match what a TfidfVectorizer with the same max_features fitted on the whole corpus would give
+class FeatureStore:
+
+    ## constructor for store
+    ## arguments:
+    ##      - filename: .npz file the counts are kept in
+    ##      - version: version of the counting the saved counts have to match
+    def __init__( self, filename = FEATURES_FILENAME, version = FEATURES_VERSION ):
+        self.filename = filename
+        self.version = version
+        self.counts = None
+        self.terms = None
+
+        ## TF-IDF matrices already worked out, by max_features
+        self.weights = {}
+
+
+    ## function to get the key a corpus is saved under
+    ## arguments:
+    ##      - texts: preprocessed texts of the documents, in order
+    def key( self, texts ):
+
+        digest = sha256( self.version.encode( 'utf-8' ) )
+
+        for text in texts:
+            digest.update( b'\0' + text.encode( 'utf-8' ) )
+
+        return digest.hexdigest()
+
+
+    ## function to get the counts of a corpus, loaded from disk if they were saved for the same texts, returns whether they were
+    ## arguments:
+    ##      - texts: preprocessed texts of the documents, in order, a row of the counts per text
+    def build( self, texts ):
+
+        key = self.key( texts )
+        self.weights = {}
+
+        if exists( self.filename ):
+            with np.load( self.filename ) as saved:
+                if str( saved[ 'key' ] ) == key:
+                    self.counts = sp.csr_matrix( ( saved[ 'data' ], saved[ 'indices' ], saved[ 'indptr' ] ), shape = tuple( saved[ 'shape' ] ) )
+                    self.terms = saved[ 'terms' ]
+                    return True
+
+        vectorizer = CountVectorizer( dtype = np.int32 )
+        self.counts = vectorizer.fit_transform( texts ).tocsr()
+        self.terms = vectorizer.get_feature_names_out().astype( str )
+
+        if dirname( self.filename ):
+            makedirs( dirname( self.filename ), exist_ok = True )
+
+        ## written next to the old file and moved into place, so a reader never sees half a store
+        with open( self.filename + '.tmp', 'wb' ) as fh:
+            np.savez( fh, key = key, data = self.counts.data, indices = self.counts.indices, indptr = self.counts.indptr, shape = self.counts.shape, terms = self.terms )
+
+        replace( self.filename + '.tmp', self.filename )
+
+        return False
+
+
+    ## function to get the columns kept by a max_features limit, the most frequent terms over the corpus in vocabulary order
+    ## arguments:
+    ##      - max_features: number of terms to keep, None keeps them all
+    def select( self, max_features = None ):
+
+        if max_features is None or max_features >= len( self.terms ):
+            return np.arange( len( self.terms ) )
+
+        ## the same ranking TfidfVectorizer makes, ties included, so the same terms are kept
+        frequencies = np.asarray( self.counts.sum( axis = 0, dtype = np.float64 ) ).ravel()
+        keep = np.zeros( len( self.terms ), bool )
+        keep[ ( -frequencies ).argsort()[ : max_features ] ] = True
+
+        return np.flatnonzero( keep )
+
+
+    ## function to get the TF-IDF weights of every document, idf is worked out over the whole corpus, returns ( weights, terms )
+    ## arguments:
+    ##      - max_features: number of terms to keep, None keeps them all
+    def tfidf( self, max_features = None ):
+
+        if max_features not in self.weights:
+            columns = self.select( max_features )
+            counts = self.counts[ :, columns ]
+            self.weights[ max_features ] = TfidfTransformer().fit_transform( counts ).tocsr(), self.terms[ columns ]
+
+        return self.weights[ max_features ]
@@ -0,0 +1,232 @@
+from concurrent.futures import ProcessPoolExecutor
+from features import FeatureStore
+from itertools import product
+from multiprocessing import get_all_start_methods, get_context
+from multiprocessing.shared_memory import SharedMemory
+from os import cpu_count
+from pandas import DataFrame
+from sklearn.model_selection import StratifiedKFold
+from sklearn.naive_bayes import MultinomialNB
+from time import perf_counter
+import numpy as np
+import scipy.sparse as sp
+
+## cross validation settings, the folds are drawn once and every setting is scored on the same ones
+FOLDS = 5
+FOLD_SEED = 0
+
+## number of settings handed to a worker at a time, settings are ordered by max_features so a chunk mostly shares its weights
+CHUNK_SIZE = 8
+
+## every fit of a grid search is written here, a row per setting and fold
+RESULTS_FILENAME = 'processed/grid_search.csv'
+
+## the state of each worker process, built once when the worker starts, along with the shared memory its counts live in
+WORKER_SEARCH = None
+WORKER_BLOCKS = None
+
+
+## function to copy arrays into shared memory, returns the blocks and the ( name, shape, dtype ) of each array to attach to them with
+## arguments:
+##      - arrays: name to numpy array dictionary
+def share_arrays( arrays ):
+
+    blocks, layout = [], {}
+
+    for name, array in arrays.items():
+        block = SharedMemory( create = True, size = max( array.nbytes, 1 ) )
+        np.ndarray( array.shape, array.dtype, buffer = block.buf )[ ... ] = array
+        blocks.append( block )
+        layout[ name ] = ( block.name, array.shape, array.dtype.str )
+
+    return blocks, layout
+
+
+## function to attach to arrays in shared memory without copying them, returns the blocks and a name to array dictionary
+## the blocks have to be kept for as long as the arrays are used
+## arguments:
+##      - layout: ( name, shape, dtype ) of each array, as share_arrays gives it
+def attach_arrays( layout ):
+
+    blocks, arrays = [], {}
+
+    for name, ( block_name, shape, dtype ) in layout.items():
+        block = SharedMemory( name = block_name )
+        blocks.append( block )
+        arrays[ name ] = np.ndarray( shape, dtype, buffer = block.buf )
+
+    return blocks, arrays
+
+
+## function to score binary predictions, class 1 being the positive one, returns accuracy, precision, recall and f1
+## worked out from the confusion counts directly, the sklearn metrics cost more than fitting on small folds
+## arguments:
+##      - truth: true class of each document
+##      - predictions: predicted class of each document
+def scores( truth, predictions ):
+
+    true_positives = np.count_nonzero( ( predictions == 1 ) & ( truth == 1 ) )
+    false_positives = np.count_nonzero( ( predictions == 1 ) & ( truth != 1 ) )
+    false_negatives = np.count_nonzero( ( predictions != 1 ) & ( truth == 1 ) )
+
+    return {
+        'accuracy': np.count_nonzero( predictions == truth ) / len( truth )
+        , 'precision': true_positives / ( true_positives + false_positives ) if true_positives + false_positives else 0.0
+        , 'recall': true_positives / ( true_positives + false_negatives ) if true_positives + false_negatives else 0.0
+        , 'f1': 2 * true_positives / ( 2 * true_positives + false_positives + false_negatives ) if true_positives else 0.0
+    }
+
+
+## this is a class to hold what a worker needs to score settings, the term counts, labels and folds
+class FoldScorer:
+
+    ## constructor for scorer
+    ## arguments:
+    ##      - store: FeatureStore holding the counts of the corpus
+    ##      - labels: class of each document
+    ##      - folds: ( train rows, test rows ) of each fold
+    def __init__( self, store, labels, folds ):
+        self.store = store
+        self.labels = labels
+        self.folds = folds
+
+
+    ## function to score a setting on every fold, returns a row per fold
+    ## arguments:
+    ##      - setting: ( max_features, alpha )
+    def score( self, setting ):
+
+        max_features, alpha = setting
+
+        ## only the weights of the max_features being scored are kept, so sweeping many of them does not grow memory
+        start = perf_counter()
+        if max_features not in self.store.weights:
+            self.store.weights.clear()
+        weights, _ = self.store.tfidf( max_features )
+        weights_seconds = perf_counter() - start
+
+        rows = []
+
+        for fold, ( train, test ) in enumerate( self.folds ):
+
+            start = perf_counter()
+            nb = MultinomialNB( alpha = alpha )
+            nb.fit( weights[ train ], self.labels[ train ] )
+            fitted = perf_counter()
+            predictions = nb.predict( weights[ test ] )
+            predicted = perf_counter()
+
+            rows.append( {
+                'max_features': max_features
+                , 'alpha': alpha
+                , 'fold': fold
+                , **scores( self.labels[ test ], predictions )
+                , 'weights_seconds': weights_seconds if fold == 0 else 0.0
+                , 'fit_seconds': fitted - start
+                , 'predict_seconds': predicted - fitted
+            } )
+
+        return rows
+
+
+## function run when a worker process starts, attaches to the shared counts and builds the scorer the worker reuses
+## arguments:
+##      - layout: shared memory layout of the counts and terms
+##      - shape: shape of the count matrix
+##      - labels: class of each document
+##      - folds: ( train rows, test rows ) of each fold
+def start_worker( layout, shape, labels, folds ):
+
+    global WORKER_SEARCH, WORKER_BLOCKS
+
+    WORKER_BLOCKS, arrays = attach_arrays( layout )
+
+    store = FeatureStore()
+    store.counts = sp.csr_matrix( ( arrays[ 'data' ], arrays[ 'indices' ], arrays[ 'indptr' ] ), shape = shape, copy = False )
+    store.terms = arrays[ 'terms' ]
+
+    WORKER_SEARCH = FoldScorer( store, labels, folds )
+
+
+## function to score a setting in a worker process
+## arguments:
+##      - setting: ( max_features, alpha )
+def score_setting( setting ):
+
+    return WORKER_SEARCH.score( setting )
+
+
+## this is a class to grid search the Naive Bayes classifier over max_features and alpha with k-fold cross validation
+## the folds are drawn once, and settings are scored across a pool of worker processes that share the term counts
+## through shared memory rather than each getting a pickled copy
+class GridSearch:
+
+    ## constructor for search
+    ## arguments:
+    ##      - store: FeatureStore holding the counts of the corpus
+    ##      - labels: class of each document, in the order of the counts
+    ##      - folds: number of folds
+    ##      - processes: number of worker processes, 1 scores settings in this process, defaults to one per cpu
+    ##      - seed: seed the folds are drawn with
+    def __init__( self, store, labels, folds = FOLDS, processes = None, seed = FOLD_SEED ):
+        self.store = store
+        self.labels = np.asarray( labels )
+        self.processes = processes or cpu_count() or 1
+
+        ## every class is spread evenly over the folds
+        self.folds = list( StratifiedKFold( n_splits = folds, shuffle = True, random_state = seed ).split( np.zeros( len( self.labels ) ), self.labels ) )
+
+        ## workers are forked so they do not rerun the script that started them, where we cannot fork we work serially
+        if 'fork' not in get_all_start_methods():
+            self.processes = 1
+
+
+    ## function to score every combination of a grid, returns a DataFrame with a row per setting and fold
+    ## arguments:
+    ##      - grid: dictionary with a list of max_features and a list of alpha to try
+    ##      - filename: optional csv file the results are written to
+    def run( self, grid, filename = RESULTS_FILENAME ):
+
+        settings = sorted( product( grid[ 'max_features' ], grid[ 'alpha' ] ), key = lambda el: ( el[ 0 ] is None, el[ 0 ] or 0, el[ 1 ] ) )
+
+        if self.processes == 1:
+            scorer = FoldScorer( self.store, self.labels, self.folds )
+            results = [ scorer.score( setting ) for setting in settings ]
+
+        else:
+            counts = self.store.counts
+            blocks, layout = share_arrays( { 'data': counts.data, 'indices': counts.indices, 'indptr': counts.indptr, 'terms': self.store.terms } )
+
+            try:
+                with ProcessPoolExecutor( max_workers = self.processes, mp_context = get_context( 'fork' ), initializer = start_worker, initargs = ( layout, counts.shape, self.labels, self.folds ) ) as pool:
+                    results = list( pool.map( score_setting, settings, chunksize = CHUNK_SIZE ) )
+            finally:
+                for block in blocks:
+                    block.close()
+                    block.unlink()
+
+        ## max_features stays a whole number, with None for no limit
+        results = DataFrame( [ row for rows in results for row in rows ] )
+        results[ 'max_features' ] = results[ 'max_features' ].astype( 'Int64' )
+
+        if filename:
+            results.to_csv( filename, index = False )
+
+        return results
+
+
+## function to average the folds of grid search results, returns a row per setting, best accuracy first
+## arguments:
+##      - results: DataFrame given by GridSearch.run
+def summarize( results ):
+
+    summary = results.groupby( [ 'max_features', 'alpha' ], dropna = False ).agg(
+        accuracy = ( 'accuracy', 'mean' )
+        , accuracy_std = ( 'accuracy', 'std' )
+        , precision = ( 'precision', 'mean' )
+        , recall = ( 'recall', 'mean' )
+        , f1 = ( 'f1', 'mean' )
+        , fit_seconds = ( 'fit_seconds', 'sum' )
+    )
+
+    return summary.sort_values( [ 'accuracy', 'f1' ], ascending = False ).reset_index()
@@ -1,82 +1,180 @@
-from bs4 import BeautifulSoup
-from constants import DEBUG, COUNTRIES, YEARS, HR_CONFIG
-from json import dumps
-from re import DOTALL, findall
-from urllib.request import urlopen
-from utilities import download, unpack
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from constants import DEBUG, COUNTRIES, YEARS, CACHE_CONFIG, FETCH_CONFIG, HR_CONFIG
+from countries import CountryIndex
+from extractors import parse_hr_index, parse_hr_report
+from json import dumps, load
+from os import remove, replace
+from os.path import exists
+from re import fullmatch
+from sqlite3 import connect
+from sys import argv
+from time import perf_counter
+from utilities import Fetcher, ResponseCache, unpack
 
-LINK_REGEX = '"(https://www.state.gov/reports/{year}-country-reports-on-human-rights-practices/.*?)"'
-SECTION_REGEX = '<section class=".*?content">(.*?)</section>'
-SUBTITLE_REGEX = '<h3.*?>(.*?)</h3>'
-TEXT_REGEX = '<p>(.*?)</p>'
-TITLE_REGEX = '<h2.*?>(.*?)</h2>'
+LINK_PREFIX = 'https://www.state.gov/reports/{year}-country-reports-on-human-rights-practices/'
 
-## we go through each year
-for year in ['2021']: #YEARS:
+## where each year's reports are written, and the reports of the year that could not be fetched, as country to url
+REPORTS_FILENAME = 'raw/hr/{year}_hrreports.json'
+FAILURES_FILENAME = 'raw/hr/{year}_hrfailures.json'
 
-    ## unpack our base url based on uear
-    url = unpack( HR_CONFIG[ 'baseURL' ], dict( zip( HR_CONFIG[ "q" ], [ year ] ) ) )
+## a country report is a page straight under the prefix named by its slug, links back to the index or deeper pages are not
+SLUG_REGEX = r'[\w-]+'
+
+## pages are cached on disk between runs and revalidated rather than downloaded again
+fetcher = Fetcher( cache = ResponseCache( **CACHE_CONFIG ), **FETCH_CONFIG )
+
+## only the reports of the countries in COUNTRIES are crawled, picked by canonical id rather than slug so a report filed under
+## another slug of the same country, like burma or the congos, is still found
+## usage: python hr_crawler.py [--all], --all crawls every report the index links to, whatever country it is for
+CRAWL_ALL = '--all' in argv[ 1 : ]
+
+countries = CountryIndex( connect( ':memory:' ) )
+selected = set( countries.resolve( country.upper() ) for country in COUNTRIES ) - { None }
+
+
+## function to fetch and parse a single country report, run on the worker pool
+## arguments:
+##      - url: url of the country report
+def crawl_report( url ):
+
+    start = perf_counter()
+    data = fetcher.fetch( url )
+    elapsed = perf_counter() - start
+
+    ## sections, their subtitles and paragraphs are extracted in a single pass over the page
+    return parse_hr_report( data ), elapsed, len( data.encode( 'utf-8' ) )
+
+
+## function to get the url of the report index of a year
+## arguments:
+##      - year: year of the reports
+def index_url( year ):
+    return unpack( HR_CONFIG[ 'baseURL' ], dict( zip( HR_CONFIG[ "q" ], [ year ] ) ) )
+
+
+## function to find the country report urls of a year, kept under the upper cased slug of their url
+## only reports of the selected countries are kept, unless the crawler was run with --all
+## arguments:
+##      - year: year of the reports
+def crawl_index( year ):
+
+    url = index_url( year )
 
     if DEBUG:
         print( f'... Fetching data from URL: {url}' )
 
-    ## we fetch data from the URL
-    contents = {}
-    data = download( url )
-    soup = BeautifulSoup( data, 'html.parser' )
-
-    
-    
     ## we now find all of the unique URLs for countries
-    url_re = unpack( LINK_REGEX, dict( zip( HR_CONFIG[ "q" ], [ year ] ) ) )
-    urls = [ findall( url_re, str( el ), flags = DOTALL ) for el in soup.find_all( 'a' ) ]
-    urls = set( [ el[ 0 ] for el in urls if el ] )
+    prefix = unpack( LINK_PREFIX, dict( zip( HR_CONFIG[ "q" ], [ year ] ) ) )
+    urls = parse_hr_index( fetcher.fetch( url ), prefix )
+    slugs = { url: url[ len( prefix ) : ].strip( '/' ) for url in urls }
 
-    ## now we loop over those urls
-    for url in urls:
+    reports = { slug.upper(): url for url, slug in slugs.items() if fullmatch( SLUG_REGEX, slug ) }
 
-        ## we fetch data from the URL
-        article = {}
-        country = url.split( '/' )[ -2 ].upper()
-        data = download( url )
-        soup = BeautifulSoup( data, 'html.parser' )
+    if CRAWL_ALL:
+        return reports
+
+    ## match only reads the index, so the years can be planned on the pool
+    kept = { country: url for country, url in reports.items() if countries.match( country ) in selected }
+    print( f'... {year}: crawling {len( kept )} of the {len( reports )} reports the index links to, run with --all to crawl every one' )
+
+    return kept
 
-        if DEBUG:
-            print( f'... Processing {country} in the year {year}' )
 
-        ## we loop through HTML sections for text
-        for section in soup.find_all( 'section' ):
+## function to get the reports of a year still to be crawled, returns ( reports already crawled, country to url of the rest )
+## a year whose last crawl left failures only fetches the reports that failed, any other year is crawled from its index
+## arguments:
+##      - year: year of the reports
+def plan_year( year ):
 
-            ## convert to string please
-            section = str( section )
+    reports_file, failures_file = REPORTS_FILENAME.format( year = year ), FAILURES_FILENAME.format( year = year )
 
-            ## we look only for sections with relevant text
-            tsection = findall( SECTION_REGEX, section, flags = DOTALL )
+    if not exists( failures_file ) or not exists( reports_file ):
+        return {}, crawl_index( year )
 
-            ## if not a match... we continue!
-            if not len( tsection ):
-                continue
+    with open( reports_file, 'r' ) as fh:
+        reports = load( fh )
+    with open( failures_file, 'r' ) as fh:
+        failures = load( fh )
 
-            title = findall( TITLE_REGEX, section, flags = DOTALL )
+    print( f'... Resuming {year}: fetching the {len( failures )} reports that failed last time' )
 
-            if title:
-                title = title[ 0 ]
+    return reports, failures
 
-            subtitles = list( findall( SUBTITLE_REGEX, section, flags = DOTALL ) )
 
-            ## we want to avoid duplicates
-            if len( subtitles ) != 1:
-                continue
+## function to write a finished year's reports, the files are moved into place so a reader never sees half a year
+## reports that could not be fetched are written alongside, so the next run only fetches those
+## arguments:
+##      - year: year of the reports
+##      - reports: country to report dictionary
+##      - failures: country to url dictionary of the reports that could not be fetched
+def write_year( year, reports, failures ):
 
-            subtitle = subtitles[ 0 ]
-            text = " ".join( findall( TEXT_REGEX, section, flags = DOTALL ) )
-            
-            article[ subtitle ] = text
+    reports_file, failures_file = REPORTS_FILENAME.format( year = year ), FAILURES_FILENAME.format( year = year )
+
+    with open( f'{reports_file}.tmp', 'w' ) as fh:
+        print( f'Writing {year} to file...' )
+        fh.write( dumps( { country: reports[ country ] for country in sorted( reports ) }, indent = 4 ) )
+
+    replace( f'{reports_file}.tmp', reports_file )
+
+    if failures:
+        print( f'... {len( failures )} reports of {year} could not be fetched, run the crawler again to fetch them' )
+        with open( f'{failures_file}.tmp', 'w' ) as fh:
+            fh.write( dumps( { country: failures[ country ] for country in sorted( failures ) }, indent = 4 ) )
+        replace( f'{failures_file}.tmp', failures_file )
+
+    elif exists( failures_file ):
+        remove( failures_file )
+
+
+## every year's country reports are fetched and parsed together on a bounded pool
+pool = ThreadPoolExecutor( max_workers = FETCH_CONFIG[ 'concurrency' ] )
+plans = { pool.submit( plan_year, year ): year for year in YEARS }
+contents, indexes = {}, {}
+
+## a year whose index cannot be fetched is left as it is, the next run tries it again
+for job in as_completed( plans ):
+
+    year = plans[ job ]
+
+    try:
+        contents[ year ], indexes[ year ] = job.result()
+    except Exception as e:
+        print( f'... Could not fetch the index of {year} from {index_url( year )}, skipping it: {e}' )
+
+## with --all, reports of countries we cannot place are still crawled, the processor loads them without a country id
+if CRAWL_ALL:
+    print( '... Crawling every report the indexes link to (--all), not just the countries in COUNTRIES' )
+    for country in sorted( set( country for year in indexes for country in indexes[ year ] ) ):
+        if countries.match( country ) is None:
+            print( f'... {country} does not match a known country, its reports are kept under that name' )
+
+failures = { year: {} for year in indexes }
+remaining = { year: len( indexes[ year ] ) for year in indexes }
+jobs = { pool.submit( crawl_report, url ): ( year, country, url ) for year in indexes for country, url in indexes[ year ].items() }
+
+## years without any reports to fetch are finished straight away
+for year in indexes:
+    if not remaining[ year ]:
+        write_year( year, contents.pop( year ), failures.pop( year ) )
+
+## a report that cannot be fetched is logged and noted down, the rest of the crawl carries on
+for job in as_completed( jobs ):
+
+    year, country, url = jobs[ job ]
+    remaining[ year ] = remaining[ year ] - 1
+
+    try:
+        contents[ year ][ country ], elapsed, size = job.result()
+    except Exception as e:
+        print( f'... Failed to fetch {country} in the year {year} from {url}: {e}' )
+        failures[ year ][ country ] = url
+    else:
+        if DEBUG:
+            print( f'... Processed {country} in the year {year}: {size} bytes in {elapsed:.2f}s' )
 
-        contents[ country ] = article
+    ## each year is written as soon as its last report comes in
+    if not remaining[ year ]:
+        write_year( year, contents.pop( year ), failures.pop( year ) )
 
-    
-    ## open file to write to
-    with open( f'raw/hr/{year}_hrreports.json', 'w' ) as fh:
-        print( f'Writing to file...' )
-        fh.write( dumps( contents, indent = 4 ) )
+pool.shutdown()
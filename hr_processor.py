@@ -1,116 +1,207 @@
-from collections import defaultdict
 from constants import YEARS
+from countries import CountryIndex
 from json import dump, dumps, load
-from nltk.tokenize import word_tokenize
-from nltk import pos_tag
-from nltk.corpus import stopwords, wordnet
-from nltk.stem import WordNetLemmatizer
-from re import sub
+from preprocessor import ParallelPreprocessor, PreprocessedCache
 from sqlite3 import connect, OperationalError
-from utilities import IRDictionary
-
-## REGEX TO REMOVE ANY HTML FORMATTING
-HTML_TAG = '</?\w+?>'
+from utilities import IRDictionary, LoadManifest, PhaseTimer, begin_bulk_load, end_bulk_load
 
 ## this is a class to process votes and place them into a SQLite DB
 class HRReportProcessor:
 
-    ## constructor
-    def __init__( self, filename = ":memory:" ):
+    ## constructor, the table is kept between runs and only the years whose source files changed are loaded again
+    ## args:
+    ## - filename: database to load into
+    ## - bulk: load in a single transaction with fast, non-durable settings and build the keys once the data is in
+    ## - rebuild: drop everything and load every year from scratch
+    ## - processes: number of worker processes the text is preprocessed on, defaults to one per cpu
+    def __init__( self, filename = ":memory:", bulk = False, rebuild = False, processes = None ):
 
         ## create our db object
         self.db = connect( filename )
-        self.docid = 0
+        self.bulk = bulk
+        self.timer = PhaseTimer()
+
+        ## preprocessed text is cached between runs, so a section is only preprocessed again if its text changes
+        self.preprocessor = ParallelPreprocessor( processes, cache = PreprocessedCache() )
+
+        if bulk:
+            begin_bulk_load( self.db )
+
+        ## setting up some tables for db, the key is a unique index so a bulk load can build it after inserting
+        with self.timer.phase( 'create tables' ):
+            cursor = self.db.cursor()
+
+            ## tables from before countries were canonicalized have no country ids, those are loaded again from scratch
+            columns = [ row[ 1 ] for row in cursor.execute( '''PRAGMA table_info( YEAR_COUNTRY_SECTION_RAWTEXT )''' ) ]
+            rebuild = rebuild or bool( columns ) and 'COUNTRY_ID' not in columns
+
+            if rebuild:
+                cursor.execute( '''DROP TABLE IF EXISTS YEAR_COUNTRY_SECTION_RAWTEXT''' )
+
+            cursor.execute( '''
+                CREATE TABLE IF NOT EXISTS YEAR_COUNTRY_SECTION_RAWTEXT
+                (
+                    DOCID INT
+                    , YEAR INT
+                    , COUNTRY_ID INT
+                    , COUNTRY TEXT
+                    , SECTION TEXT
+                    , RAWTEXT TEXT
+                    , FORMATTED TEXT
+                )
+            ''' )
+
+            ## the manifest records which file each loaded year came from
+            self.manifest = LoadManifest( self.db, 'YEAR_COUNTRY_SECTION_RAWTEXT' )
+
+            if rebuild:
+                self.manifest.remove()
+
+            ## the country of every report is resolved to its canonical id, shared with the votes
+            self.countries = CountryIndex( self.db )
+
+            if not bulk:
+                self.create_indexes()
+                self.db.commit()
+
+        ## documents of newly loaded years are numbered after the ones we kept
+        self.docid = cursor.execute( '''SELECT COALESCE( MAX( DOCID ) + 1, 0 ) FROM YEAR_COUNTRY_SECTION_RAWTEXT''' ).fetchone()[ 0 ]
+
+
+    ## function to create the keys of the tables
+    def create_indexes( self ):
 
-        ## setting up some tables for db
         cursor = self.db.cursor()
-        cursor.execute( '''DROP TABLE IF EXISTS YEAR_COUNTRY_SECTION_RAWTEXT''' )
-        cursor.execute( '''
-            CREATE TABLE YEAR_COUNTRY_SECTION_RAWTEXT
-            (
-                DOCID INT PRIMARY KEY
-                , YEAR INT
-                , COUNTRY INT
-                , SECTION TEXT
-                , RAWTEXT TEXT
-                , FORMATTED TEXT
-            )
-        ''' )
-        self.db.commit()
+        cursor.execute( '''CREATE UNIQUE INDEX IF NOT EXISTS YEAR_COUNTRY_SECTION_RAWTEXT_KEY ON YEAR_COUNTRY_SECTION_RAWTEXT ( DOCID )''' )
+        cursor.execute( '''CREATE INDEX IF NOT EXISTS YEAR_COUNTRY_SECTION_RAWTEXT_COUNTRY ON YEAR_COUNTRY_SECTION_RAWTEXT ( COUNTRY_ID )''' )
+
+
+    ## function to call once every year is loaded, in bulk mode this is when the keys of new tables are built
+    def finish_load( self ):
+
+        if self.bulk:
+            with self.timer.phase( 'create indexes' ):
+                self.create_indexes()
+
+
+    ## function to commit the run, in bulk mode this is the single commit of the whole load
+    def commit( self ):
+
+        with self.timer.phase( 'commit' ):
+            if self.bulk:
+                end_bulk_load( self.db )
+                self.bulk = False
+            else:
+                self.db.commit()
         
 
     ## fuction to load votes file
+    ## the year is skipped if its file is the one already loaded, otherwise the year's rows are replaced, returns whether it was loaded
     ## args:
     ## - file: name of votes file to load
     ## - year: the year of the data being processed
     def load_year( self, filename, year ):
 
+        changed, digest = self.manifest.check( year, filename )
+
+        if not changed:
+            print( f'... {filename} is unchanged, skipping {year}' )
+            return False
+
         ## open the file and store the votes
-        with open( filename, 'r' ) as fh:
+        with self.timer.phase( f'load {year}' ), open( filename, 'r' ) as fh:
+
+            self.delete_year( year )
 
             ## set up some variables for processing
             data = load( fh )
+            documents = [ ( country, section, data[ country ][ section ] ) for country in data for section in data[ country ] ]
+
+            print( f'Processing documents {self.docid} to {self.docid + len( documents ) - 1}...' )
+
+            ## the text of every section is preprocessed across the worker pool
+            formatted = self.preprocessor.process_all( [ raw for _, _, raw in documents ] )
             insert = []
-            tag_map = defaultdict( lambda : wordnet.NOUN )
-            tag_map[ 'J' ] = wordnet.ADJ
-            tag_map[ 'V' ] = wordnet.VERB
-            tag_map[ 'R' ] = wordnet.ADV
-
-            ## insert each resolution into a list
-            for country in data:
-                for section in data[ country ]:
-
-                    print( f'Processing document {self.docid}...' )
-                    
-                    raw = data[ country ][ section ]
-
-                    ## we perform some text processing
-                    ## processing is based on guide posted here: https://medium.com/@bedigunjit/simple-guide-to-text-classification-nlp-using-svm-and-naive-bayes-with-python-421db3a72d34
-                    formatted = sub( HTML_TAG, "", raw )
-                    formatted = word_tokenize( formatted )
-
-                    words = []
-                    word_lemmatizer = WordNetLemmatizer()
-
-                    for word, tag in pos_tag( formatted ):
-
-                        if word not in stopwords.words( 'english' ) and word.isalpha():
-                            words.append( word_lemmatizer.lemmatize( word, tag_map[ tag[ 0 ] ] ) )
-
-                    final_formatted = " ".join( words )
-                    
-                    ## now we insert into our database
-                    insert.append(
-                        (
-                            self.docid
-                          , year 
-                          , country 
-                          , section 
-                          , raw 
-                          , final_formatted
-                        )
+
+            for ( country, section, raw ), final_formatted in zip( documents, formatted ):
+
+                ## now we insert into our database
+                insert.append(
+                    (
+                        self.docid
+                      , year 
+                      , self.countries.resolve( country )
+                      , country 
+                      , section 
+                      , raw 
+                      , final_formatted
                     )
-                    self.docid = self.docid + 1
+                )
+                self.docid = self.docid + 1
 
             ## now we insert into the database
             cursor = self.db.cursor()
             cursor.executemany( '''
                 INSERT INTO
-                YEAR_COUNTRY_SECTION_RAWTEXT ( DOCID, YEAR, COUNTRY, SECTION, RAWTEXT, FORMATTED )
-                VALUES ( ?, ?, ?, ?, ?, ? )
+                YEAR_COUNTRY_SECTION_RAWTEXT ( DOCID, YEAR, COUNTRY_ID, COUNTRY, SECTION, RAWTEXT, FORMATTED )
+                VALUES ( ?, ?, ?, ?, ?, ?, ? )
             ''', insert )
+            self.manifest.record( year, digest, filename )
+
+            if not self.bulk:
+                self.db.commit()
+
+        return True
+
+
+    ## function to delete a year's rows
+    ## args:
+    ## - year: the year to delete
+    def delete_year( self, year ):
+
+        cursor = self.db.cursor()
+        cursor.execute( '''DELETE FROM YEAR_COUNTRY_SECTION_RAWTEXT WHERE YEAR = ?''', ( year, ) )
+
+
+    ## function to drop the years that are loaded but no longer wanted, returns the years dropped
+    ## args:
+    ## - years: the years to keep
+    def prune_years( self, years ):
+
+        dropped = [ year for year in self.manifest.years() if year not in [ str( el ) for el in years ] ]
+
+        for year in dropped:
+            print( f'... Dropping {year}' )
+            self.delete_year( year )
+            self.manifest.remove( year )
+
+        if dropped and not self.bulk:
             self.db.commit()
 
+        return dropped
+
 
 
-## initalize some accounting variables
-hr_report_processor = HRReportProcessor( 'processed/model.db' )
+## initalize some accounting variables, only changed years are loaded and they are bulk loaded
+hr_report_processor = HRReportProcessor( 'processed/model.db', bulk = True )
 
 ## go through our vote collection
+hr_report_processor.prune_years( YEARS )
 for year in YEARS:
     print( f'Processing file for {year}...' )
     hr_report_processor.load_year( f'raw/hr/{year}_hrreports.json', year )
 
+## everything from this run is committed at once
+hr_report_processor.finish_load()
+hr_report_processor.commit()
+print( f'Preprocessed text cache: {hr_report_processor.preprocessor.cache.statistics()}' )
+hr_report_processor.preprocessor.close()
+hr_report_processor.timer.report()
+
+## time spent in each preprocessing stage, added up over the worker processes
+print( 'Preprocessing stages (summed over workers):' )
+hr_report_processor.preprocessor.timer.report()
+
 
 """
 print( f'Processing files...' )
@@ -143,13 +234,11 @@ print( f'Creating index and dictionary files...' )
 ## setting up some variables
 dictionary = IRDictionary()
 
-DICTIONARY_FILENAME = 'processed/hr/dictionary.json'
+DICTIONARY_FILENAME = 'processed/hr/dictionary.bin'
 INDEX_FILENAME = 'processed/hr/index.bin'
 
-dictionary.read_collection( corpus )
-dictionary.attach_index( INDEX_FILENAME )
-
-dictionary.write_index( INDEX_FILENAME )
+## postings are flushed to block files as we go so memory stays bounded
+dictionary.build_index( corpus, INDEX_FILENAME )
 dictionary.write_dictionary( DICTIONARY_FILENAME )
 
 with open( f'processed/hr/document_map.json', 'w' ) as fh:
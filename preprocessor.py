@@ -0,0 +1,282 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from multiprocessing import get_all_start_methods, get_context
+from nltk import __version__ as NLTK_VERSION, pos_tag
+from nltk.corpus import stopwords, wordnet
+from nltk.stem import WordNetLemmatizer
+from nltk.tokenize import word_tokenize
+from os import cpu_count, makedirs
+from os.path import dirname
+from re import compile
+from sqlite3 import connect
+from time import perf_counter
+from utilities import IRLRUCache, PhaseTimer
+
+## REGEX TO REMOVE ANY HTML FORMATTING
+HTML_TAG = compile( r'</?\w+?>' )
+
+## preprocessing settings, documents are handed to worker processes a chunk at a time
+LEMMA_CACHE_SIZE = 200000
+CHUNK_SIZE = 16
+
+## version of the preprocessing pipeline, bump it whenever the output of TextPreprocessor changes so cached text is redone
+## the nltk version is part of it too, since its tagger and lemmatizer decide the output as much as we do
+PIPELINE_VERSION = f'2-nltk{NLTK_VERSION}'
+
+## preprocessed text is kept here between runs, shared by everything that preprocesses report text
+PREPROCESSED_FILENAME = 'processed/preprocessed.db'
+
+## the stages a document goes through, in order
+STAGES = [ 'strip', 'tokenize', 'tag', 'lemmatize' ]
+
+## the engine of each worker process, built once when the worker starts
+WORKER_PREPROCESSOR = None
+
+
+## this is a class to turn raw report text into the space separated lemmas we index and classify
+## processing is based on guide posted here: https://medium.com/@bedigunjit/simple-guide-to-text-classification-nlp-using-svm-and-naive-bayes-with-python-421db3a72d34
+class TextPreprocessor:
+
+    ## constructor, the stopwords, lemmatizer and tag map are loaded once and shared by every document
+    ## arguments:
+    ##      - cache_size: maximum number of ( word, pos ) to lemma entries remembered
+    def __init__( self, cache_size = LEMMA_CACHE_SIZE ):
+        self.stops = frozenset( stopwords.words( 'english' ) )
+        self.lemmatizer = WordNetLemmatizer()
+        self.lemma_cache = IRLRUCache( cache_size )
+        self.timings = dict.fromkeys( STAGES, 0 )
+
+        self.tag_map = defaultdict( lambda : wordnet.NOUN )
+        self.tag_map[ 'J' ] = wordnet.ADJ
+        self.tag_map[ 'V' ] = wordnet.VERB
+        self.tag_map[ 'R' ] = wordnet.ADV
+
+
+    ## function to lemmatize a word, lemmas are remembered since the same words come up over and over
+    ## arguments:
+    ##      - word: word to lemmatize
+    ##      - pos: wordnet part of speech of the word
+    def lemmatize( self, word, pos ):
+
+        lemma = self.lemma_cache.get( ( word, pos ) )
+
+        if lemma is None:
+            lemma = self.lemmatizer.lemmatize( word, pos )
+            self.lemma_cache.put( ( word, pos ), lemma )
+
+        return lemma
+
+
+    ## function to process a single document, the time spent in each stage is added to the timings
+    ## arguments:
+    ##      - raw: raw text of the document
+    def process( self, raw ):
+
+        start = perf_counter()
+        formatted = HTML_TAG.sub( "", raw )
+        stripped = perf_counter()
+        formatted = word_tokenize( formatted )
+        tokenized = perf_counter()
+        tagged = pos_tag( formatted )
+        tagging = perf_counter()
+
+        ## the text keeps its case for tagging, so stopwords are matched in lower case to drop "The" as well as "the"
+        words = [ self.lemmatize( word, self.tag_map[ tag[ 0 ] ] ) for word, tag in tagged if word.lower() not in self.stops and word.isalpha() ]
+        end = perf_counter()
+
+        for stage, seconds in zip( STAGES, ( stripped - start, tokenized - stripped, tagging - tokenized, end - tagging ) ):
+            self.timings[ stage ] = self.timings[ stage ] + seconds
+
+        return " ".join( words )
+
+
+## function run when a worker process starts, builds the engine the worker reuses for every chunk
+## arguments:
+##      - cache_size: maximum number of ( word, pos ) to lemma entries remembered by the worker
+def start_worker( cache_size ):
+
+    global WORKER_PREPROCESSOR
+    WORKER_PREPROCESSOR = TextPreprocessor( cache_size )
+
+
+## function to process a chunk of documents, returns the processed texts and the time spent in each stage
+## arguments:
+##      - chunk: raw texts of the documents
+##      - preprocessor: engine to use, defaults to the worker's own
+def process_chunk( chunk, preprocessor = None ):
+
+    preprocessor = preprocessor or WORKER_PREPROCESSOR
+    preprocessor.timings = dict.fromkeys( STAGES, 0 )
+
+    return [ preprocessor.process( raw ) for raw in chunk ], preprocessor.timings
+
+
+## this is a class to keep preprocessed text between runs, keyed by the hash of the raw text and the pipeline version
+## a text is only preprocessed again if it changes or the pipeline does
+class PreprocessedCache:
+
+    ## constructor for cache, entries made by other versions of the pipeline are dropped
+    ## arguments:
+    ##      - filename: sqlite database the cache is kept in
+    ##      - version: version of the pipeline the entries belong to
+    def __init__( self, filename = PREPROCESSED_FILENAME, version = PIPELINE_VERSION ):
+
+        if dirname( filename ):
+            makedirs( dirname( filename ), exist_ok = True )
+
+        self.db = connect( filename )
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+
+        self.db.execute( '''
+            CREATE TABLE IF NOT EXISTS PREPROCESSED_TEXT
+            (
+                HASH TEXT
+                , VERSION TEXT
+                , PREPROCESSED TEXT
+                , PRIMARY KEY( HASH, VERSION )
+            )
+        ''' )
+        self.db.execute( '''DELETE FROM PREPROCESSED_TEXT WHERE VERSION <> ?''', ( version, ) )
+        self.db.commit()
+
+
+    ## function to get the hash a raw text is cached under
+    ## arguments:
+    ##      - raw: raw text
+    def key( self, raw ):
+
+        return sha256( raw.encode( 'utf-8' ) ).hexdigest()
+
+
+    ## function to look up texts, returns a hash to preprocessed text dictionary of the ones found
+    ## arguments:
+    ##      - keys: hashes of the raw texts
+    def lookup( self, keys ):
+
+        found = {}
+        keys = list( set( keys ) )
+
+        ## looked up in slices to stay under sqlite's limit on query parameters
+        for i in range( 0, len( keys ), 500 ):
+            part = keys[ i : i + 500 ]
+            found.update( self.db.execute( f'''
+                SELECT HASH, PREPROCESSED FROM PREPROCESSED_TEXT WHERE VERSION = ? AND HASH IN ( {','.join( '?' * len( part ) )} )
+            ''', [ self.version ] + part ) )
+
+        self.hits = self.hits + len( found )
+        self.misses = self.misses + len( keys ) - len( found )
+
+        return found
+
+
+    ## function to store preprocessed texts
+    ## arguments:
+    ##      - entries: hash to preprocessed text dictionary
+    def store( self, entries ):
+
+        self.db.executemany( '''
+            INSERT OR REPLACE INTO PREPROCESSED_TEXT ( HASH, VERSION, PREPROCESSED ) VALUES ( ?, ?, ? )
+        ''', [ ( key, self.version, text ) for key, text in entries.items() ] )
+        self.db.commit()
+
+
+    ## function to get the hit and miss counts of the cache
+    def statistics( self ):
+
+        return { 'hits': self.hits, 'misses': self.misses, 'size': self.db.execute( '''SELECT COUNT( * ) FROM PREPROCESSED_TEXT''' ).fetchone()[ 0 ] }
+
+
+    ## function to close the cache
+    def close( self ):
+
+        self.db.close()
+
+
+## this is a class to preprocess many documents at once across a pool of worker processes
+class ParallelPreprocessor:
+
+    ## constructor, the pool is started on first use and kept for later batches
+    ## arguments:
+    ##      - processes: number of worker processes, 1 processes documents in this process, defaults to one per cpu
+    ##      - chunk_size: number of documents handed to a worker at a time
+    ##      - cache_size: maximum number of ( word, pos ) to lemma entries remembered by each worker
+    ##      - cache: optional PreprocessedCache, texts found in it are not preprocessed again
+    def __init__( self, processes = None, chunk_size = CHUNK_SIZE, cache_size = LEMMA_CACHE_SIZE, cache = None ):
+        self.processes = processes or cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        self.cache = cache
+        self.pool = None
+
+        ## the engine used when documents are processed in this process
+        self.local = None
+
+        ## time spent in each stage, summed over every worker
+        self.timer = PhaseTimer()
+
+        ## workers are forked so they do not rerun the script that started them, where we cannot fork we work serially
+        if 'fork' not in get_all_start_methods():
+            self.processes = 1
+
+
+    ## function to preprocess documents, returns the processed texts in the same order
+    ## with a cache only the texts it does not hold are preprocessed, and those are added to it
+    ## arguments:
+    ##      - texts: raw texts of the documents
+    def process_all( self, texts ):
+
+        if self.cache is None:
+            return self.process_texts( texts )
+
+        keys = [ self.cache.key( raw ) for raw in texts ]
+        found = self.cache.lookup( keys )
+
+        ## each distinct missing text is preprocessed once, even if it appears more than once
+        missing = { key: raw for key, raw in zip( keys, texts ) if key not in found }
+        processed = dict( zip( missing, self.process_texts( list( missing.values() ) ) ) )
+        self.cache.store( processed )
+        found.update( processed )
+
+        return [ found[ key ] for key in keys ]
+
+
+    ## function to preprocess documents without the cache, returns the processed texts in the same order
+    ## arguments:
+    ##      - texts: raw texts of the documents
+    def process_texts( self, texts ):
+
+        chunks = [ texts[ i : i + self.chunk_size ] for i in range( 0, len( texts ), self.chunk_size ) ]
+
+        if self.processes == 1:
+            if self.local is None:
+                self.local = TextPreprocessor( self.cache_size )
+            results = ( process_chunk( chunk, self.local ) for chunk in chunks )
+
+        else:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor( max_workers = self.processes, mp_context = get_context( 'fork' ), initializer = start_worker, initargs = ( self.cache_size, ) )
+            results = self.pool.map( process_chunk, chunks )
+
+        processed = []
+
+        for chunk, timings in results:
+            processed.extend( chunk )
+            for stage, seconds in timings.items():
+                self.timer.add( stage, seconds )
+
+        return processed
+
+
+    ## function to stop the worker processes and close the cache
+    def close( self ):
+
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
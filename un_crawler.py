@@ -1,137 +1,65 @@
-from bs4 import BeautifulSoup
-from constants import DEBUG, COUNTRIES, YEARS, UN_CONFIG
-from json import dumps, load
-from re import DOTALL, findall
-from utilities import download, unpack
+from constants import DEBUG, COUNTRIES, YEARS, CACHE_CONFIG, FETCH_CONFIG, UN_CONFIG
+from extractors import parse_un_record, parse_un_search
+from json import dumps
+from utilities import CrawlJournal, Fetcher, ResponseCache, unpack
 
 
 ## serach results querying info
-LINK_REGEX = '<a class="moreinfo" href="/record/(.*?)">'
 PAGE_SIZE = 200
 
-## content web page info
-TITLE_DIV_REGEX = '<div class="full-record-title">(.*?)</div>'
-VOTE_DIV_REGEX = '\A<div class="metadata-row"><span class="title col-xs-12 col-sm-3 col-md-2">Vote[^\w][^\w]'
-VOTE_SPAN_REGEX = '<span class="value col-xs-12 col-sm-9 col-md-10">(.*?)</span>'
-VOTE_PATTERN_REGEX = '([YNA\s]) (.*?)<br/?>'
-SECOND_VOTE_PATTERN_REGEX = ' ([YNA\s]) (.*)'
 
+## record pages are fetched concurrently over pooled connections and cached on disk between runs
+fetcher = Fetcher( cache = ResponseCache( **CACHE_CONFIG ), **FETCH_CONFIG )
 
 ## we go through each year
 for year in YEARS:
 
-    ## this is our vote content dictionary
-    content = {}
+    ## records we already have are kept in a journal, so an interrupted crawl picks up where it stopped
+    journal = CrawlJournal( f'raw/un/{year}_unvotes.jsonl' )
     
     ## we now loop over pages
     for i in range( 0, PAGE_SIZE * 10, PAGE_SIZE ):
 
-        ## this will count our total results from the last page
-        pages = []
-
         ## we unpack the URL
         url = unpack( UN_CONFIG[ 'baseURL' ], dict( zip( UN_CONFIG[ "q" ], [ str( i ), str( PAGE_SIZE ), str( year ) ] ) ) )
 
         if DEBUG:
             print( f'... Fetching data from URL: {url}' )
 
-        ## we fetch data from the URL
-        article = {}
-        data = download( url )
-        soup = BeautifulSoup( data, 'html.parser' )
-
-        ## we loop through HTML sections for text
-        for section in soup.find_all( 'a' ):
+        ## we fetch data from the URL and pull the record ids out of the results in one pass
+        pages = parse_un_search( fetcher.fetch( url ) )
 
-            ## convert to string please
-            section = str( section )
+        ## loop over the found pages we do not have yet, which are fetched concurrently in the background
+        new_pages = [ page for page in pages if page not in journal ]
+        urls = [ unpack( UN_CONFIG[ 'recordURL' ], { 'record': page } ) for page in new_pages ]
 
-            ## we look only for sections with relevant text
-            tsection = findall( LINK_REGEX, section, flags = DOTALL )
-
-            ## if not a match... we continue!
-            if not len( tsection ):
-                continue
-
-            ## append result to the last page length
-            pages.append( tsection[ 0 ] )
-                
-
-        ## loop over the found pages:
-        for page in pages:
+        if DEBUG:
+            print( f'... {len( pages ) - len( new_pages )} of {len( pages )} records already crawled' )
 
-            ## get the data
-            data = str( download( f'https://digitallibrary.un.org/record/{page}' ) )
-            soup = BeautifulSoup( data, 'html.parser' )
-            title, votes = None, None
+        for page, ( url, data ) in zip( new_pages, fetcher.fetch_all( urls ) ):
 
-            ## loop over the div tags until we find the voting meat
-            for el in soup.find_all( 'div' ):
+            ## title and vote rows are extracted in a single pass over the page, with run together vote rows already split out
+            title, votes = parse_un_record( data )
 
-                ## regex pattern for title
-                if findall( TITLE_DIV_REGEX, str( el ), flags = DOTALL ):
-                    title = str( el )                
+            print( f'Results at: {url}' )
 
-                ## regex pattern for votes
-                if findall( VOTE_DIV_REGEX, str( el ), flags = DOTALL ):
-                    votes = str( el )
+            if title is None:
+                print( f'... No resolution title found at {url}, skipping' )
+                continue
 
-            
-            print( f'Results at: https://digitallibrary.un.org/record/{page}' )
-            title = findall( TITLE_DIV_REGEX, title, flags = DOTALL )[ 0 ].strip()
-            votes = findall( VOTE_PATTERN_REGEX, votes, flags = DOTALL )
-            votes = dict( [ ( el2, el1 ) for el1, el2 in votes ] )
-            content[ title ] = votes
+            journal.append( page, { 'title': title, 'votes': votes } )
 
         ## did we hit page size? if not, stop.
         if len( pages ) < PAGE_SIZE:
             print( '... Found all results for {year}' )
             break
 
-    ## open file to write to
-    with open( f'raw/un/{year}_unvotes.json', 'w' ) as fh:
-        print( f'Writing to file...' )
-        fh.write( dumps( content, indent = 4 ) )
-
-
-
-## this is a quick algorithm to fix some messed up tags that are scraped from the UN website
-for year in YEARS:
-
-    ndata = {}
-
-    ## we loop over our written files
-    with open( f'raw/un/{year}_unvotes.json', 'r' ) as fh:
-
-        data = load( fh )
-
-        for key in data:
-
-            ndata[ key ] = {}
-            
-            for el in data[ key ]:
-
-                overwrite = None
-                spl = el.split( "<br>" )
-                
-                if len( spl ) > 1:
-                    overwrite = { spl[ 0 ] : data[ key ][ el ] }
-                        
-                    for e in el.split( "<br>" ):
-
-                        votes = findall( SECOND_VOTE_PATTERN_REGEX, e, flags = DOTALL )
-                                  
-                        if votes:
-                            for vote in votes:
-                                  overwrite[ vote[ 1 ] ] = vote[ 0 ]
-
-                    for e in overwrite:
-                        ndata[ key ][ e ] = overwrite[ e ]
-                        
-                else:
-                    ndata[ key ][ el ] = data[ key ][ el ]
+    journal.close()
 
+    ## the year's votes are assembled from every record in the journal
+    content = { entry[ 'title' ]: entry[ 'votes' ] for entry in journal.entries.values() }
 
+    ## open file to write to
     with open( f'raw/un/{year}_unvotes.json', 'w' ) as fh:
         print( f'Writing to file...' )
-        fh.write( dumps( ndata, indent = 4 ) )
+        fh.write( dumps( content, indent = 4 ) )
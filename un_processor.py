@@ -1,179 +1,347 @@
+from alignment import AlignmentStore, load_vote_matrix
 from constants import YEARS
-from json import load
+from countries import CountryIndex
 from sqlite3 import connect, OperationalError
+from utilities import LoadManifest, PhaseTimer, begin_bulk_load, end_bulk_load, iter_json_items
+
+## number of resolutions handed to sqlite at a time while a year is streamed in
+BATCH_SIZE = 500
 
 ## this is a class to process votes and place them into a SQLite DB
 class UNVoteProcessor:
 
-    ## constructor
-    def __init__( self, filename = ":memory:" ):
+    ## constructor, tables are kept between runs and only the years whose source files changed are loaded again
+    ## args:
+    ## - filename: database to load into
+    ## - bulk: load in a single transaction with fast, non-durable settings and build the keys once the data is in
+    ## - rebuild: drop everything and load every year from scratch
+    def __init__( self, filename = ":memory:", bulk = False, rebuild = False ):
 
         ## create our db object
         self.db = connect( filename )
+        self.bulk = bulk
+        self.timer = PhaseTimer()
+        self.legacy = False
+
+        if bulk:
+            begin_bulk_load( self.db )
+
+        ## setting up some tables for db, their keys are unique indexes so a bulk load can build them after inserting
+        ## votes are kept a resolution per row, as one byte per country holding the code of its vote, 0 where it has none
+        ## countries are coded by their canonical id, which is their position in the bytes, and votes against their own lookup table
+        with self.timer.phase( 'create tables' ):
+            cursor = self.db.cursor()
+
+            ## databases from before the votes were packed kept them a vote per row in a table, and ones from before countries
+            ## were canonicalized coded them against a COUNTRIES table of their own, both are loaded again from scratch
+            legacy = cursor.execute( '''
+                SELECT NAME FROM sqlite_master WHERE TYPE = 'table' AND NAME IN ( 'YEAR_RESOLUTION_COUNTRY_VOTES', 'COUNTRIES' )
+            ''' ).fetchall()
+
+            for ( table, ) in legacy:
+                cursor.execute( f'''DROP TABLE {table}''' )
+                rebuild = True
+                self.legacy = True
+
+            if legacy:
+                LoadManifest( self.db, 'YEAR_RESOLUTION_COUNTRY_VOTES' ).remove()
+
+            if rebuild:
+                cursor.execute( '''DROP VIEW IF EXISTS YEAR_RESOLUTION_COUNTRY_VOTES''' )
+                cursor.execute( '''DROP TABLE IF EXISTS RESOLUTION_VOTES''' )
+                cursor.execute( '''DROP TABLE IF EXISTS RESOLUTIONS''' )
+
+            cursor.execute( '''
+                CREATE TABLE IF NOT EXISTS VOTE_CODES
+                (
+                    VOTE_ID INTEGER PRIMARY KEY
+                    , VOTE TEXT UNIQUE
+                )
+            ''' )
+            cursor.execute( '''
+                CREATE TABLE IF NOT EXISTS RESOLUTION_VOTES
+                (
+                    YEAR INT
+                    , RESOLUTION_ID INT
+                    , VOTES BLOB
+                )
+            ''' )
+            cursor.execute( '''
+                CREATE TABLE IF NOT EXISTS RESOLUTIONS
+                (
+                    YEAR INT
+                    , RESOLUTION_ID INT
+                    , RESOLUTION_NAME TEXT
+                )            
+            ''' )
+
+            ## the votes a row at a time, unpacked on the fly for ad hoc queries, codes stay below 128 so unicode() reads the byte
+            cursor.execute( '''
+                CREATE VIEW IF NOT EXISTS YEAR_RESOLUTION_COUNTRY_VOTES AS
+                SELECT
+                    r.YEAR
+                    , r.RESOLUTION_ID
+                    , c.COUNTRY
+                    , v.VOTE
+                FROM RESOLUTION_VOTES r
+                INNER JOIN CANONICAL_COUNTRIES c
+                    ON c.COUNTRY_ID < LENGTH( r.VOTES )
+                INNER JOIN VOTE_CODES v
+                    ON v.VOTE_ID = UNICODE( SUBSTR( r.VOTES, c.COUNTRY_ID + 1, 1 ) )
+            ''' )
+
+            ## the manifest records which file each loaded year came from
+            self.manifest = LoadManifest( self.db, 'RESOLUTION_VOTES' )
+
+            ## the country statuses are worked out again too, since they are keyed by country id
+            if rebuild:
+                self.manifest.remove()
+                LoadManifest( self.db, 'COUNTRY_STATUS' ).remove()
+
+            ## every spelling of a country in the votes is resolved to its canonical id
+            self.countries = CountryIndex( self.db )
+
+            ## vote codes handed out so far, new votes get the next free code as they turn up
+            self.vote_ids = dict( cursor.execute( '''SELECT VOTE, VOTE_ID FROM VOTE_CODES''' ) )
+
+            if not bulk:
+                self.create_indexes()
+                self.db.commit()
+
+
+    ## function to create the keys of the tables
+    def create_indexes( self ):
 
-        ## setting up some tables for db
         cursor = self.db.cursor()
-        cursor.execute( '''DROP TABLE IF EXISTS YEAR_RESOLUTION_COUNTRY_VOTES''' )
-        cursor.execute( '''
-            CREATE TABLE YEAR_RESOLUTION_COUNTRY_VOTES
-            (
-                YEAR INT
-                , RESOLUTION_ID INT
-                , COUNTRY TEXT
-                , VOTE TEXT
-                , PRIMARY KEY( YEAR, RESOLUTION_ID, COUNTRY )
-            )
-        ''' )
-        cursor.execute( '''DROP TABLE IF EXISTS RESOLUTIONS''' )
-        cursor.execute( '''
-            CREATE TABLE RESOLUTIONS
-            (
-                YEAR INT
-                , RESOLUTION_ID INT
-                , RESOLUTION_NAME TEXT
-                , PRIMARY KEY (YEAR, RESOLUTION_ID)
-            )            
-        ''' )
-        self.db.commit()
-        
+        cursor.execute( '''CREATE UNIQUE INDEX IF NOT EXISTS RESOLUTION_VOTES_KEY ON RESOLUTION_VOTES ( YEAR, RESOLUTION_ID )''' )
+        cursor.execute( '''CREATE UNIQUE INDEX IF NOT EXISTS RESOLUTIONS_KEY ON RESOLUTIONS ( YEAR, RESOLUTION_ID )''' )
+
+
+    ## function to call once every year is loaded, in bulk mode this is when the keys of new tables are built
+    def finish_load( self ):
+
+        if self.bulk:
+            with self.timer.phase( 'create indexes' ):
+                self.create_indexes()
+
+
+    ## function to commit the run, in bulk mode this is the single commit of the whole load
+    def commit( self ):
+
+        with self.timer.phase( 'commit' ):
+            if self.bulk:
+                end_bulk_load( self.db )
+                self.bulk = False
+            else:
+                self.db.commit()
 
-    ## fuction to load votes file
+        ## the dropped legacy tables leave most of the file as free pages, vacuum cannot run in a transaction so it comes after the commit
+        if self.legacy:
+            with self.timer.phase( 'vacuum' ):
+                self.db.execute( '''VACUUM''' )
+            self.legacy = False
+
+
+    ## function to get the code of a vote, votes seen for the first time are added to the lookup table
+    ## args:
+    ## - cursor: cursor to insert with
+    ## - vote: vote to code
+    def vote_code( self, cursor, vote ):
+
+        if vote not in self.vote_ids:
+            cursor.execute( '''INSERT INTO VOTE_CODES ( VOTE_ID, VOTE ) VALUES ( NULL, ? )''', ( vote, ) )
+            self.vote_ids[ vote ] = cursor.lastrowid
+
+            if self.vote_ids[ vote ] > 127:
+                raise ValueError( f'Too many distinct votes to pack into a byte, {vote} would be coded {self.vote_ids[ vote ]}' )
+
+        return self.vote_ids[ vote ]
+
+
+    ## function to pack the votes of a resolution, byte i holds the code of country i's vote
+    ## args:
+    ## - cursor: cursor to insert new codes with
+    ## - countries: country to vote dictionary of the resolution
+    def pack_votes( self, cursor, countries ):
+
+        ## spellings that name no known country have no byte to go in and are left out
+        votes = [ ( self.countries.resolve( country ), self.vote_code( cursor, vote ) ) for country, vote in countries.items() ]
+        votes = [ ( country_id, vote_id ) for country_id, vote_id in votes if country_id is not None ]
+        packed = bytearray( max( [ country_id for country_id, _ in votes ], default = -1 ) + 1 )
+
+        for country_id, vote_id in votes:
+            packed[ country_id ] = vote_id
+
+        return bytes( packed )
+
+
+    ## fuction to load votes file, resolutions are streamed from the file so memory does not grow with its size
+    ## the year is skipped if its file is the one already loaded, otherwise the year's rows are replaced, returns whether it was loaded
     ## args:
     ## - file: name of votes file to load
     ## - year: the year of the data being processed
-    def load_year( self, filename, year ):
+    ## - batch_size: number of resolutions inserted at a time
+    def load_year( self, filename, year, batch_size = BATCH_SIZE ):
+
+        changed, digest = self.manifest.check( year, filename )
+
+        if not changed:
+            print( f'... {filename} is unchanged, skipping {year}' )
+            return False
 
         ## open the file and store the votes
-        with open( filename, 'r' ) as fh:
-
-            ## set up some variables for processing
-            data = load( fh )
-            insert = []
-            resolutions = dict( zip( data.keys(), range( len( data ) ) ) )
-
-            ## insert each resolution into a list
-            for resolution in data:
-                for country in data[ resolution ]:
-                    insert.append(
-                        ( year \
-                          , resolutions[ resolution ] \
-                          , country \
-                          , data[ resolution ][ country ]
-                        )
-                    )
-
-            ## now we insert into the database
+        with self.timer.phase( f'load {year}' ), open( filename, 'r' ) as fh:
+
+            self.delete_year( year )
+
             cursor = self.db.cursor()
-            cursor.executemany( '''
-                INSERT INTO
-                YEAR_RESOLUTION_COUNTRY_VOTES ( YEAR, RESOLUTION_ID, COUNTRY, VOTE )
-                VALUES ( ?, ?, ?, ? )
-            ''', insert )
-            cursor.executemany( '''
-                INSERT INTO
-                RESOLUTIONS ( YEAR, RESOLUTION_NAME, RESOLUTION_ID )
-                VALUES ( ?, ?, ? )
-            ''', [ ( year, el1, el2 ) for el1, el2 in resolutions.items() ]  )
+            resolutions, votes = [], []
+
+            ## resolutions are read one at a time and inserted once a batch fills up
+            for resolution_id, ( resolution, countries ) in enumerate( iter_json_items( fh ) ):
+
+                resolutions.append( ( year, resolution, resolution_id ) )
+                votes.append( ( year, resolution_id, self.pack_votes( cursor, countries ) ) )
+
+                if len( votes ) >= batch_size:
+                    self.insert_rows( cursor, resolutions, votes )
+                    resolutions, votes = [], []
+
+            self.insert_rows( cursor, resolutions, votes )
+            self.manifest.record( year, digest, filename )
+
+            if not self.bulk:
+                self.db.commit()
+
+        return True
+
+
+    ## function to delete a year's rows
+    ## args:
+    ## - year: the year to delete
+    def delete_year( self, year ):
+
+        cursor = self.db.cursor()
+        cursor.execute( '''DELETE FROM RESOLUTION_VOTES WHERE YEAR = ?''', ( year, ) )
+        cursor.execute( '''DELETE FROM RESOLUTIONS WHERE YEAR = ?''', ( year, ) )
+
+
+    ## function to drop the years that are loaded but no longer wanted, returns the years dropped
+    ## args:
+    ## - years: the years to keep
+    def prune_years( self, years ):
+
+        dropped = [ year for year in self.manifest.years() if year not in [ str( el ) for el in years ] ]
+
+        for year in dropped:
+            print( f'... Dropping {year}' )
+            self.delete_year( year )
+            self.manifest.remove( year )
+
+        if dropped and not self.bulk:
             self.db.commit()
 
+        return dropped
+
+
+    ## function to insert a batch of rows into the vote and resolution tables
+    ## args:
+    ## - cursor: cursor to insert with
+    ## - resolutions: ( year, resolution name, resolution id ) rows
+    ## - votes: ( year, resolution id, packed votes ) rows
+    def insert_rows( self, cursor, resolutions, votes ):
+
+        cursor.executemany( '''
+            INSERT INTO
+            RESOLUTION_VOTES ( YEAR, RESOLUTION_ID, VOTES )
+            VALUES ( ?, ?, ? )
+        ''', votes )
+        cursor.executemany( '''
+            INSERT INTO
+            RESOLUTIONS ( YEAR, RESOLUTION_NAME, RESOLUTION_ID )
+            VALUES ( ?, ?, ? )
+        ''', resolutions )
+
     
-## first we collect our datasets by country by year
-un_vote_processor = UNVoteProcessor( 'processed/model.db' )
+## first we collect our datasets by country by year, only changed years are loaded and they are bulk loaded
+un_vote_processor = UNVoteProcessor( 'processed/model.db', bulk = True )
 
 ## go through our vote collection
-for year in YEARS:
-    un_vote_processor.load_year( f'raw/un/{year}_unvotes.json', year )
-
-
-## we open a connection to our database
-cursor = un_vote_processor.db.cursor()
-
-## this complicated little query is a way for us to classify our countries
-## the logic here is actually pretty simple (despite looking complicated)
-## we are calculating the overlapping voting percentages across all resoutions between a country and the US
-query = '''
-    WITH cte_USVotes AS
-    (
-        SELECT
-            YEAR
-            , RESOLUTION_ID
-            , VOTE
-        FROM YEAR_RESOLUTION_COUNTRY_VOTES
-        WHERE COUNTRY = 'UNITED STATES'
-    )
-    , cte_TotalVotes AS
-    (
-        SELECT
-            v.YEAR
-            , v.COUNTRY
-            , COUNT( v.COUNTRY ) AS N_VOTES
-        FROM YEAR_RESOLUTION_COUNTRY_VOTES v
-        INNER JOIN cte_USVotes us
-            ON us.RESOLUTION_ID = v.RESOLUTION_ID
-            AND us.YEAR = v.YEAR
-        GROUP BY v.YEAR
-            , v.COUNTRY
-        HAVING COUNT( v.COUNTRY ) > 10
-    )
-    , cte_Alignment AS
-    (
-        SELECT
-            r.YEAR
-            , r.COUNTRY
-            , COUNT( r.VOTE ) AS ALIGNMENT
-        FROM YEAR_RESOLUTION_COUNTRY_VOTES r
-        INNER JOIN cte_USVotes c
-            ON c.YEAR = r.YEAR
-            AND c.RESOLUTION_ID = r.RESOLUTION_ID
-            AND c.VOTE = r.VOTE
-        GROUP BY r.YEAR
-            , r.COUNTRY
-    )
-    SELECT
-        a.COUNTRY
-        , SUM( ALIGNMENT ) * 1.0 / SUM( N_VOTES ) AS VOTING_PERCENTAGE
-    FROM cte_Alignment a
-    INNER JOIN cte_TotalVotes v
-        ON a.YEAR = v.YEAR
-        AND a.COUNTRY = v.COUNTRY
-    WHERE a.COUNTRY <> 'UNITED STATES'
-    GROUP BY a.COUNTRY
-    ORDER BY SUM( ALIGNMENT ) * 1.0 / SUM( N_VOTES ) DESC
-'''
-
-## we now loop over our results and assign classes based on what we see
-results = cursor.execute( query ).fetchall()
-classes = []
-
-## this is dumb code, but just a simple way to get classes based on insight from another analysis
-for i in range( len( results ) ):
-
-    if i <= 60:
-        classes.append( ( results[ i ][ 0 ], 'ALLY' ) )
-    else:
-        classes.append( ( results[ i ][ 0 ], 'OPPOSED' ) )
-
-## setting our classes
-cursor = un_vote_processor.db.cursor()
-cursor.execute( '''DROP TABLE IF EXISTS COUNTRY_STATUS''' )
-cursor.execute( '''
-    CREATE TABLE COUNTRY_STATUS
-    (
-        COUNTRY TEXT
-        , STATUS TEXT
-    )
-''' )
-un_vote_processor.db.commit()
-
-cursor = un_vote_processor.db.cursor()
-
-cursor.executemany( '''
-    INSERT INTO
-    COUNTRY_STATUS ( COUNTRY, STATUS )
-    VALUES ( ?, ? )
-''', classes )
-
-un_vote_processor.db.commit()
+un_vote_processor.prune_years( YEARS )
+loaded = [ year for year in YEARS if un_vote_processor.load_year( f'raw/un/{year}_unvotes.json', year ) ]
+
+un_vote_processor.finish_load()
+
+## every year's country x country agreement is kept in the database, only years loaded in this run are worked out again
+alignment = AlignmentStore( un_vote_processor.db )
+
+with un_vote_processor.timer.phase( 'agreement' ):
+    alignment.drop_years( [ year for year in alignment.years() if year not in YEARS ] )
+    stale = [ year for year in YEARS if year in loaded or year not in alignment.years() ]
+
+    if stale:
+        alignment.update_years( load_vote_matrix( un_vote_processor.db, stale ), stale )
+
+## the country classes only depend on the loaded votes, so they are only worked out again when those change
+status = LoadManifest( un_vote_processor.db, 'COUNTRY_STATUS' )
+signature = un_vote_processor.manifest.signature()
+
+if status.digest() == signature:
+    print( '... Votes are unchanged, keeping country statuses' )
+
+else:
+    with un_vote_processor.timer.phase( 'country status' ):
+
+        ## countries are clustered on their agreement with every other country, the ones clustered with the US are its allies
+        clusters = alignment.clusters()
+        classes = alignment.classes( 'UNITED STATES', clusters = clusters )
+
+        ## both tables are keyed by the canonical country id, which is what the report text is joined on
+        countries = un_vote_processor.countries
+
+        ## setting our classes
+        cursor = un_vote_processor.db.cursor()
+        cursor.execute( '''DROP TABLE IF EXISTS COUNTRY_STATUS''' )
+        cursor.execute( '''
+            CREATE TABLE COUNTRY_STATUS
+            (
+                COUNTRY_ID INT
+                , COUNTRY TEXT
+                , STATUS TEXT
+            )
+        ''' )
+
+        cursor = un_vote_processor.db.cursor()
+
+        cursor.executemany( '''
+            INSERT INTO
+            COUNTRY_STATUS ( COUNTRY_ID, COUNTRY, STATUS )
+            VALUES ( ?, ?, ? )
+        ''', sorted( row for row in ( ( countries.resolve( country ), country, status ) for country, status in classes.items() ) if row[ 0 ] is not None ) )
+        cursor.execute( '''CREATE UNIQUE INDEX COUNTRY_STATUS_KEY ON COUNTRY_STATUS ( COUNTRY_ID )''' )
+
+        ## the clusters themselves are kept too, so classes for other reference countries can be read straight from them
+        cursor.execute( '''DROP TABLE IF EXISTS COUNTRY_CLUSTERS''' )
+        cursor.execute( '''
+            CREATE TABLE COUNTRY_CLUSTERS
+            (
+                COUNTRY_ID INT
+                , COUNTRY TEXT
+                , CLUSTER INT
+            )
+        ''' )
+        cursor.executemany( '''
+            INSERT INTO
+            COUNTRY_CLUSTERS ( COUNTRY_ID, COUNTRY, CLUSTER )
+            VALUES ( ?, ?, ? )
+        ''', sorted( row for row in ( ( countries.resolve( country ), country, cluster ) for country, cluster in clusters.items() ) if row[ 0 ] is not None ) )
+        cursor.execute( '''CREATE UNIQUE INDEX COUNTRY_CLUSTERS_KEY ON COUNTRY_CLUSTERS ( COUNTRY_ID )''' )
+
+    status.record( '', signature )
+
+## everything from this run is committed at once
+un_vote_processor.commit()
+un_vote_processor.timer.report()
 
 """
 ## quick interpreter
@@ -0,0 +1,22 @@
+from constants import DEBUG, YEARS
+from extractors import repair_votes
+from os import replace
+from sys import argv
+from utilities import dump_json_items, iter_json_items
+
+## standalone fix for vote files written before the vote parser repaired "<br>" tags itself
+## files are streamed one resolution at a time and written to a temporary file that replaces the original, so they are never loaded whole
+## usage: python un_repair.py [ file ... ], defaults to every year's raw/un/{year}_unvotes.json
+
+
+filenames = argv[ 1 : ] or [ f'raw/un/{year}_unvotes.json' for year in YEARS ]
+
+for filename in filenames:
+
+    if DEBUG:
+        print( f'... Repairing votes in {filename}' )
+
+    with open( filename, 'r' ) as fh, open( filename + '.tmp', 'w' ) as out:
+        dump_json_items( ( ( title, repair_votes( votes ) ) for title, votes in iter_json_items( fh ) ), out )
+
+    replace( filename + '.tmp', filename )
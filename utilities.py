@@ -1,139 +1,832 @@
-from urllib.request import urlopen
-from json import dump, dumps, load
-from os import stat
-from re import DOTALL, findall, match, sub
-from time import time
-from nltk.corpus import stopwords
+from array import array
+from collections import Counter, OrderedDict
+from heapq import heappush, heapreplace, merge
+from itertools import groupby
+from operator import attrgetter, itemgetter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from hashlib import sha256
+from threading import Lock, get_ident, local
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from json import JSONDecodeError, JSONDecoder, dump, dumps, load, loads
+from mmap import ACCESS_READ, mmap
+from os import makedirs, remove, replace, stat, utime, walk
+from os.path import dirname, join
+from re import DOTALL, compile, findall, match, sub
+from struct import Struct
+from tempfile import TemporaryDirectory
+from time import monotonic, perf_counter, sleep, time
+import numpy as np
 
 ## some constants
 DEBUG = 1
 INDEX_ENTRY_SIZE = 4
+STEM_CACHE_SIZE = 100000
+
+## crawling constants
+FETCH_CONCURRENCY = 8
+FETCH_RATE = 4
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 1.0
+FETCH_TIMEOUT = 30
+FETCH_REDIRECTS = 5
+FETCH_USER_AGENT = 'Mozilla/5.0 (compatible; un-versus-hr-project)'
+CACHE_MAX_SIZE = 2 << 30
+JSON_CHUNK_SIZE = 1 << 16
+
+## sqlite settings used while a database is bulk loaded, and the defaults they are put back to afterwards
+BULK_JOURNAL_MODE = 'WAL'
+BULK_SYNCHRONOUS = 'OFF'
+BULK_CACHE_SIZE = -( 256 << 10 )
+DEFAULT_JOURNAL_MODE = 'DELETE'
+DEFAULT_SYNCHRONOUS = 'FULL'
+
+## layout of a single posting in the index file, big-endian ( docid, freq ) pairs
+POSTING_DTYPE = np.dtype( [ ( 'docid', '>u4' ), ( 'freq', '>u4' ) ] )
+
+## index file formats, the fixed format has no header while newer formats start with a magic and version
+INDEX_FORMAT_FIXED = 1
+INDEX_FORMAT_VBYTE = 2
+INDEX_FORMAT_BLOCKED = 3
+INDEX_MAGIC = b'IRIX'
+INDEX_HEADER_SIZE = 8
+WRITE_BUFFER_SIZE = 1 << 20
+
+## the blocked format splits each postings list into blocks of this many postings, listed in a skip table ahead of them
+## as the last docid of the block and where its codes end, so a search decodes only the blocks it reaches
+INDEX_BLOCK_SIZE = 128
+SKIP_DTYPE = np.dtype( [ ( 'last', '<u4' ), ( 'end', '<u4' ) ] )
+
+## block files used when indexing under a memory budget, each entry is a term length and a posting count then the data
+BLOCK_ENTRY = Struct( '<II' )
+MEMORY_BUDGET = 256 << 20
+POSTING_MEMORY = 8
+TERM_MEMORY = 200
+
+## dictionary file formats, the binary lexicon starts with a magic and version followed by its metadata
+LEXICON_FORMAT_JSON = 1
+LEXICON_FORMAT_BINARY = 2
+LEXICON_MAGIC = b'IRLX'
+LEXICON_HEADER = Struct( '<4sII' )
+LEXICON_ALIGNMENT = 8
+
+## numeric fields of each lexicon entry and their fixed-width types
+LEXICON_FIELDS = [
+    ( 'id', '<u4' )
+    , ( 'document_frequency', '<u4' )
+    , ( 'term_frequency', '<u8' )
+    , ( 'offset', '<u8' )
+    , ( 'length', '<u8' )
+    , ( 'max_score', '<f8' )
+]
+
+## scoring models for ranked retrieval, the weights used at index time are kept in the dictionary
+BM25_WEIGHTS = { 'model': 'bm25', 'k1': 1.2, 'b': 0.75 }
+TFIDF_WEIGHTS = { 'model': 'tfidf' }
+
+## MaxScore walks the documents in windows of this many docids, the threshold is raised after each window
+MAXSCORE_WINDOW = 1 << 12
+## relative slack on upper bounds, so rounding in how scores are summed never prunes a document that belongs in the top k
+BOUND_SLACK = 1e-9
 
 ## some porter's constants
 M0 = "[^aeiou]*[aeiou]*$"
 M1 = "[^aeiou]?[aeiou]+[^aeiou]+[aeiou]?$"
 
+## precompiled porter's patterns
+M0_RE = compile( M0 )
+M1_RE = compile( M1 )
+SSES_RE = compile( r"(\w+?)sses$" )
+IES_RE = compile( r"(\w+?)ies$" )
+S_RE = compile( r"(\w+?[^aiou])s$" )
+EED_RE = compile( r"(\w+?)eed$" )
+ED_RE = compile( r"(.*?[aeiou].*?)ed" )
+ING_RE = compile( r"(.*?[aeiou].*?)ing" )
+AT_RE = compile( r"(.*?)at" )
+BL_RE = compile( r"(.*?)bl" )
+IZ_RE = compile( r"(.*?)iz" )
+CVC_RE = compile( r"[^aeiou][aeiou][^aeiou]" )
+
+## tokenizer patterns
+CHUNK_RE = compile( r"[^\s-]+" )
+TERM_RE = compile( r"[a-z0-9_]+" )
+SPECIAL_RE = compile( r"[^a-z0-9_]" )
+
+
+## bounded memo cache with least recently used eviction
+class IRLRUCache:
+
+    ## constructor for cache
+    ## arguments:
+    ##      - capacity: maximum number of entries kept before evicting
+    def __init__( self, capacity ):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    ## function to fetch a value, returns None on a miss
+    ## arguments:
+    ##      - key: key to look up
+    def get( self, key ):
+
+        value = self.entries.get( key )
+
+        if value is None:
+            self.misses = self.misses + 1
+        else:
+            self.hits = self.hits + 1
+            self.entries.move_to_end( key )
+
+        return value
+
+
+    ## function to store a value, evicting the least recently used entry when full
+    ## arguments:
+    ##      - key: key to store
+    ##      - value: value to store, must not be None
+    def put( self, key, value ):
+
+        self.entries[ key ] = value
+        self.entries.move_to_end( key )
+
+        if len( self.entries ) > self.capacity:
+            self.entries.popitem( last = False )
+
+
+    ## function to report cache statistics
+    def statistics( self ):
+        return {
+            'size': len( self.entries )
+            , 'capacity': self.capacity
+            , 'hits': self.hits
+            , 'misses': self.misses
+        }
+
 
 ## class to process tokens to terms
 class IRAdvancedTermProcessor:
 
-    ## function performs first step of Porter's algorithm, description of implementation taken from: http://facweb.cs.depaul.edu/mobasher/classes/csc575/papers/porter-algorithm.html
+    ## constructor for term processor
+    ## arguments:
+    ##      - cache_size: maximum number of token -> stem entries to memoize
+    def __init__( self, cache_size = STEM_CACHE_SIZE ):
+        self.stem_cache = IRLRUCache( cache_size )
+        self.stops = None
+
+
+    ## function performs first step of Porter's algorithm, results are memoized since the same tokens recur constantly
     ## arguments:
     ##      - token: token to be stemmed
     def porters( self, token ):
 
+        stem = self.stem_cache.get( token )
+
+        if stem is None:
+            stem = self.stem( token )
+            self.stem_cache.put( token, stem )
+
+        return stem
+
+
+    ## function performs first step of Porter's algorithm, description of implementation taken from: http://facweb.cs.depaul.edu/mobasher/classes/csc575/papers/porter-algorithm.html
+    ## patterns are precompiled and guarded by cheap substring checks, the guards are necessary conditions of each pattern so output is unchanged
+    ## arguments:
+    ##      - token: token to be stemmed
+    def stem( self, token ):
+
         m = 0
-        if match( M0, token ):
-            #print( f'M0: {token}' )
+        if M0_RE.match( token ):
             m = 0
-        elif match( M1, token ):
-            #print( f'M1: {token}' )
+        elif M1_RE.match( token ):
             m = 1
         else:
-            #print( f'M2+: {token}' )
             m = 2
 
-        
         ## step 1a
-        if match( "(\w+?)sses$", token ):
-            token = sub( r"(\w+?)sses$", "\g<1>ss", token )
+        if 'sses' in token and SSES_RE.match( token ):
+            token = SSES_RE.sub( r"\g<1>ss", token )
 
-        elif match( "(\w+?)ies$", token ):
-            token = sub( r"(\w+?)ies$", "\g<1>i", token )
+        elif 'ies' in token and IES_RE.match( token ):
+            token = IES_RE.sub( r"\g<1>i", token )
 
-        else:
-            token = sub( r"(\w+?[^aiou])s$", "\g<1>", token )
+        elif 's' in token:
+            token = S_RE.sub( r"\g<1>", token )
 
         ## step 1b
         if m > 0:
-            token = sub( r"(\w+?)eed$", "\g<1>ee", token )
+            if 'eed' in token:
+                token = EED_RE.sub( r"\g<1>ee", token )
 
-        elif match( "(.*?[aeiou].*?)ed", token ):
-            
-            token = sub( "(.*?[aeiou].*?)ed", "\g<1>", token )
+        elif 'ed' in token and ED_RE.match( token ):
+            token = self.restore_suffix( ED_RE.sub( r"\g<1>", token ), m )
 
-            if match( "(.*?)at", token ):
-                token = sub( "(.*?)at", "\g<1>ate", token )
+        elif 'ing' in token and ING_RE.match( token ):
+            token = self.restore_suffix( ING_RE.sub( r"\g<1>", token ), m )
+
+        return token
 
-            elif match( "(.*?)bl", token ):  
-                token = sub( "(.*?)bl", "\g<1>ble", token )
 
-            elif match( "(.*?)iz", token ):  
-                token = sub( "(.*?)iz", "\g<1>ize", token )
+    ## function to repair a token after its -ed or -ing suffix has been removed
+    ## arguments:
+    ##      - token: token with the suffix removed
+    ##      - m: the measure of the original token
+    def restore_suffix( self, token, m ):
 
-            ## double same consonant ending check
-            elif token[ -1 ] == token[ -2 ] and token[ -1 ] not in ( 'l', 's', 'z' ):
-                token = token[ : -1 ]
+        if AT_RE.match( token ):
+            token = AT_RE.sub( r"\g<1>ate", token )
 
-            elif m == 1 and match( '[^aeiou][aeiou][^aeiou]', token ):
-                token = token + 'e'
+        elif BL_RE.match( token ):
+            token = BL_RE.sub( r"\g<1>ble", token )
 
-        elif match( "(.*?[aeiou].*?)ing", token ):
-            
-            token = sub( "(.*?[aeiou].*?)ing", "\g<1>", token )
+        elif IZ_RE.match( token ):
+            token = IZ_RE.sub( r"\g<1>ize", token )
 
-            if match( "(.*?)at", token ):
-                token = sub( "(.*?)at", "\g<1>ate", token )
+        ## double same consonant ending check
+        elif token[ -1 ] == token[ -2 ] and token[ -1 ] not in ( 'l', 's', 'z' ):
+            token = token[ : -1 ]
 
-            elif match( "(.*?)bl", token ):  
-                token = sub( "(.*?)bl", "\g<1>ble", token )
+        elif m == 1 and CVC_RE.match( token ):
+            token = token + 'e'
 
-            elif match( "(.*?)iz", token ):  
-                token = sub( "(.*?)iz", "\g<1>ize", token )
+        return token
 
-            ## double same consonant ending check
-            elif token[ -1 ] == token[ -2 ] and token[ -1 ] not in ( 'l', 's', 'z' ):
-                token = token[ : -1 ]
 
-            elif m == 1 and match( '[^aeiou][aeiou][^aeiou]', token ):
-                token = token + 'e'
+    ## function to load the stopword set, this is done once per processor and only when first needed
+    ## nltk is imported here too, so modules that only need the crawling or json helpers do not pay for loading it
+    def load_stopwords( self ):
 
+        if self.stops is None:
+            from nltk.corpus import stopwords
+            self.stops = frozenset( stopwords.words( 'english' ) )
 
-        return token
+        return self.stops
 
 
     ## function to transforms a document to tokens and then normalize to terms, specifically:
-    ##      - split on spaces
+    ##      - split on whitespace and hyphens
     ##      - remove special characters
     ##      - convert all to lower case
-    ##      - remove numbers
-    ##      - remove newlines
+    ##      - remove stopwords
     ##      - first step of Porter's for plural and conjugated verbs
+    ## the document is scanned once and terms are yielded lazily
     ## arguments:
     ##      - document: the document to be tokenized
     def tokenize_and_normalize( self, document ):
 
-        ## first we strip out any newlines or whitespace
-        document = document.strip()
+        stops = self.load_stopwords()
 
-        ## we perform case-folding
-        document = document.lower()
+        for chunk in CHUNK_RE.finditer( document.lower() ):
 
-        ## we replace hyphens with spaces
-        document = sub( r"-", " ", document )
+            token = chunk.group()
 
-        ## now we remove special characters
-        document = sub( r"[^a-zA-Z0-9_ \n]", '', document )
+            ## most tokens are already clean, so we only strip special characters when needed
+            if not TERM_RE.fullmatch( token ):
+                token = SPECIAL_RE.sub( '', token )
 
-        ## we now tokenize
-        tokens = document.split( " " )
-
-        ## lets throw my implementation of Porter's at it, why not?
-        stops = set( stopwords.words( 'english' ) )
-        
-        for i in range( len( tokens ) ):
-            
             ## stopword removal
-            if tokens[ i ] in stops:
+            if not token or token in stops:
                 continue
-            
-            tokens[ i ] = self.porters( tokens[ i ] )
 
+            yield self.porters( token )
 
-        
 
-        return len( tokens ), list( tokens )
-            
+## function to count the bytes each unsigned integer needs as a variable-byte code
+## arguments:
+##      - values: unsigned integers to be encoded
+def vbyte_lengths( values ):
+
+    lengths = np.ones( len( values ), dtype = np.int64 )
+    for k in range( 1, 10 ):
+        lengths = lengths + ( values >= np.uint64( 1 << ( 7 * k ) ) )
+
+    return lengths
+
+
+## function to encode unsigned integers as variable-byte codes, seven bits per byte with the high bit marking continuation
+## arguments:
+##      - values: unsigned integers to be encoded
+def vbyte_encode( values ):
+
+    values = np.asarray( values, dtype = np.uint64 )
+    lengths = vbyte_lengths( values )
+
+    ## position of each output byte within its value
+    starts = np.cumsum( lengths ) - lengths
+    position = np.arange( lengths.sum() ) - np.repeat( starts, lengths )
+
+    data = ( np.repeat( values, lengths ) >> ( position * 7 ).astype( np.uint64 ) ) & np.uint64( 0x7f )
+    data[ position < np.repeat( lengths, lengths ) - 1 ] |= np.uint64( 0x80 )
+
+    return data.astype( np.uint8 ).tobytes()
+
+
+## function to decode variable-byte codes written by vbyte_encode
+## arguments:
+##      - buffer: buffer holding the codes
+##      - offset: position of the first code in the buffer
+##      - length: number of bytes to decode
+def vbyte_decode( buffer, offset = 0, length = -1 ):
+
+    data = np.frombuffer( buffer, dtype = np.uint8, count = length, offset = offset )
+
+    if not len( data ):
+        return np.empty( 0, dtype = np.uint64 )
+
+    ## each value ends on a byte without the continuation bit
+    ends = ( data & 0x80 ) == 0
+    starts = np.flatnonzero( np.concatenate( ( [ True ], ends[ : -1 ] ) ) )
+    position = np.arange( len( data ) ) - np.repeat( starts, np.diff( np.append( starts, len( data ) ) ) )
+
+    return np.add.reduceat( ( data & 0x7f ).astype( np.uint64 ) << ( position * 7 ).astype( np.uint64 ), starts )
+
+
+## function to find where each posting of a list goes in the blocked format, returns ( gap positions, freq positions )
+## each block of INDEX_BLOCK_SIZE postings is a run of docid gaps followed by a run of frequencies
+## arguments:
+##      - count: number of postings in the list
+def block_positions( count ):
+
+    position = np.arange( count )
+    first = position - position % INDEX_BLOCK_SIZE
+    size = np.minimum( INDEX_BLOCK_SIZE, count - first )
+
+    return first + position, first + position + size
+
+
+## function to read a block file written by IRDictionary.write_block as a stream of ( term, docids, freqs )
+## arguments:
+##      - block_file: the name of the block file to read
+def read_block( block_file ):
+
+    with open( block_file, 'rb' ) as fh:
+
+        while True:
+
+            header = fh.read( BLOCK_ENTRY.size )
+            if not header:
+                break
+
+            size, count = BLOCK_ENTRY.unpack( header )
+            term = fh.read( size ).decode( 'utf-8' )
+
+            docids, freqs = array( 'I' ), array( 'I' )
+            docids.fromfile( fh, count )
+            freqs.fromfile( fh, count )
+
+            yield term, docids, freqs
+
+
+## memory-mapped reader for an index file, the file is mapped once and postings are decoded as views into it
+class IRPostingsReader:
+
+    ## constructor for postings reader
+    ## arguments:
+    ##      - index_file: path to index file, this should be a binary file
+    def __init__( self, index_file ):
+
+        self.index_file = index_file
+        self.handle = open( index_file, 'rb' )
+
+        ## the file is told apart from a later one written to the same path by its modification time and size
+        status = stat( self.handle.fileno() )
+        self.signature = ( index_file, status.st_mtime_ns, status.st_size )
+
+        ## an empty file cannot be mapped, so we fall back to an empty buffer
+        if status.st_size:
+            self.buffer = mmap( self.handle.fileno(), 0, access = ACCESS_READ )
+        else:
+            self.buffer = b''
+
+        ## files without a header are in the original fixed-width format
+        if self.buffer[ : len( INDEX_MAGIC ) ] == INDEX_MAGIC:
+            self.version = int.from_bytes( self.buffer[ len( INDEX_MAGIC ) : INDEX_HEADER_SIZE ], byteorder = 'big', signed = False )
+        else:
+            self.version = INDEX_FORMAT_FIXED
+
+        if self.version not in ( INDEX_FORMAT_FIXED, INDEX_FORMAT_VBYTE, INDEX_FORMAT_BLOCKED ):
+            raise ValueError( f'Unsupported index format {self.version} in {index_file}' )
+
+
+    ## function to fetch the postings of a dictionary entry as a structured ( docid, freq ) array
+    ## for the fixed format the returned array is a zero-copy view into the mapped file
+    ## arguments:
+    ##      - entry: IRDictionary entry of the term to be fetched
+    def postings( self, entry ):
+
+        if not entry:
+            return np.empty( 0, dtype = POSTING_DTYPE )
+
+        count = entry[ 'document_frequency' ]
+
+        if self.version == INDEX_FORMAT_FIXED:
+            return np.frombuffer( self.buffer, dtype = POSTING_DTYPE, count = count, offset = entry[ 'offset' ] )
+
+        postings = np.empty( count, dtype = POSTING_DTYPE )
+
+        ## the compressed format holds a block of docid gaps followed by a block of frequencies
+        if self.version == INDEX_FORMAT_VBYTE:
+            values = vbyte_decode( self.buffer, entry[ 'offset' ], entry[ 'length' ] )
+            postings[ 'docid' ] = np.cumsum( values[ : count ] )
+            postings[ 'freq' ] = values[ count : ]
+            return postings
+
+        ## the blocked format holds the same gaps and frequencies, interleaved a block at a time after the skip table
+        skips = self.skips( entry )
+        values = vbyte_decode( self.buffer, entry[ 'offset' ] + skips.nbytes, entry[ 'length' ] - skips.nbytes )
+        gaps, freqs = block_positions( count )
+        postings[ 'docid' ] = np.cumsum( values[ gaps ] )
+        postings[ 'freq' ] = values[ freqs ]
+
+        return postings
+
+
+    ## function to fetch the skip table of a dictionary entry in the blocked format, as a zero-copy view of ( last, end ) pairs
+    ## arguments:
+    ##      - entry: IRDictionary entry of the term
+    def skips( self, entry ):
+
+        if self.version != INDEX_FORMAT_BLOCKED:
+            raise ValueError( f'Index format {self.version} of {self.index_file} has no skip tables' )
+
+        count = -( -entry[ 'document_frequency' ] // INDEX_BLOCK_SIZE )
+
+        return np.frombuffer( self.buffer, dtype = SKIP_DTYPE, count = count, offset = entry[ 'offset' ] )
+
+
+    ## function to decode some blocks of a dictionary entry in the blocked format, returns ( docids, freqs ) of each block
+    ## only the codes of the asked blocks are read, docid gaps restart from the last docid of the block before
+    ## arguments:
+    ##      - entry: IRDictionary entry of the term
+    ##      - blocks: positions of the blocks in the skip table, in increasing order
+    def decode_blocks( self, entry, blocks ):
+
+        skips = self.skips( entry )
+        start = entry[ 'offset' ] + skips.nbytes
+        ends = skips[ 'end' ].astype( np.int64 )
+        starts = np.append( 0, ends[ : -1 ] )
+
+        values = vbyte_decode( b''.join( self.buffer[ start + starts[ block ] : start + ends[ block ] ] for block in blocks ) )
+        sizes = np.minimum( INDEX_BLOCK_SIZE, entry[ 'document_frequency' ] - np.asarray( blocks, dtype = np.int64 ) * INDEX_BLOCK_SIZE )
+
+        decoded, position = [], 0
+        for block, size in zip( blocks, sizes.tolist() ):
+            base = skips[ 'last' ][ block - 1 ].item() if block else 0
+            decoded.append( ( base + np.cumsum( values[ position : position + size ] ).astype( np.int64 ), values[ position + size : position + 2 * size ] ) )
+            position = position + 2 * size
+
+        return decoded
+
+
+    ## function to release the file handle, views handed out may still use the mapping so it is unmapped once they are gone
+    def close( self ):
+        self.buffer = b''
+        self.handle.close()
+
+
+## function to pad a length up to the lexicon alignment
+## arguments:
+##      - size: number of bytes to be padded
+def lexicon_padding( size ):
+    return -size % LEXICON_ALIGNMENT
+
+
+## memory-mapped, read-only binary lexicon, terms are looked up by binary search over the sorted term table
+## entries are returned as dictionaries so it can stand in for the json lexicon, they are copies so changing them changes nothing,
+## an IRDictionary turns a loaded lexicon into a plain dictionary before it first writes to it, see IRDictionary.writable_lexicon
+class IRLexicon:
+
+    ## constructor for lexicon
+    ## arguments:
+    ##      - dictionary_file: path to a binary dictionary file written by IRDictionary.write_dictionary
+    def __init__( self, dictionary_file ):
+
+        self.handle = open( dictionary_file, 'rb' )
+        self.buffer = mmap( self.handle.fileno(), 0, access = ACCESS_READ )
+
+        magic, version, size = LEXICON_HEADER.unpack_from( self.buffer )
+        if magic != LEXICON_MAGIC or version != LEXICON_FORMAT_BINARY:
+            raise ValueError( f'{dictionary_file} is not a binary dictionary file' )
+
+        ## the metadata holds the collection statistics and describes the layout of the arrays
+        position = LEXICON_HEADER.size
+        self.metadata = loads( self.buffer[ position : position + size ].decode( 'utf-8' ) )
+        position = position + size + lexicon_padding( position + size )
+
+        count = self.metadata[ 'count' ]
+        self.string_offsets = np.frombuffer( self.buffer, dtype = '<u8', count = count + 1, offset = position )
+        position = position + self.string_offsets.nbytes
+
+        self.fields = {}
+        for name, dtype in self.metadata[ 'fields' ]:
+            self.fields[ name ] = np.frombuffer( self.buffer, dtype = dtype, count = count, offset = position )
+            position = position + self.fields[ name ].nbytes + lexicon_padding( self.fields[ name ].nbytes )
+
+        ## document lengths are needed for length normalization when scoring
+        self.document_lengths = np.frombuffer( self.buffer, dtype = '<u4', count = self.metadata[ 'documents' ], offset = position )
+        position = position + self.document_lengths.nbytes + lexicon_padding( self.document_lengths.nbytes )
+
+        self.strings = position
+        self.count = count
+
+
+    ## function to fetch the encoded term at a position of the term table
+    ## arguments:
+    ##      - i: position in the term table
+    def term_bytes( self, i ):
+        return self.buffer[ self.strings + int( self.string_offsets[ i ] ) : self.strings + int( self.string_offsets[ i + 1 ] ) ]
+
+
+    ## function to find the position of a term in the term table, returns -1 if the term is not present
+    ## arguments:
+    ##      - term: term to look up
+    def find( self, term ):
+
+        key = term.encode( 'utf-8' )
+        low, high = 0, self.count
+
+        while low < high:
+
+            middle = ( low + high ) // 2
+
+            if self.term_bytes( middle ) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self.count and self.term_bytes( low ) == key:
+            return low
+
+        return -1
+
+
+    ## function to build the dictionary entry at a position of the term table
+    ## arguments:
+    ##      - i: position in the term table
+    def entry( self, i ):
+        return { name: values[ i ].item() for name, values in self.fields.items() }
+
+
+    ## function to fetch the entry of a term, returns default if the term is not present
+    ## arguments:
+    ##      - term: term to look up
+    ##      - default: value returned for missing terms
+    def get( self, term, default = None ):
+
+        i = self.find( term )
+
+        return default if i < 0 else self.entry( i )
+
+
+    def __getitem__( self, term ):
+
+        i = self.find( term )
+
+        if i < 0:
+            raise KeyError( term )
+
+        return self.entry( i )
+
+
+    def __contains__( self, term ):
+        return self.find( term ) >= 0
+
+
+    def __len__( self ):
+        return self.count
+
+
+    def __iter__( self ):
+        for i in range( self.count ):
+            yield self.term_bytes( i ).decode( 'utf-8' )
+
+
+    ## function to iterate over ( term, entry ) pairs in term order
+    def items( self ):
+        for i in range( self.count ):
+            yield self.term_bytes( i ).decode( 'utf-8' ), self.entry( i )
+
+
+    ## function to release the file handle, arrays handed out may still use the mapping so it is unmapped once they are gone
+    def close( self ):
+        self.buffer = b''
+        self.fields = {}
+        self.string_offsets = None
+        self.document_lengths = None
+        self.handle.close()
+
+
+## function to score the postings of a term with BM25 or TF-IDF
+## arguments:
+##      - weights: scoring model and its parameters, such as BM25_WEIGHTS or TFIDF_WEIGHTS
+##      - freqs: frequency of the term in each document
+##      - lengths: length of each document
+##      - df: document frequency of the term
+##      - document_count: total number of documents
+##      - average_length: average document length
+def score_postings( weights, freqs, lengths, df, document_count, average_length ):
+
+    freqs = np.asarray( freqs, dtype = np.float64 )
+
+    if weights[ 'model' ] == 'tfidf':
+        return ( 1 + np.log( freqs ) ) * np.log( document_count / df )
+
+    if weights[ 'model' ] != 'bm25':
+        raise ValueError( f"Unsupported scoring model {weights[ 'model' ]}" )
+
+    k1, b = weights[ 'k1' ], weights[ 'b' ]
+    idf = np.log( 1 + ( document_count - df + 0.5 ) / ( df + 0.5 ) )
+
+    return idf * freqs * ( k1 + 1 ) / ( freqs + k1 * ( 1 - b + b * np.asarray( lengths, dtype = np.float64 ) / average_length ) )
+
+
+## a query term as MaxScore walks it, postings are decoded a block at a time as the search reaches them and kept for later probes
+## indexes without skip tables are decoded whole, as a single block
+class IRQueryTerm:
+
+    ## constructor for query term
+    ## arguments:
+    ##      - reader: IRPostingsReader of the index holding the term
+    ##      - entry: IRDictionary entry of the term
+    ##      - score: function giving the scores of the term for some ( docids, freqs ) of its postings
+    ##      - bound: upper bound on the score of the term, taken from every posting when not given
+    def __init__( self, reader, entry, score, bound = None ):
+
+        self.reader = reader
+        self.entry = entry
+        self.score = score
+        self.blocks = {}
+
+        ## last docid of each block, a block holds the docids after the last docid of the block before
+        if reader.version == INDEX_FORMAT_BLOCKED:
+            self.last = reader.skips( entry )[ 'last' ].astype( np.int64 )
+        else:
+            postings = reader.postings( entry )
+            self.last = postings[ 'docid' ][ -1 : ].astype( np.int64 )
+            self.blocks[ 0 ] = ( postings[ 'docid' ].astype( np.int64 ), postings[ 'freq' ] )
+
+        if bound is None and len( self.last ):
+            bound = score( *self.postings( range( len( self.last ) ) ) ).max().item()
+
+        self.bound = bound
+
+
+    ## function to get the postings of some blocks as ( docids, freqs ), decoding the ones not seen yet
+    ## arguments:
+    ##      - blocks: positions of the blocks, in increasing order
+    def postings( self, blocks ):
+
+        blocks = list( blocks )
+        missing = [ block for block in blocks if block not in self.blocks ]
+
+        if missing:
+            self.blocks.update( zip( missing, self.reader.decode_blocks( self.entry, missing ) ) )
+
+        if not blocks:
+            return np.empty( 0, dtype = np.int64 ), np.empty( 0, dtype = np.uint64 )
+
+        return np.concatenate( [ self.blocks[ block ][ 0 ] for block in blocks ] ), np.concatenate( [ self.blocks[ block ][ 1 ] for block in blocks ] )
+
+
+    ## function to get the first docid of the term at or after a docid, or infinity if there is none
+    ## arguments:
+    ##      - start: docid to start from
+    def next_docid( self, start ):
+
+        block = np.searchsorted( self.last, start )
+
+        if block == len( self.last ):
+            return np.inf
+
+        docids, _ = self.postings( [ block ] )
+
+        return docids[ np.searchsorted( docids, start ) ].item()
+
+
+    ## function to get the postings of the term in a range of docids as ( docids, freqs )
+    ## arguments:
+    ##      - start: first docid of the range
+    ##      - end: docid the range stops before
+    def window( self, start, end ):
+
+        first = np.searchsorted( self.last, start )
+        last = min( np.searchsorted( self.last, end ), len( self.last ) - 1 )
+        docids, freqs = self.postings( range( first, last + 1 ) )
+        first, last = np.searchsorted( docids, start ), np.searchsorted( docids, end )
+
+        return docids[ first : last ], freqs[ first : last ]
+
+
+    ## function to get the scores of the term for some documents, zero for the ones it is not in
+    ## only the blocks that could hold the documents are decoded
+    ## arguments:
+    ##      - candidates: sorted docids of the documents
+    def probe( self, candidates ):
+
+        blocks = np.searchsorted( self.last, candidates )
+        docids, freqs = self.postings( np.unique( blocks[ blocks < len( self.last ) ] ).tolist() )
+        scores = np.zeros( len( candidates ), dtype = np.float64 )
+
+        if not len( docids ):
+            return scores
+
+        positions = np.minimum( np.searchsorted( docids, candidates ), len( docids ) - 1 )
+        hits = docids[ positions ] == candidates
+        scores[ hits ] = self.score( docids[ positions[ hits ] ], freqs[ positions[ hits ] ] )
+
+        return scores
+
+
+## function to find the top k documents with MaxScore pruning, returns ( docid, score ) pairs best first
+## documents are walked in docid order, a window at a time, keeping the k best in a heap whose worst score is the threshold
+## terms whose upper bounds together cannot beat the threshold are non-essential: only the postings of the essential terms
+## are walked, each window starting at the next docid one of them holds, and the non-essential terms are probed, strongest
+## first, only for documents that can still beat it, so blocks of postings neither walked nor probed are never decoded
+## the ranking and scores are the same as scoring every document, ties broken by docid
+## arguments:
+##      - terms: IRQueryTerm of each query term
+##      - k: number of documents to return
+##      - window: number of docids walked between raising the threshold
+def max_score( terms, k, window = MAXSCORE_WINDOW ):
+
+    terms = sorted( [ term for term in terms if len( term.last ) ], key = attrgetter( 'bound' ) )
+
+    if not terms or k < 1:
+        return []
+
+    ## terms are sorted by upper bound, so the non-essential ones form a prefix, prefix[ i ] bounds a document holding only the first i
+    bounds = np.array( [ term.bound for term in terms ] )
+    prefix = np.append( 0.0, np.cumsum( bounds ) )
+
+    ## the k best so far as ( score, -docid ), so the worst of them, and of equal scores the latest docid, is first
+    heap = []
+    threshold = -np.inf
+    essential = 0
+    start = 0
+
+    while True:
+
+        ## the window skips ahead to the next document an essential term holds, the only ones that can still beat the threshold
+        start = min( term.next_docid( start ) for term in terms[ essential : ] )
+
+        if start == np.inf:
+            break
+
+        spans = [ term.window( start, start + window ) for term in terms[ essential : ] ]
+        candidates = np.unique( np.concatenate( [ docids for docids, _ in spans ] ) )
+        contributions = np.zeros( ( len( terms ), len( candidates ) ), dtype = np.float64 )
+
+        for i, ( docids, freqs ) in enumerate( spans, essential ):
+
+            if not len( docids ):
+                continue
+
+            positions = np.searchsorted( docids, candidates )
+            hits = np.flatnonzero( docids[ np.minimum( positions, len( docids ) - 1 ) ] == candidates )
+            contributions[ i, hits ] = terms[ i ].score( docids[ positions[ hits ] ], freqs[ positions[ hits ] ] )
+
+        ## non-essential terms are probed only for documents whose partial score and remaining bounds can still beat the threshold
+        upper = contributions.sum( axis = 0 ) + prefix[ essential ]
+        alive = np.arange( len( candidates ) )
+
+        for i in reversed( range( essential ) ):
+
+            alive = alive[ upper[ alive ] * ( 1 + BOUND_SLACK ) > threshold ]
+
+            if not len( alive ):
+                break
+
+            contributions[ i, alive ] = terms[ i ].probe( candidates[ alive ] )
+            upper[ alive ] = upper[ alive ] - bounds[ i ] + contributions[ i, alive ]
+
+        alive = alive[ upper[ alive ] * ( 1 + BOUND_SLACK ) > threshold ]
+
+        ## scores are summed in term order, the same order as scoring every document would
+        totals = np.zeros( len( alive ), dtype = np.float64 )
+        for row in contributions[ :, alive ]:
+            totals = totals + row
+
+        for docid, total in zip( candidates[ alive ].tolist(), totals.tolist() ):
+            if len( heap ) < k:
+                heappush( heap, ( total, -docid ) )
+            elif ( total, -docid ) > heap[ 0 ]:
+                heapreplace( heap, ( total, -docid ) )
+
+        ## later documents lose ties to the ones in the heap, so a document has to beat the threshold outright
+        if len( heap ) == k:
+            threshold = heap[ 0 ][ 0 ]
+            essential = np.searchsorted( prefix[ 1 : ] * ( 1 + BOUND_SLACK ), threshold, side = 'right' )
+
+            if essential == len( terms ):
+                break
+
+        start = start + window
+
+    return [ ( -docid, total ) for total, docid in sorted( heap, reverse = True ) ]
+
 
 ## Dictionary object
 class IRDictionary:
@@ -149,104 +842,345 @@ class IRDictionary:
             , 'weights': None
         }
         self.postings = {}
+        self.document_lengths = array( 'I' )
         self.processor = processor
+        self.reader = None
         
 
     ## function to read a collection of documents from a single file
+    ## postings and term statistics are built in a single pass, each term keeps parallel docid and frequency arrays
     ## arguments:
     ##      - documents: the corpus of documents to be processed
     def read_collection( self, documents ):
 
+        ## docids carry on from any collection read before this one
+        first = self.dictionary[ 'document_count' ]
+
         ## loop until the end of time
         ## reading all file contents causes MemoryError
         ## so we read documents one at a time
-        for docid in range( len( documents ) ):
+        for docid, document in enumerate( documents, first ):
+            self.add_document( docid, document )
 
-            document = documents[ docid ]
+        ## print some basic statistics
+        if DEBUG > 0:
+            print( f"Total Documents Processed: {self.dictionary[ 'document_count' ] - first}" )
+            print( f"Total Unique Words (Terms): {self.dictionary[ 'uniques' ]}" )
+            print( f"Total Amount of Words (Tokens): {self.dictionary[ 'collection_size' ]}" )
 
-            ## tokenize and normalize
-            n_tokens, tokens = self.processor.tokenize_and_normalize( document )
 
-            ## we loop over our terms
-            for token in tokens:
+    ## function to add a single document to the postings and the dictionary, returns the number of postings added
+    ## arguments:
+    ##      - docid: id of the document, documents must be added in increasing docid order
+    ##      - document: the document to be processed
+    def add_document( self, docid, document ):
 
-                ## we check to see if the term is already in our postings list
-                ## if it is then add this docID to the list, if not init the list with this docID
-                if token in self.postings:
-                    
-                    if docid in self.postings[ token ]:
-                        self.postings[ token ][ docid ] = self.postings[ token ][ docid ] + 1
-                    else:
-                        self.postings[ token ][ docid ] = 1
-                        
-                else:
-                    self.postings[ token ] = { docid: 1 }
+        lexicon = self.writable_lexicon()
 
-            ## keep track of the total number of tokens processed and documents processed
-            self.dictionary[ 'collection_size' ] = self.dictionary[ 'collection_size' ] + n_tokens
-            self.dictionary[ 'document_count' ] = self.dictionary[ 'document_count' ] + 1
+        ## tokenize and normalize, terms are counted as they are produced
+        counts = Counter( self.processor.tokenize_and_normalize( document ) )
 
+        ## we loop over our terms
+        for term, freq in counts.items():
 
-        ## print some basic statistics
-        if DEBUG > 0:
-            print( f'Total Documents Processed: {int( docid ) + 1}' )
-            print( f'Total Unique Words (Terms): {len(self.postings)}' )
-            print( f"Total Amount of Words (Tokens): {self.dictionary[ 'collection_size' ]}" )
+            entry = lexicon.get( term )
 
+            ## new terms get the next id
+            if entry is None:
+                entry = lexicon[ term ] = {
+                    'id': len( lexicon )
+                    , 'document_frequency': 0
+                    , 'term_frequency': 0
+                    , 'offset': 0
+                }
 
-        ## we now assemble the dictionary from our postings list
-        counter = 0
-        self.dictionary[ 'dictionary' ] = {}
-        self.dictionary[ 'uniques' ] = len(self.postings)
-        
-        for term in self.postings:
-            self.dictionary[ 'dictionary' ][ term ] = {
-                'id': counter
-                , 'document_frequency': len( self.postings[ term ] )
-                , 'term_frequency': sum( [ self.postings[ term ][ docid ] for docid in self.postings[ term ] ]  )
-                , 'offset': 0
-            }
-            counter = counter + 1
+            ## terms get empty postings arrays the first time they are seen since the last flush
+            if term not in self.postings:
+                self.postings[ term ] = ( array( 'I' ), array( 'I' ) )
+
+            ## documents arrive in docid order so the arrays stay sorted
+            docids, freqs = self.postings[ term ]
+            docids.append( docid )
+            freqs.append( freq )
+
+            entry[ 'document_frequency' ] = entry[ 'document_frequency' ] + 1
+            entry[ 'term_frequency' ] = entry[ 'term_frequency' ] + freq
+
+        ## keep track of the total number of tokens processed and documents processed
+        self.document_lengths.append( sum( counts.values() ) )
+        self.dictionary[ 'collection_size' ] = self.dictionary[ 'collection_size' ] + self.document_lengths[ -1 ]
+        self.dictionary[ 'document_count' ] = self.dictionary[ 'document_count' ] + 1
+        self.dictionary[ 'uniques' ] = len( lexicon )
+
+        return len( counts )
+
+
+    ## function to get the lexicon ready to be written to, returns it
+    ## a binary lexicon loaded by load_dictionary is read-only, so the first write copies it into a plain dictionary in memory
+    ## and lets go of the mapped file, after that the dictionary behaves as if it had been loaded from json
+    def writable_lexicon( self ):
+
+        lexicon = self.dictionary[ 'dictionary' ]
+
+        if isinstance( lexicon, IRLexicon ):
+            self.dictionary[ 'dictionary' ] = dict( lexicon.items() )
+            lexicon.close()
+
+        return self.dictionary[ 'dictionary' ]
+
+
+    ## function to index a stream of documents without holding every posting in memory
+    ## postings are flushed to sorted block files whenever the memory budget is reached and the blocks are then merged into the index
+    ## arguments:
+    ##      - documents: iterable of documents to be processed, this can be a generator
+    ##      - index_file: the name of the index file we want to write to
+    ##      - memory_budget: approximate number of bytes of postings to hold in memory before flushing a block
+    ##      - version: the index format to write
+    ##      - temp_dir: directory for the block files, defaults to the system temporary directory
+    def build_index( self, documents, index_file, memory_budget = MEMORY_BUDGET, version = INDEX_FORMAT_BLOCKED, temp_dir = None ):
+
+        first = self.dictionary[ 'document_count' ]
+        buffered = 0
+        blocks = []
+
+        with TemporaryDirectory( dir = temp_dir ) as directory:
+
+            for docid, document in enumerate( documents, first ):
+
+                buffered = buffered + self.add_document( docid, document )
+
+                ## this is a rough estimate of the memory held by our postings arrays
+                if buffered * POSTING_MEMORY + len( self.postings ) * TERM_MEMORY >= memory_budget:
+                    blocks.append( self.write_block( f'{directory}/block{len( blocks )}.bin' ) )
+                    buffered = 0
+
+            if self.postings:
+                blocks.append( self.write_block( f'{directory}/block{len( blocks )}.bin' ) )
+
+            if DEBUG > 0:
+                print( f"Total Documents Processed: {self.dictionary[ 'document_count' ] - first}" )
+                print( f'Merging {len( blocks )} blocks into {index_file}...' )
+
+            self.write_postings( index_file, self.merge_blocks( blocks ), version )
+
+        self.attach_index( index_file )
+
+
+    ## function to write our in-memory postings to a sorted block file and then flush them
+    ## arguments:
+    ##      - block_file: the name of the block file we want to write to
+    def write_block( self, block_file ):
+
+        with open( block_file, 'wb' ) as fh:
+
+            for term in sorted( self.postings.keys() ):
+
+                docids, freqs = self.postings[ term ]
+                encoded = term.encode( 'utf-8' )
+
+                fh.write( BLOCK_ENTRY.pack( len( encoded ), len( docids ) ) )
+                fh.write( encoded )
+                fh.write( docids.tobytes() )
+                fh.write( freqs.tobytes() )
+
+        self.flush_postings()
+
+        return block_file
+
+
+    ## function to merge sorted block files into a single sorted stream of ( term, docids, freqs )
+    ## blocks hold increasing docids, so the postings of a term are concatenated in block order
+    ## arguments:
+    ##      - block_files: block files in the order they were written
+    def merge_blocks( self, block_files ):
+
+        merged = merge( *[ read_block( block_file ) for block_file in block_files ], key = itemgetter( 0 ) )
+
+        for term, group in groupby( merged, key = itemgetter( 0 ) ):
+
+            _, docids, freqs = next( group )
+
+            for _, more_docids, more_freqs in group:
+                docids.extend( more_docids )
+                freqs.extend( more_freqs )
+
+            yield term, docids, freqs
 
 
     ## function to write our postings list to an inverted index file
     ## as currently designed this is algorithm A
     ## arguments:
     ##      - index_file: the name of the index file we want to write to
-    def write_index( self, index_file ):
+    ##      - version: the index format to write, INDEX_FORMAT_BLOCKED, INDEX_FORMAT_VBYTE or the original INDEX_FORMAT_FIXED
+    def write_index( self, index_file, version = INDEX_FORMAT_BLOCKED ):
+
+        postings = ( ( term, *self.postings[ term ] ) for term in sorted( self.postings.keys() ) )
+        self.write_postings( index_file, postings, version )
+
+
+    ## function to write a sorted stream of postings lists to an inverted index file
+    ## arguments:
+    ##      - index_file: the name of the index file we want to write to
+    ##      - postings: iterable of ( term, docids, freqs ) in term order, docids and freqs are array( 'I' )
+    ##      - version: the index format to write
+    def write_postings( self, index_file, postings, version ):
+
+        if version not in ( INDEX_FORMAT_FIXED, INDEX_FORMAT_VBYTE, INDEX_FORMAT_BLOCKED ):
+            raise ValueError( f'Unsupported index format {version}' )
 
+        ## offsets, lengths and upper bounds are written back into the lexicon entries
+        self.writable_lexicon()
         offset = 0
-        ret = ""
+        terms, blocks, buffered = [], [], 0
 
-        ## open a connection to our index file
-        with open( index_file, 'wb' ) as file:
+        ## upper bounds on each term's score are computed here so queries can skip documents that cannot reach the top
+        weights = self.dictionary[ 'weights' ] = self.dictionary[ 'weights' ] or BM25_WEIGHTS
+        lengths = np.frombuffer( self.document_lengths, dtype = np.uint32 )
+        average_length = self.dictionary[ 'collection_size' ] / max( self.dictionary[ 'document_count' ], 1 )
 
-            for term in sorted( self.postings.keys() ):
+        ## a reader still mapping the old index is let go, the new index is written next to it and moved into place
+        ## so views handed out of the old mapping never see a truncated file
+        self.release_reader()
+
+        with open( index_file + '.tmp', 'wb' ) as file:
+
+            ## the fixed format is written without a header so older readers still understand it
+            if version != INDEX_FORMAT_FIXED:
+                file.write( INDEX_MAGIC + version.to_bytes( INDEX_HEADER_SIZE - len( INDEX_MAGIC ), byteorder = 'big', signed = False ) )
+                offset = INDEX_HEADER_SIZE
+
+            for term, docids, freqs in postings:
 
-                self.dictionary[ 'dictionary' ][ term ][ 'offset' ] = offset
+                block = np.empty( len( docids ), dtype = POSTING_DTYPE )
+                block[ 'docid' ] = np.frombuffer( docids, dtype = np.uint32 )
+                block[ 'freq' ] = np.frombuffer( freqs, dtype = np.uint32 )
 
-                ## we write out our postings list to our index file and then note the offset
-                for docid in sorted( self.postings[ term ].keys() ): 
+                scores = score_postings( weights, block[ 'freq' ], lengths[ block[ 'docid' ] ], len( block ), self.dictionary[ 'document_count' ], average_length )
+                self.dictionary[ 'dictionary' ][ term ][ 'max_score' ] = scores.max().item()
 
-                        ## get our docid and frequency
-                        freq = int( self.postings[ term ][ docid ] )
-                        docid = int( docid )
+                ## postings are collected and written in bulk rather than one small write per posting
+                terms.append( term )
+                blocks.append( block )
+                buffered = buffered + len( block )
 
-                        ## write postings list data
-                        file.write( docid.to_bytes( INDEX_ENTRY_SIZE, byteorder='big', signed=False ) )
-                        file.write( freq.to_bytes( INDEX_ENTRY_SIZE, byteorder='big', signed=False ) )
+                if buffered * POSTING_DTYPE.itemsize >= WRITE_BUFFER_SIZE:
+                    offset = self.write_postings_blocks( file, terms, blocks, offset, version )
+                    terms, blocks, buffered = [], [], 0
 
-                        ## note the offset, we advance it by eight bytes for each entry in the postings list
-                        offset = offset + INDEX_ENTRY_SIZE * 2
+            self.write_postings_blocks( file, terms, blocks, offset, version )
 
+        replace( index_file + '.tmp', index_file )
 
-    ## function to write our dictionary to a json file
+
+    ## function to write a batch of postings lists and note their offsets and lengths in the dictionary
+    ## arguments:
+    ##      - file: index file handle to write to
+    ##      - terms: terms of the postings lists, in index order
+    ##      - blocks: structured ( docid, freq ) array of each term
+    ##      - offset: position in the index file the batch starts at
+    ##      - version: the index format to write
+    def write_postings_blocks( self, file, terms, blocks, offset, version ):
+
+        if not terms:
+            return offset
+
+        if version == INDEX_FORMAT_FIXED:
+            lengths = [ block.nbytes for block in blocks ]
+            data = b''.join( block.tobytes() for block in blocks )
+
+        ## the compressed format stores each term as a block of docid gaps followed by a block of frequencies
+        elif version == INDEX_FORMAT_VBYTE:
+            values = np.concatenate( [ np.concatenate( ( np.diff( block[ 'docid' ].astype( np.uint64 ), prepend = np.uint64( 0 ) ), block[ 'freq' ] ) ) for block in blocks ] )
+            counts = np.array( [ len( block ) * 2 for block in blocks ], dtype = np.int64 )
+            lengths = np.add.reduceat( vbyte_lengths( values ), np.cumsum( counts ) - counts ).tolist()
+            data = vbyte_encode( values )
+
+        ## the blocked format stores each term as a skip table followed by the same codes, interleaved a block at a time
+        else:
+            values = []
+            for block in blocks:
+                gaps, freqs = block_positions( len( block ) )
+                interleaved = np.empty( 2 * len( block ), dtype = np.uint64 )
+                interleaved[ gaps ] = np.diff( block[ 'docid' ].astype( np.uint64 ), prepend = np.uint64( 0 ) )
+                interleaved[ freqs ] = block[ 'freq' ]
+                values.append( interleaved )
+
+            ## each block of a term starts 2 * INDEX_BLOCK_SIZE values after the one before it
+            counts = np.array( [ len( block ) for block in blocks ], dtype = np.int64 )
+            chunks = -( -counts // INDEX_BLOCK_SIZE )
+            firsts = np.arange( chunks.sum() ) - np.repeat( np.cumsum( chunks ) - chunks, chunks )
+            starts = np.repeat( 2 * ( np.cumsum( counts ) - counts ), chunks ) + 2 * INDEX_BLOCK_SIZE * firsts
+
+            values = np.concatenate( values )
+            block_lengths = np.add.reduceat( vbyte_lengths( values ), starts )
+            codes = vbyte_encode( values )
+
+            pieces, lengths, position, first = [], [], 0, 0
+            for block, chunk in zip( blocks, chunks.tolist() ):
+                skips = np.empty( chunk, dtype = SKIP_DTYPE )
+                skips[ 'last' ] = block[ 'docid' ][ np.minimum( np.arange( 1, chunk + 1 ) * INDEX_BLOCK_SIZE, len( block ) ) - 1 ]
+                skips[ 'end' ] = np.cumsum( block_lengths[ first : first + chunk ] )
+                size = skips[ 'end' ][ -1 ].item()
+                pieces.extend( ( skips.tobytes(), codes[ position : position + size ] ) )
+                lengths.append( skips.nbytes + size )
+                position, first = position + size, first + chunk
+
+            data = b''.join( pieces )
+
+        for term, length in zip( terms, lengths ):
+            self.dictionary[ 'dictionary' ][ term ][ 'offset' ] = offset
+            self.dictionary[ 'dictionary' ][ term ][ 'length' ] = length
+            offset = offset + length
+
+        file.write( data )
+
+        return offset
+
+
+    ## function to write our dictionary to a file
     ## arguments:
     ##      - dictionary_file: the name of the dictionary file we want to write to
-    def write_dictionary( self, dictionary_file ):
+    ##      - version: the dictionary format to write, either LEXICON_FORMAT_BINARY or the original LEXICON_FORMAT_JSON
+    def write_dictionary( self, dictionary_file, version = LEXICON_FORMAT_BINARY ):
+
+        if version == LEXICON_FORMAT_JSON:
+            with open( dictionary_file, 'w' ) as fh:
+                dump( { **self.dictionary, 'dictionary': dict( self.dictionary[ 'dictionary' ].items() ), 'document_lengths': self.document_lengths.tolist() }, fh )
+            return
+
+        if version != LEXICON_FORMAT_BINARY:
+            raise ValueError( f'Unsupported dictionary format {version}' )
+
+        ## terms are stored sorted, utf-8 preserves code point order so byte comparisons agree with this sort
+        entries = sorted( self.dictionary[ 'dictionary' ].items(), key = itemgetter( 0 ) )
+        strings = [ term.encode( 'utf-8' ) for term, _ in entries ]
+
+        metadata = { key: value for key, value in self.dictionary.items() if key != 'dictionary' }
+        metadata[ 'count' ] = len( entries )
+        metadata[ 'fields' ] = LEXICON_FIELDS
+        metadata[ 'documents' ] = len( self.document_lengths )
+        metadata = dumps( metadata ).encode( 'utf-8' )
+
+        string_offsets = np.zeros( len( strings ) + 1, dtype = '<u8' )
+        string_offsets[ 1 : ] = np.cumsum( [ len( string ) for string in strings ] )
+
+        with open( dictionary_file, 'wb' ) as fh:
+
+            fh.write( LEXICON_HEADER.pack( LEXICON_MAGIC, LEXICON_FORMAT_BINARY, len( metadata ) ) )
+            fh.write( metadata )
+            fh.write( bytes( lexicon_padding( LEXICON_HEADER.size + len( metadata ) ) ) )
+            fh.write( string_offsets.tobytes() )
+
+            for name, dtype in LEXICON_FIELDS:
+                values = np.array( [ entry.get( name, 0 ) for _, entry in entries ], dtype = dtype )
+                fh.write( values.tobytes() )
+                fh.write( bytes( lexicon_padding( values.nbytes ) ) )
+
+            lengths = np.array( self.document_lengths, dtype = '<u4' )
+            fh.write( lengths.tobytes() )
+            fh.write( bytes( lexicon_padding( lengths.nbytes ) ) )
 
-        with open( dictionary_file, 'w' ) as fh:
-            dump( self.dictionary, fh )
+            fh.write( b''.join( strings ) )
 
 
     ## function to retrieve term statistics from the dictionary
@@ -267,16 +1201,66 @@ class IRDictionary:
     ## arguments:
     ##      - index_file: path to index file, this should be a binary file
     def attach_index( self, index_file ):
+        self.release_reader()
         self.dictionary[ 'index_file' ] = index_file
 
 
-    ## function to load dictionary from a file
+    ## function to close the postings reader, the next lookup maps the attached index again
+    def release_reader( self ):
+
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+    ## function to get the postings reader of the attached index, the file is only mapped again once it is rewritten
+    def postings_reader( self ):
+
+        index_file = self.dictionary[ 'index_file' ]
+
+        if self.reader is not None:
+            status = stat( index_file )
+            if self.reader.signature != ( index_file, status.st_mtime_ns, status.st_size ):
+                self.release_reader()
+
+        if self.reader is None:
+            self.reader = IRPostingsReader( index_file )
+
+        return self.reader
+
+
+    ## function to fetch the postings of several terms at once from the attached index
     ## arguments:
-    ##      - dictionary_file: path to .json dictionary file to load
+    ##      - terms: iterable of terms to be fetched
+    def get_postings( self, terms ):
+
+        reader = self.postings_reader()
+        lexicon = self.dictionary[ 'dictionary' ]
+
+        return { term: reader.postings( lexicon.get( term ) ) for term in terms }
+
+
+    ## function to load dictionary from a file, binary dictionaries are memory-mapped rather than parsed
+    ## arguments:
+    ##      - dictionary_file: path to a binary or .json dictionary file to load
     def load_dictionary( self, dictionary_file ):
-        
+
+        with open( dictionary_file, 'rb' ) as fh:
+            magic = fh.read( len( LEXICON_MAGIC ) )
+
+        self.document_lengths = array( 'I' )
+
+        if magic == LEXICON_MAGIC:
+            lexicon = IRLexicon( dictionary_file )
+            self.dictionary = { key: value for key, value in lexicon.metadata.items() if key not in ( 'count', 'fields', 'documents' ) }
+            self.dictionary[ 'dictionary' ] = lexicon
+            self.document_lengths.frombytes( lexicon.document_lengths.astype( np.uint32 ).tobytes() )
+            return
+
         with open( dictionary_file, 'r' ) as fh:
             self.dictionary = load( fh )
+
+        self.document_lengths.extend( self.dictionary.pop( 'document_lengths', [] ) )
         
 
     ## remove all postings
@@ -284,49 +1268,673 @@ class IRDictionary:
         self.postings = {}
 
         
+    ## function to rank documents against a free text query, returns the top k ( docid, score ) pairs best first
+    ## documents are scored with the model in the dictionary weights and pruned with MaxScore using each term's upper bound
+    ## arguments:
+    ##      - query: free text query, processed the same way as the documents
+    ##      - k: number of documents to return
+    def search( self, query, k = 10 ):
+
+        weights = self.dictionary[ 'weights' ] or BM25_WEIGHTS
+        lexicon = self.dictionary[ 'dictionary' ]
+        lengths = np.frombuffer( self.document_lengths, dtype = np.uint32 )
+        average_length = self.dictionary[ 'collection_size' ] / max( self.dictionary[ 'document_count' ], 1 )
+
+        ## repeated query terms simply weigh more
+        query_terms = Counter( self.processor.tokenize_and_normalize( query ) )
+        reader = self.postings_reader()
+        terms = []
+
+        for term, weight in query_terms.items():
+
+            entry = lexicon.get( term )
+
+            if not entry or not entry[ 'document_frequency' ]:
+                continue
+
+            ## indexes written before upper bounds were stored fall back to the bound of the scored postings
+            score = self.term_scorer( entry[ 'document_frequency' ], weight, weights, lengths, average_length )
+            terms.append( IRQueryTerm( reader, entry, score, weight * entry[ 'max_score' ] if 'max_score' in entry else None ) )
+
+        return max_score( terms, k )
+
+
+    ## function to get a function scoring some postings of a term, so MaxScore only scores the postings it reaches
+    ## arguments:
+    ##      - df: document frequency of the term
+    ##      - weight: number of times the term is in the query
+    ##      - weights: scoring model and its parameters
+    ##      - lengths: length of each document
+    ##      - average_length: average document length
+    def term_scorer( self, df, weight, weights, lengths, average_length ):
+
+        def score( docids, freqs ):
+            return weight * score_postings( weights, freqs, lengths[ docids ], df, self.dictionary[ 'document_count' ], average_length )
+
+        return score
+
+
     ## function to retrieve postings list from an index file
     ## arguments:
     ##      - entry: IRDictionary entry of the term to be fetched
     def retrieve_postings_from_index_from_index( self, entry ):
 
-        postings = {}
-
         # if we have no entry, just return an empty list 
         if not entry:
-            return postings
+            return {}
 
-        # we open our index file and fetch our tuples starting at the offset in the dictionary
-        with open( self.dictionary[ 'index_file' ], 'rb' ) as idx:
+        postings = self.postings_reader().postings( entry )
 
-            # advance read to the offset place
-            idx.read( entry[ 'offset' ] )
+        return dict( zip( map( str, postings[ 'docid' ].tolist() ), postings[ 'freq' ].tolist() ) )
 
-            # get the postings, which we can calculate as being =  {doc count} * {size of posting entry} * 2
-            size = entry[ 'document_frequency' ] * INDEX_ENTRY_SIZE * 2
-            content = idx.read( size )
 
-            # iterate over contents
-            for i in range( 0, size, INDEX_ENTRY_SIZE * 2 ):             
-                docid = int.from_bytes( content[ i : i + INDEX_ENTRY_SIZE ], byteorder = 'big', signed = False )
-                freq = int.from_bytes( content[ i + INDEX_ENTRY_SIZE : i + INDEX_ENTRY_SIZE * 2 ], byteorder = 'big', signed = False )
-                postings[ str( docid ) ] = freq
+            
+## on-disk cache of fetched pages keyed by a hash of their url, least recently used pages are evicted past a size limit
+## each page is kept as a body file and a json file holding its ETag and Last-Modified validators
+class ResponseCache:
 
-        return postings
+    ## constructor for cache
+    ## arguments:
+    ##      - directory: directory the cached pages are kept in
+    ##      - max_size: maximum number of bytes of page bodies to keep
+    ##      - offline: if set, pages are only ever served from the cache
+    def __init__( self, directory, max_size = CACHE_MAX_SIZE, offline = False ):
+
+        self.directory = directory
+        self.max_size = max_size
+        self.offline = offline
+        self.lock = Lock()
+
+        makedirs( directory, exist_ok = True )
+
+        ## we pick up whatever earlier runs left behind, the modification time of a body is when it was last used
+        used = []
+        for root, _, files in walk( directory ):
+            for name in files:
+                if name.endswith( '.body' ):
+                    try:
+                        status = stat( join( root, name ) )
+                    except FileNotFoundError:
+                        continue
+                    used.append( ( status.st_mtime, name[ : -5 ], status.st_size ) )
+
+        ## size of each page by key, least recently used first, and the running total of their sizes
+        self.sizes = OrderedDict( ( key, size ) for _, key, size in sorted( used ) )
+        self.size = sum( self.sizes.values() )
+
+
+    ## function to get the path of a cached page without its extension
+    ## arguments:
+    ##      - key: hash of the page url
+    def path( self, key ):
+        return join( self.directory, key[ : 2 ], key )
+
+
+    ## function to fetch a cached page as a dictionary with its body and validators, returns None on a miss
+    ## arguments:
+    ##      - url: url of the page
+    def lookup( self, url ):
+
+        key = sha256( url.encode( 'utf-8' ) ).hexdigest()
+        path = self.path( key )
+
+        try:
+            with open( f'{path}.json', 'r' ) as fh:
+                entry = load( fh )
+            with open( f'{path}.body', 'rb' ) as fh:
+                entry[ 'body' ] = fh.read()
+
+            ## the modification time of the body keeps the order pages were used in for later runs
+            utime( f'{path}.body' )
+
+        except FileNotFoundError:
+            return None
+
+        with self.lock:
+            if key in self.sizes:
+                self.sizes.move_to_end( key )
+
+        return entry
+
+
+    ## function to store a page in the cache
+    ## arguments:
+    ##      - url: url of the page
+    ##      - body: body of the page as bytes
+    ##      - etag: ETag header of the response, if any
+    ##      - last_modified: Last-Modified header of the response, if any
+    def store( self, url, body, etag = None, last_modified = None ):
+
+        key = sha256( url.encode( 'utf-8' ) ).hexdigest()
+        path = self.path( key )
+        makedirs( dirname( path ), exist_ok = True )
+
+        ## files are written aside and moved into place so a reader never sees half a page
+        suffix = f'.{get_ident()}.tmp'
+        with open( f'{path}.body{suffix}', 'wb' ) as fh:
+            fh.write( body )
+        with open( f'{path}.json{suffix}', 'w' ) as fh:
+            dump( { 'url': url, 'etag': etag, 'last_modified': last_modified }, fh )
+
+        replace( f'{path}.json{suffix}', f'{path}.json' )
+        replace( f'{path}.body{suffix}', f'{path}.body' )
+
+        with self.lock:
+            self.size = self.size - self.sizes.pop( key, 0 ) + len( body )
+            self.sizes[ key ] = len( body )
+            self.evict()
+
+
+    ## function to remove the least recently used pages until the cache fits in its size limit, pages already gone are skipped
+    def evict( self ):
+
+        while self.size > self.max_size and self.sizes:
+
+            key, size = self.sizes.popitem( last = False )
+            self.size = self.size - size
+
+            for extension in ( 'body', 'json' ):
+                try:
+                    remove( f'{self.path( key )}.{extension}' )
+                except FileNotFoundError:
+                    pass
+
+
+## append-only jsonl journal of crawled records, so an interrupted crawl can resume and later crawls only fetch new records
+class CrawlJournal:
+
+    ## constructor for journal, records already in the file are loaded
+    ## arguments:
+    ##      - filename: path to the journal file
+    def __init__( self, filename ):
+
+        self.filename = filename
+        self.entries = OrderedDict()
+        line = '\n'
+
+        try:
+            with open( filename, 'r', encoding = 'utf-8' ) as fh:
+                for line in fh:
+
+                    ## a crawl killed mid-write can leave a partial last line, that record is simply fetched again
+                    try:
+                        entry = loads( line )
+                    except ValueError:
+                        continue
+
+                    self.entries[ entry[ 'record' ] ] = entry[ 'data' ]
+
+        except FileNotFoundError:
+            pass
+
+        self.handle = open( filename, 'a', encoding = 'utf-8' )
+
+        ## we make sure new records start on a line of their own
+        if not line.endswith( '\n' ):
+            self.handle.write( '\n' )
+
+
+    ## function to check if a record is already in the journal
+    ## arguments:
+    ##      - record: id of the record
+    def __contains__( self, record ):
+        return record in self.entries
+
+
+    ## function to add a record to the journal, it is written out straight away
+    ## arguments:
+    ##      - record: id of the record
+    ##      - data: json serializable data of the record
+    def append( self, record, data ):
+
+        self.handle.write( dumps( { 'record': record, 'data': data } ) + '\n' )
+        self.handle.flush()
+        self.entries[ record ] = data
+
+
+    ## function to close the journal file
+    def close( self ):
+        self.handle.close()
+
+
+## fetches web pages over pooled keep-alive connections, with a per-host rate limit and retries with backoff
+class Fetcher:
+
+    ## constructor for fetcher
+    ## arguments:
+    ##      - concurrency: maximum number of requests in flight at once
+    ##      - rate: maximum number of requests per second to a single host
+    ##      - retries: number of times a failed request is retried
+    ##      - backoff: seconds to wait before the first retry, doubled for each retry after that
+    ##      - timeout: seconds to wait on a connection before giving up
+    ##      - cache: optional ResponseCache pages are revalidated against and stored in
+    def __init__( self, concurrency = FETCH_CONCURRENCY, rate = FETCH_RATE, retries = FETCH_RETRIES, backoff = FETCH_BACKOFF, timeout = FETCH_TIMEOUT, cache = None ):
+        self.cache = cache
+        self.concurrency = concurrency
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.lock = Lock()
+        self.slots = {}
+        self.local = local()
+        self.pool = None
+
+
+    ## function to get this thread's keep-alive connection to a host, connections are reused across requests
+    ## arguments:
+    ##      - scheme: http or https
+    ##      - host: host and optional port to connect to
+    def connection( self, scheme, host ):
+
+        if not hasattr( self.local, 'connections' ):
+            self.local.connections = {}
+
+        key = ( scheme, host )
+        if key not in self.local.connections:
+            factory = HTTPSConnection if scheme == 'https' else HTTPConnection
+            self.local.connections[ key ] = factory( host, timeout = self.timeout )
+
+        return self.local.connections[ key ]
+
+
+    ## function to drop this thread's connection to a host after a failure
+    ## arguments:
+    ##      - scheme: http or https
+    ##      - host: host and optional port of the connection
+    def discard( self, scheme, host ):
+
+        connection = self.local.connections.pop( ( scheme, host ), None )
+        if connection is not None:
+            connection.close()
+
+
+    ## function to wait for our turn to send a request to a host
+    ## arguments:
+    ##      - host: host the request is going to
+    def throttle( self, host ):
+
+        if not self.rate:
+            return
+
+        ## each request reserves the next free slot for its host
+        with self.lock:
+            now = monotonic()
+            slot = max( now, self.slots.get( host, now ) )
+            self.slots[ host ] = slot + 1 / self.rate
+
+        if slot > now:
+            sleep( slot - now )
+
+
+    ## function to fetch a single page, following redirects
+    ## arguments:
+    ##      - url: url to be fetched
+    def fetch( self, url ):
+
+        for attempt in range( self.retries + 1 ):
+
+            try:
+                return self.request( url ).decode( 'utf-8' )
+
+            ## client errors will not go away by retrying
+            except HTTPError as e:
+                if attempt == self.retries or ( e.code < 500 and e.code != 429 ):
+                    raise
+
+            except ( HTTPException, OSError ):
+                if attempt == self.retries:
+                    raise
+
+            if DEBUG > 0:
+                print( f'... Retrying {url} (attempt {attempt + 2} of {self.retries + 1})' )
+
+            sleep( self.backoff * 2 ** attempt )
+
+
+    ## function to send a single request over a pooled connection, returns the body as bytes
+    ## cached pages are revalidated with a conditional request and served from the cache when unchanged
+    ## arguments:
+    ##      - url: url to be fetched
+    ##      - redirects: number of redirects still allowed
+    def request( self, url, redirects = FETCH_REDIRECTS ):
+
+        cached = self.cache.lookup( url ) if self.cache is not None else None
+
+        ## in offline mode we never touch the network
+        if self.cache is not None and self.cache.offline:
+            if cached is None:
+                raise LookupError( f'{url} is not in the cache' )
+            return cached[ 'body' ]
+
+        parts = urlsplit( url )
+        path = urlunsplit( ( '', '', parts.path or '/', parts.query, '' ) )
+        headers = { 'Connection': 'keep-alive', 'User-Agent': FETCH_USER_AGENT }
+
+        if cached is not None and cached[ 'etag' ]:
+            headers[ 'If-None-Match' ] = cached[ 'etag' ]
+        if cached is not None and cached[ 'last_modified' ]:
+            headers[ 'If-Modified-Since' ] = cached[ 'last_modified' ]
+
+        self.throttle( parts.netloc )
+        connection = self.connection( parts.scheme, parts.netloc )
+
+        try:
+            connection.request( 'GET', path, headers = headers )
+            response = connection.getresponse()
+            contents = response.read()
+        except ( HTTPException, OSError ):
+            self.discard( parts.scheme, parts.netloc )
+            raise
+
+        if response.will_close:
+            self.discard( parts.scheme, parts.netloc )
+
+        if response.status == 304 and cached is not None:
+            return cached[ 'body' ]
+
+        ## redirected pages are also cached under the url we asked for so offline runs can find them
+        if response.status in ( 301, 302, 303, 307, 308 ) and redirects > 0:
+            contents = self.request( urljoin( url, response.getheader( 'Location' ) ), redirects - 1 )
+            if self.cache is not None:
+                self.cache.store( url, contents )
+            return contents
+
+        ## only successes are cached, a 304 without a cached page, a redirect past the limit and errors are raised instead
+        if not 200 <= response.status < 300:
+            raise HTTPError( url, response.status, response.reason, response.headers, None )
+
+        if self.cache is not None:
+            self.cache.store( url, contents, response.getheader( 'ETag' ), response.getheader( 'Last-Modified' ) )
+
+        return contents
+
+
+    ## function to fetch many pages concurrently, results are yielded as ( url, contents ) in the order of the urls
+    ## arguments:
+    ##      - urls: urls to be fetched
+    def fetch_all( self, urls ):
+
+        urls = list( urls )
+
+        ## the worker threads are kept between calls so their connections stay open
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor( max_workers = self.concurrency )
+
+        yield from zip( urls, self.pool.map( self.fetch, urls ) )
 
 
-            
 ## scrapes a website for documents
 ## args:
 ##      - url: url to be scraped
 def download( url ):
 
-    ## get the website address
-    contents = ""
-    with urlopen( url ) as handle:
-        contents = handle.read().decode( 'utf-8' )
-    
-    ## scrape the contents with regex
-    return contents
+    ## pages are fetched over a shared pool of keep-alive connections
+    return DEFAULT_FETCHER.fetch( url )
+
+
+## function to stream the members of a top level json object as ( key, value ) pairs without loading the whole file
+## only one member is held in memory at a time, so memory does not grow with the size of the file
+## arguments:
+##      - fh: text file handle positioned at the start of a json object
+##      - chunk_size: number of characters read at a time
+def iter_json_items( fh, chunk_size = JSON_CHUNK_SIZE ):
+
+    decoder = JSONDecoder()
+    buffer, position, eof = '', 0, False
+    expected, key = '{', None
+
+    while True:
+
+        ## skip whitespace, reading more when we run out of buffer
+        while position < len( buffer ) and buffer[ position ] in ' \t\r\n':
+            position = position + 1
+
+        if position == len( buffer ):
+            if eof:
+                raise ValueError( 'Unexpected end of json object' )
+            chunk = fh.read( chunk_size )
+            buffer, position, eof = buffer[ position : ] + chunk, 0, not chunk
+            continue
+
+        ## the object closes after a member, or straight away if it is empty
+        if buffer[ position ] == '}' and ( expected == ',' or ( expected == 'key' and key is None ) ):
+            return
+
+        ## punctuation between members
+        if expected in ( '{', ':', ',' ):
+            if buffer[ position ] != expected:
+                raise ValueError( f"Expected '{expected}' in json object, found '{buffer[ position ]}'" )
+            position = position + 1
+            expected = { '{': 'key', ':': 'value', ',': 'key' }[ expected ]
+            continue
+
+        ## keys and values are decoded whole, if one runs off the end of the buffer we read more and try again
+        try:
+            item, end = decoder.raw_decode( buffer, position )
+        except JSONDecodeError:
+            item, end = None, None
+
+        if end is None or ( end == len( buffer ) and not eof ):
+            if eof:
+                raise ValueError( 'Malformed json object' )
+            chunk = fh.read( chunk_size )
+            buffer, position, eof = buffer[ position : ] + chunk, 0, not chunk
+            continue
+
+        position = end
+
+        if expected == 'key':
+            key, expected = item, ':'
+        else:
+            yield key, item
+            expected = ','
+
+            ## we drop what has been consumed so the buffer stays small
+            buffer, position = buffer[ position : ], 0
+
+
+## function to write ( key, value ) pairs as a json object, formatted the same as json.dumps( ..., indent = 4 )
+## arguments:
+##      - items: iterable of ( key, value ) pairs
+##      - fh: text file handle to write to
+def dump_json_items( items, fh ):
+
+    separator = '{\n'
+
+    for key, value in items:
+        fh.write( f"{separator}    {dumps( key )}: {dumps( value, indent = 4 ).replace( chr( 10 ), chr( 10 ) + '    ' )}" )
+        separator = ',\n'
+
+    fh.write( '{}' if separator == '{\n' else '\n}' )
+
+
+## class to time the phases of a run, each phase is printed as it finishes and the totals reported at the end
+class PhaseTimer:
+
+    ## constructor for timer
+    def __init__( self ):
+        self.timings = OrderedDict()
+
+
+    ## function to time a phase, used as a context manager, time spent in a phase of the same name adds up
+    ## arguments:
+    ##      - name: name of the phase
+    @contextmanager
+    def phase( self, name ):
+
+        start = perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            self.add( name, elapsed )
+
+            if DEBUG:
+                print( f'... {name} took {elapsed:.2f}s' )
+
+
+    ## function to add time measured elsewhere, such as in a worker process, to a phase
+    ## arguments:
+    ##      - name: name of the phase
+    ##      - seconds: time to add
+    def add( self, name, seconds ):
+
+        self.timings[ name ] = self.timings.get( name, 0 ) + seconds
+
+
+    ## function to print the time spent in each phase
+    def report( self ):
+
+        for name, seconds in self.timings.items():
+            print( f'{name:<30} {seconds:>8.2f}s' )
+
+        print( f'{"total":<30} {sum( self.timings.values() ):>8.2f}s' )
+
+
+## function to switch a sqlite connection into bulk load mode and open the transaction the whole load runs in
+## durability is traded for speed, which is fine for a database that is rebuilt from scratch
+## arguments:
+##      - db: sqlite connection, outside of any transaction
+##      - journal_mode: journal mode during the load, WAL or OFF
+##      - synchronous: sync setting during the load
+##      - cache_size: page cache size, negative values are in KiB
+def begin_bulk_load( db, journal_mode = BULK_JOURNAL_MODE, synchronous = BULK_SYNCHRONOUS, cache_size = BULK_CACHE_SIZE ):
+
+    db.execute( f'PRAGMA journal_mode = {journal_mode}' )
+    db.execute( f'PRAGMA synchronous = {synchronous}' )
+    db.execute( f'PRAGMA cache_size = {cache_size}' )
+    db.execute( 'BEGIN' )
+
+
+## function to commit a bulk load and put the connection back to its default, durable settings
+## arguments:
+##      - db: sqlite connection in bulk load mode
+def end_bulk_load( db ):
+
+    db.commit()
+    db.execute( f'PRAGMA journal_mode = {DEFAULT_JOURNAL_MODE}' )
+    db.execute( f'PRAGMA synchronous = {DEFAULT_SYNCHRONOUS}' )
+
+
+## function to get the sha256 hex digest of a file, read in chunks so large files are not loaded whole
+## arguments:
+##      - filename: file to hash
+def file_digest( filename ):
+
+    digest = sha256()
+
+    with open( filename, 'rb' ) as fh:
+        for chunk in iter( lambda: fh.read( WRITE_BUFFER_SIZE ), b'' ):
+            digest.update( chunk )
+
+    return digest.hexdigest()
+
+
+## class to record which source files each year of a table was loaded from, so unchanged years are not loaded again
+## the manifest lives in the database it describes, so it is committed or rolled back with the data
+class LoadManifest:
+
+    ## constructor for manifest
+    ## arguments:
+    ##      - db: sqlite connection
+    ##      - dataset: name of the data the entries belong to, usually a table
+    def __init__( self, db, dataset ):
+        self.db = db
+        self.dataset = dataset
+
+        self.db.execute( '''
+            CREATE TABLE IF NOT EXISTS LOAD_MANIFEST
+            (
+                DATASET TEXT
+                , YEAR TEXT
+                , FILENAME TEXT
+                , HASH TEXT
+                , MTIME REAL
+                , SIZE INT
+                , PRIMARY KEY( DATASET, YEAR )
+            )
+        ''' )
+
+
+    ## function to check if a year's source file differs from the one last loaded, returns ( changed, digest )
+    ## the file is only hashed when its size or modification time moved, a touched but identical file is not reloaded
+    ## arguments:
+    ##      - year: year the file holds
+    ##      - filename: source file of the year
+    def check( self, year, filename ):
+
+        info = stat( filename )
+        row = self.db.execute( '''
+            SELECT FILENAME, HASH, MTIME, SIZE FROM LOAD_MANIFEST WHERE DATASET = ? AND YEAR = ?
+        ''', ( self.dataset, str( year ) ) ).fetchone()
+
+        if row and row[ 0 ] == filename and row[ 2 ] == info.st_mtime and row[ 3 ] == info.st_size:
+            return False, row[ 1 ]
+
+        digest = file_digest( filename )
+
+        if row and row[ 0 ] == filename and row[ 1 ] == digest:
+            self.record( year, digest, filename )
+            return False, digest
+
+        return True, digest
+
+
+    ## function to record the source a year was loaded from
+    ## arguments:
+    ##      - year: year that was loaded
+    ##      - digest: hash of what was loaded
+    ##      - filename: optional source file, its size and modification time are kept for the next check
+    def record( self, year, digest, filename = None ):
+
+        info = stat( filename ) if filename else None
+        self.db.execute( '''
+            INSERT OR REPLACE INTO LOAD_MANIFEST ( DATASET, YEAR, FILENAME, HASH, MTIME, SIZE )
+            VALUES ( ?, ?, ?, ?, ?, ? )
+        ''', ( self.dataset, str( year ), filename, digest, info and info.st_mtime, info and info.st_size ) )
+
+
+    ## function to get the recorded hash of a year, or None if it was never loaded
+    ## arguments:
+    ##      - year: year to look up
+    def digest( self, year = '' ):
+
+        row = self.db.execute( '''
+            SELECT HASH FROM LOAD_MANIFEST WHERE DATASET = ? AND YEAR = ?
+        ''', ( self.dataset, str( year ) ) ).fetchone()
+
+        return row[ 0 ] if row else None
+
+
+    ## function to get the years recorded for the dataset
+    def years( self ):
+
+        return [ row[ 0 ] for row in self.db.execute( '''
+            SELECT YEAR FROM LOAD_MANIFEST WHERE DATASET = ? ORDER BY YEAR
+        ''', ( self.dataset, ) ) ]
+
+
+    ## function to forget a year, or every year when none is given
+    ## arguments:
+    ##      - year: year to forget
+    def remove( self, year = None ):
+
+        if year is None:
+            self.db.execute( '''DELETE FROM LOAD_MANIFEST WHERE DATASET = ?''', ( self.dataset, ) )
+        else:
+            self.db.execute( '''DELETE FROM LOAD_MANIFEST WHERE DATASET = ? AND YEAR = ?''', ( self.dataset, str( year ) ) )
+
+
+    ## function to get a single hash of everything recorded for the dataset, it changes whenever any year does
+    def signature( self ):
+
+        rows = self.db.execute( '''
+            SELECT YEAR, HASH FROM LOAD_MANIFEST WHERE DATASET = ? ORDER BY YEAR
+        ''', ( self.dataset, ) )
+
+        return sha256( dumps( rows.fetchall() ).encode( 'utf-8' ) ).hexdigest()
 
 
 ## unpacks a query to a base url
@@ -341,3 +1949,7 @@ def unpack( base, q = [] ):
 
     ## bind the baseurl and the query
     return base
+
+
+## the fetcher shared by calls to download
+DEFAULT_FETCHER = Fetcher()